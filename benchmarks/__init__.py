@@ -0,0 +1 @@
+"""Seeded benchmarks of the engine hot paths, run with `python -m benchmarks` from the game folder."""
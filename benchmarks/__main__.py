@@ -0,0 +1,105 @@
+import os, sys, gc, json, argparse
+from time import perf_counter
+import numpy as np
+
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+DEFAULT_PARAMS = {'seed': 1, 'length': 100, 'enemies': 20, 'sparks': 1000}
+
+
+def run_workload(game, setup, params, iterations, warmup=5):
+    step = setup(game, params)
+    for _ in range(warmup):
+        step()
+    gc.collect()
+    times = np.empty(iterations)
+    for i in range(iterations):
+        start = perf_counter()
+        step()
+        times[i] = perf_counter() - start
+    times *= 1000
+    return {'median': float(np.median(times)), 'p95': float(np.percentile(times, 95)), 'min': float(times.min()), 'iterations': iterations}
+
+
+def compare(results, baseline, threshold):
+    # prints one line per workload, returns the names that got slower than the baseline by more than threshold.
+    regressions = []
+    print('%-18s %10s %10s %10s %8s' % ('workload', 'median ms', 'p95 ms', 'baseline', 'change'))
+    for name, result in results.items():
+        base = baseline.get(name)
+        line = '%-18s %10.3f %10.3f' % (name, result['median'], result['p95'])
+        if base:
+            change = result['median'] / base['median'] - 1
+            line += ' %10.3f %+7.1f%%' % (base['median'], change * 100)
+            if change > threshold:
+                line += '  REGRESSION'
+                regressions.append(name)
+        print(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Purplish engine benchmarks')
+    parser.add_argument('workloads', nargs='*', help='workloads to run, all by default')
+    parser.add_argument('--seed', type=int, default=DEFAULT_PARAMS['seed'])
+    parser.add_argument('--scale', type=float, default=1, help='multiplies map length, enemy count and spark count')
+    parser.add_argument('--length', type=int, default=None, help='map length in noise samples (default %d)' % DEFAULT_PARAMS['length'])
+    parser.add_argument('--enemies', type=int, default=None, help='enemy count (default %d)' % DEFAULT_PARAMS['enemies'])
+    parser.add_argument('--sparks', type=int, default=None, help='live spark count (default %d)' % DEFAULT_PARAMS['sparks'])
+    parser.add_argument('--iterations', type=int, default=None, help='timed steps per workload, overrides the per-workload default')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='baseline json to compare against')
+    parser.add_argument('--save', action='store_true', help='store the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.1, help='median slowdown reported as a regression (default 0.1 = 10%%)')
+    parser.add_argument('--list', action='store_true', help='list the workloads and exit')
+    args = parser.parse_args()
+
+    # assets and saves are found relative to the working directory, like when running mgame.py.
+    os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    sys.path.insert(0, os.getcwd())
+    from mgame import Game
+    from benchmarks.workloads import WORKLOADS
+
+    if args.list:
+        print('\n'.join(WORKLOADS))
+        return 0
+    unknown = [name for name in args.workloads if name not in WORKLOADS]
+    if unknown:
+        parser.error('unknown workloads: %s' % ', '.join(unknown))
+
+    params = {'seed': args.seed}
+    for key in ('length', 'enemies', 'sparks'):
+        value = getattr(args, key)
+        params[key] = value if value is not None else max(int(DEFAULT_PARAMS[key] * args.scale), 1)
+
+    game = Game(headless=True, seed=args.seed)
+    # the first map is prepared in the background, that is not part of any workload.
+    game.map_preloader.wait()
+    results = {}
+    for name in args.workloads or WORKLOADS:
+        setup, iterations = WORKLOADS[name]
+        results[name] = run_workload(game, setup, params, args.iterations or iterations)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as f:
+            stored = json.load(f)
+        if stored['params'] == params:
+            baseline = stored['results']
+        else:
+            print('baseline was recorded with %s, not comparing' % stored['params'])
+    print('params: %s' % params)
+    regressions = compare(results, baseline, args.threshold)
+
+    if args.save:
+        if os.path.exists(args.baseline) and baseline:
+            # keep the baseline of workloads that were not run this time.
+            baseline.update(results)
+            results = baseline
+        with open(args.baseline, 'w') as f:
+            json.dump({'params': params, 'results': results}, f, indent=2)
+        print('saved baseline to %s' % args.baseline)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
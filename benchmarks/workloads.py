@@ -0,0 +1,188 @@
+import math
+import pygame as pg
+from pygame import Vector2 as Vec
+from scripts.tilemap import Tilemap
+from scripts.map_generator import RandomMapGenerator
+from scripts.entities import SlimeGreen, SlimeYellow, SlimeRed, update_enemy_sight
+from scripts.menus import Hud
+
+
+WORKLOADS = {}
+
+
+def workload(name, iterations=200):
+    # setup(game, params) builds the state and returns the step that gets timed.
+    def register(setup):
+        WORKLOADS[name] = (setup, iterations)
+        return setup
+    return register
+
+
+def new_map(game, params):
+    game.rng.seed(params['seed'])
+    game.tilemap = Tilemap(game)
+    RandomMapGenerator(game, params['length']).generate_random_map()
+    game.tilemap.bake()
+
+
+def populate(game, params):
+    # a generated map with params['enemies'] enemies spread over its enemy spawnpoints, ready to play.
+    new_map(game, params)
+    game.initialize_player()
+    game.stage_no = 6
+    game.set_map_data()
+    spawns = [Vec(enemy.pos) for enemy in game.enemies] or [Vec(game.player.pos)]
+    game.enemies.empty()
+    enemy_types = [(SlimeGreen, 4, game.enemy_slg_anims), (SlimeYellow, 5, game.enemy_sly_anims), (SlimeRed, 6, game.enemy_slr_anims)]
+    for i in range(params['enemies']):
+        enemy_cls, variant, anims = enemy_types[i % len(enemy_types)]
+        pos = spawns[i % len(spawns)]
+        game.enemies.add(enemy_cls(game, variant, (pos.x + game.rng.randint(-32, 32), pos.y), (24, 32), anims))
+    game.sparks.empty()
+    game.projectiles.empty()
+    game.particles.empty()
+    game.loot.empty()
+    game.hud = Hud(game)
+    game.main_screen = False
+    game.main_menu = False
+    game.playing = True
+    game.scroll_offset = Vec(game.player.pos) - Vec(game.display.get_size()) / 2
+
+
+@workload('map_generation', 10)
+def map_generation(game, params):
+    return lambda: new_map(game, params)
+
+
+@workload('collision')
+def collision(game, params):
+    # the swept tile collision every physics entity runs twice per tick.
+    populate(game, params)
+    grid = game.tilemap.get_collision_grid()
+    bodies = [(Vec(enemy.pos), enemy.size) for enemy in game.enemies]
+    steps = [(3, 4), (-3, 4), (3, -4), (-3, -4)]
+
+    def step():
+        for start, size in bodies:
+            pos = Vec(start)
+            for dx, dy in steps:
+                grid.move_x(pos, size, dx)
+                grid.move_y(pos, size, dy)
+    return step
+
+
+@workload('tilemap_render')
+def tilemap_render(game, params):
+    # pans the camera over the whole map.
+    populate(game, params)
+    right, left, bottom = game.tilemap.get_map_edges()
+    width = max(right - left, 1)
+    offsets = [Vec(left + (i * 37) % width, bottom - 200 - (i * 11) % 120) for i in range(100)]
+    state = [0]
+
+    def step():
+        game.tilemap.render(game.display, offsets[state[0] % len(offsets)])
+        state[0] += 1
+    return step
+
+
+@workload('enemy_visibility')
+def enemy_visibility(game, params):
+    populate(game, params)
+    player_rects = [pg.Rect(enemy.pos.x + dx, enemy.pos.y - 24, 12, 16) for enemy in game.enemies for dx in (-96, 96)]
+    enemies = list(game.enemies)
+
+    def step():
+        for enemy in enemies:
+            for rect in player_rects[:16]:
+                enemy.check_visibility(game.tilemap, rect)
+    return step
+
+
+@workload('enemies_update')
+def enemies_update(game, params):
+    populate(game, params)
+    # activation zones around the camera, like Game.update_frame sets them.
+    game.enemies.set_active_area(pg.Rect(game.scroll_offset, game.display.get_size()))
+
+    def step():
+        update_enemy_sight(game.enemies, game.tilemap, game.player.rect)
+        game.enemies.update(game.tilemap)
+    return step
+
+
+@workload('sprites_draw')
+def sprites_draw(game, params):
+    populate(game, params)
+
+    def step():
+        offset = game.scroll_offset
+        game.chests.draw(game.display, offset)
+        game.portals.draw(game.display, offset)
+        game.enemies.render(game.display, offset)
+        game.players.render(game.display, offset)
+    return step
+
+
+@workload('sparks')
+def sparks(game, params):
+    # keeps params['sparks'] sparks alive, updated and drawn every step.
+    populate(game, params)
+    center = Vec(game.player.pos)
+    state = [0]
+
+    def step():
+        missing = params['sparks'] - len(game.sparks)
+        for i in range(missing):
+            state[0] += 1
+            kind = state[0] % 3
+            angle = (state[0] * 0.618) % 1 * math.pi * 2
+            if kind == 0:
+                game.sparks.add(center, angle, 2, (255, 255, 255))
+            elif kind == 1:
+                game.sparks.add_aether(center, angle, 2)
+            else:
+                game.sparks.add_health(center, angle, 2)
+        game.sparks.update(game)
+        game.sparks.render(game.display, game.scroll_offset)
+    return step
+
+
+@workload('hud')
+def hud(game, params):
+    populate(game, params)
+    state = [0]
+
+    def step():
+        # changing stats so the bars are rebuilt like they are in play.
+        state[0] += 1
+        game.player.health = 1 + state[0] % game.player.max_health
+        game.hud.update(game)
+        game.hud.render(game.display)
+    return step
+
+
+@workload('state_snapshot')
+def state_snapshot(game, params):
+    # a quicksave and going back to it, with a fight going on.
+    populate(game, params)
+    for i in range(120):
+        game.tick()
+    data = game.snapshot_state()
+
+    def step():
+        game.snapshot_state()
+        game.restore_state(data)
+    return step
+
+
+@workload('frame')
+def frame(game, params):
+    # one full tick, render and present of the game loop.
+    populate(game, params)
+
+    def step():
+        game.tick()
+        game.render_frame(game.scroll_offset)
+        game.present_frame()
+    return step
@@ -1,6 +1,6 @@
 import pygame as pg
 from pygame import Vector2 as Vec
-import sys, os, math
+import sys, os, math, argparse, random, copy
 from scripts.utils import *
 from scripts.gameutils import *
 from scripts.menus import MainMenu, OptionsMenu, HelpMenu, PauseMenu, Hud, GameOver, StatsMenu
@@ -8,24 +8,53 @@ from scripts.stars import Stars
 from scripts.tilemap import Tilemap
 from scripts.entities import *
 from scripts.particle import *
-from scripts.map_generator import RandomMapGenerator
+from scripts.map_generator import MapPreloader, GENERATOR_VERSION
+from scripts.mapfile import is_map_delta, read_map_delta
 from scripts.soundmanager import MusicManager, SfxManager
+from scripts.replay import InputRecorder, Replay
+from scripts.profiler import FrameProfiler
+from scripts.savewriter import SaveWriter
+from scripts.gamestate import snapshot_game, restore_game
 
 
 SCREEN_RES = (960, 720)
 DISPLAY_RES = (320, 240)
+# simulation ticks per second, independent of the render frame rate.
+TICK_RATE = 60
+TICK_TIME = 1 / TICK_RATE
+# after a long stall the simulation drops time instead of running this many ticks in one frame.
+MAX_TICKS_PER_FRAME = 5
 SCALE_RATIO = DISPLAY_RES[0] / SCREEN_RES[0]
+# px around the camera, enemies wake up inside the first and go dormant outside the second.
+ENEMY_WAKE_MARGIN = 160
+ENEMY_SLEEP_MARGIN = 224
 ASSETS_DIR = os.path.join(os.getcwd(), 'assets')
 IMAGES_DIR = os.path.join(ASSETS_DIR, 'images')
 SOUNDS_DIR = os.path.join(ASSETS_DIR, 'audio')
 SAVES_DIR = os.path.join(os.getcwd(), 'savegames')
 LOCALIZATION = os.path.join(ASSETS_DIR, 'localization.json')
-SAVE_MAP_NAME = 'map_47.json'
+SAVE_MAP_NAME = 'map_47.map'
+LEGACY_SAVE_MAP_NAME = 'map_47.json'
 SAVE_DATA_NAME = 'savegame.json'
 
 
 class Game:
-    def __init__(self):
+    def __init__(self, headless=False, seed=None, interpolate=False):
+        if headless:
+            # no window or audio device needed, e.g. for simulation and benchmark runs.
+            os.environ['SDL_VIDEODRIVER'] = 'dummy'
+            os.environ['SDL_AUDIODRIVER'] = 'dummy'
+        self.headless = headless
+        # every random draw of a run comes from here, so a seed reproduces the run.
+        self.seed = seed if seed is not None else random.randrange(1 << 32)
+        self.rng = random.Random(self.seed)
+        # draw sprites between their last two tick positions.
+        self.interpolate = interpolate
+        self.tick_count = 0
+        self.input_script = None
+        self.recorder = None
+        # replays press start on the tick the recorded session did.
+        self.start_game_tick = None
         pg.init()
         pg.display.set_caption("Purplish")
         # set final screen
@@ -46,20 +75,27 @@ class Game:
         self.enemy_sly_anims = get_animations(IMAGES_DIR, 'enemy_sl_y', ('idle', 20, True), ('run', 10, True), ('attack', 5, False), ('hurt', 30, False), ('die', 2, False))
         self.enemy_slr_anims = get_animations(IMAGES_DIR, 'enemy_sl_r', ('idle', 20, True), ('run', 10, True), ('jump', 5, False), ('attack_a', 3, False), ('attack_b', 5, False), ('hurt', 30, False), ('die', 2, False))
         self.portal_anims = get_animations(IMAGES_DIR, 'portal', ('idle', 15, True))
-        self.particle_anims = get_animations(IMAGES_DIR, 'particles', ('dash', 6, False), ('splash', 5, False))
+        self.particle_anims = get_animations(IMAGES_DIR, 'particles', ('dash', 6, False, 24), ('splash', 5, False))
         self.portrait_anims = get_animations(IMAGES_DIR, 'portrait', ('idle', 10, True), ('faces', 20, False))
         self.projectile_dict = load_images_dict(IMAGES_DIR, 'projectiles')
+        self.projectile_images = {pj_type: get_image_variants(image, (False, 0)) for pj_type, image in self.projectile_dict.items()}
+        self.projectile_images['fireball'] = get_image_variants(self.projectile_dict['fireball'], (False, 0), (True, 0), (False, 90), (False, 270))
         self.loot_dict = load_images_dict(IMAGES_DIR, 'loot')
+        self.loot_images = {lt_type: get_image_variants(pg.transform.scale_by(image, 0.8), (False, 0))[(False, 0)] for lt_type, image in self.loot_dict.items()}
         self.star_images = load_images(IMAGES_DIR, 'stars')
         self.ui_dict = load_images_dict(IMAGES_DIR, 'ui')
         self.hud_dict = load_images_dict(IMAGES_DIR, 'hud')
         self.tile_dict = load_tiles(IMAGES_DIR)
+        self.chest_anims = {c_type: Animation(self.tile_dict[c_type], 4, False) for c_type in ('chest_n', 'chest_r')}
         self.player_emote = load_images(IMAGES_DIR, 'emote')
 
         self.music_manager = MusicManager(self, SOUNDS_DIR)
         self.sfx_manager = SfxManager(SOUNDS_DIR)
 
         self.font_path = os.path.join(ASSETS_DIR, 'neodgm.ttf')
+        # per-phase frame timings, F3 shows them in game.
+        self.profiler = FrameProfiler(font_path=self.font_path)
+        self.profile_path = None
         self.language = "kor"
         self.lang_strings = get_lang_strings(LOCALIZATION, self.language)
         self.lang_changed = False
@@ -67,14 +103,23 @@ class Game:
         self.playing = False
 
         self.tilemap = Tilemap(self)
+        # every save file is written through this, off the main thread.
+        self.save_writer = SaveWriter()
+        # the next stage's map is generated in the background while the current one is played.
+        self.map_preloader = MapPreloader(self)
+        # see set_map_data
+        self.map_spawnpoints = []
+        self.spawned = {}
         self.map_left_boundary = 0
         self.map_right_boundary = 0
         self.map_bottom_boundary = 0
 
         self.background = self.ui_dict['background']
-        self.stars = Stars(self.star_images, 40)
+        self.stars = Stars(self.star_images, 40, self.rng)
 
         self.camera = Vec(0, 0)
+        self.scroll_offset = Vec(0, 0)
+        self.prev_scroll_offset = Vec(0, 0)
         self.players = OffsetSpriteGroup()
         self.player = Player(self, (20, 20), (12, 16), self.player_anims)
         self.players.add(self.player)
@@ -102,21 +147,28 @@ class Game:
         self.fade_delay = 50
         self.circle_transition_radius = 1
         self.screenshake = 0
+        self.shake_offset = 0
 
         savefiles = check_existing_save(SAVES_DIR, SAVE_MAP_NAME, SAVE_DATA_NAME)
+        legacy_map = os.path.join(SAVES_DIR, LEGACY_SAVE_MAP_NAME)
+        if os.path.exists(legacy_map):
+            import_legacy_map(legacy_map, os.path.join(SAVES_DIR, SAVE_MAP_NAME))
+            savefiles = check_existing_save(SAVES_DIR, SAVE_MAP_NAME, SAVE_DATA_NAME)
         if savefiles:
             if savefiles[1][1]:
                 self.load_save_data(SAVES_DIR, SAVE_DATA_NAME)
 
-        self.enemies = OffsetSpriteGroup()
+        self.enemies = OffsetSpriteGroup(wake_margin=ENEMY_WAKE_MARGIN, sleep_margin=ENEMY_SLEEP_MARGIN)
         self.chests = OffsetSpriteGroup()
         self.portals = OffsetSpriteGroup()
-        self.particles = OffsetSpriteGroup()
-        self.projectiles = OffsetSpriteGroup()
-        self.sparks = OffsetSpriteGroup()
-        self.loot = OffsetSpriteGroup()
-        self.ap_sparks = OffsetSpriteGroup()
-        self.hp_sparks = OffsetSpriteGroup()
+        self.sprite_pool = SpritePool()
+        self.particles = OffsetSpriteGroup(pool=self.sprite_pool)
+        self.projectiles = OffsetSpriteGroup(pool=self.sprite_pool)
+        self.sparks = SparkSystem(seed=self.seed)
+        self.loot = OffsetSpriteGroup(pool=self.sprite_pool)
+
+        # the first map is generated while the menus are up.
+        self.map_preloader.prepare()
 
     def reset_game_stats(self):
         self.stage_no = 0
@@ -179,6 +231,7 @@ class Game:
 
     def delete_save(self):
         self.fade_state = 'fade_out'
+        self.save_writer.flush()
         exists = check_existing_save(SAVES_DIR, SAVE_MAP_NAME, SAVE_DATA_NAME)
         for fp, exist in exists:
             if exist:
@@ -189,11 +242,12 @@ class Game:
         filepath = os.path.join(save_dir, fn)
         player_dict = self.player.save_attributes()
         game_stats = {'enemies': self.killed_enemies, 'chests': self.looted_chests, 'items': self.looted_items, 'cleared_num': self.cleared_maps, 'clear_streak': self.clear_streak, 'stage_no': self.stage_no, 'deaths': self.deaths, 'map': self.saved_map}
-        with open(filepath, 'w') as f:
-            json.dump({'player_stats': player_dict, 'game_stats': game_stats}, f)
+        save_dict = copy.deepcopy({'player_stats': player_dict, 'game_stats': game_stats})
+        self.save_writer.write(filepath, lambda: json.dumps(save_dict).encode())
         return True
 
     def load_save_data(self, save_dir, stats_file, reset=False):
+        self.save_writer.flush()
         stats = os.path.join(save_dir, stats_file)
         with open(stats, 'r') as f:
             save_data = json.load(f)
@@ -214,42 +268,64 @@ class Game:
             self.saved_map = saved_map_dir
         else:
             self.saved_map = None
-            files = check_existing_save(SAVES_DIR, SAVE_MAP_NAME, SAVE_DATA_NAME)
-            if files[0][1]:
-                os.remove(os.path.join(SAVES_DIR, SAVE_MAP_NAME))
+            self.save_writer.remove(os.path.join(SAVES_DIR, SAVE_MAP_NAME))
         self.save_data(SAVES_DIR, SAVE_DATA_NAME)
 
     def load_existing_map(self):
+        self.save_writer.flush()
         map_path = os.path.join(SAVES_DIR, SAVE_MAP_NAME)
-        self.tilemap.load(map_path)
+        if not is_map_delta(map_path):
+            self.tilemap.load(map_path)
+            return
+        delta = read_map_delta(map_path)
+        if delta['generator_version'] != GENERATOR_VERSION:
+            # saved by a version that generates other maps from the same seed, the run goes on on a new map.
+            self.load_new_map()
+            return
+        self.tilemap = self.map_preloader.generate(delta['seed'], delta['length'])
+        self.tilemap.apply_delta(delta['player_pos'], delta['removed'], delta['opened'])
 
     def load_new_map(self):
-        path = os.path.join(SAVES_DIR, 'map_99.json')
-        self.tilemap = Tilemap(self)
-        RandomMapGenerator(self).generate_random_map()
-        self.tilemap.save(path)
+        self.tilemap = self.map_preloader.take()
 
     def set_map_data(self):
         self.map_right_boundary, self.map_left_boundary, self.map_bottom_boundary = self.tilemap.get_map_edges()
-        self.enemies = OffsetSpriteGroup()
+        self.enemies = OffsetSpriteGroup(wake_margin=ENEMY_WAKE_MARGIN, sleep_margin=ENEMY_SLEEP_MARGIN)
         self.chests = OffsetSpriteGroup()
         self.portals = OffsetSpriteGroup()
-        for spawnpoint in self.tilemap.extract([('spawnpoint', 0), ('spawnpoint', 1), ('spawnpoint', 2), ('spawnpoint', 3), ('spawnpoint', 4), ('spawnpoint', 5), ('spawnpoint', 6)]):
+        # the map's spawnpoints and {spawnpoint index: entity}, what a map save is made from.
+        self.map_spawnpoints = self.tilemap.take_spawnpoints()
+        self.spawned = {}
+        for index, spawnpoint in enumerate(self.map_spawnpoints):
+            if spawnpoint.get('removed'):
+                continue
+            entity = None
             if spawnpoint['variant'] == 0:
                 self.player.pos = Vec(spawnpoint['pos'])
             elif spawnpoint['variant'] == 1:
-                self.portals.add(Portal(self, Vec(spawnpoint['pos'][0] - 8, spawnpoint['pos'][1]), (32, 32), self.portal_anims))
+                entity = Portal(self, Vec(spawnpoint['pos'][0] - 8, spawnpoint['pos'][1]), (32, 32), self.portal_anims)
+                self.portals.add(entity)
             # always put chests on grid.
             elif spawnpoint['variant'] == 2:
-                self.chests.add(NormalChest(self, 'chest_n', 2, Vec(spawnpoint['pos']), (16, 16)))
+                entity = NormalChest(self, 'chest_n', 2, Vec(spawnpoint['pos']), (16, 16))
+                self.chests.add(entity)
             elif spawnpoint['variant'] == 3:
-                self.chests.add(RareChest(self, 3, Vec(spawnpoint['pos']), (16, 16)))
+                entity = RareChest(self, 3, Vec(spawnpoint['pos']), (16, 16))
+                self.chests.add(entity)
             elif spawnpoint['variant'] == 4:
-                self.enemies.add(SlimeGreen(self, 4, spawnpoint['pos'], (24, 32), self.enemy_slg_anims))
+                entity = SlimeGreen(self, 4, spawnpoint['pos'], (24, 32), self.enemy_slg_anims)
+                self.enemies.add(entity)
             elif spawnpoint['variant'] == 5 and self.stage_no > 2:
-                self.enemies.add(SlimeYellow(self, 5, spawnpoint['pos'], (24, 32), self.enemy_sly_anims))
+                entity = SlimeYellow(self, 5, spawnpoint['pos'], (24, 32), self.enemy_sly_anims)
+                self.enemies.add(entity)
             elif spawnpoint['variant'] == 6 and self.stage_no > 4:
-                self.enemies.add(SlimeRed(self, 6, spawnpoint['pos'], (24, 32), self.enemy_slr_anims))
+                entity = SlimeRed(self, 6, spawnpoint['pos'], (24, 32), self.enemy_slr_anims)
+                self.enemies.add(entity)
+            if entity is not None:
+                self.spawned[index] = entity
+                if spawnpoint.get('opened'):
+                    entity.set_opened()
+        self.map_preloader.prepare()
 
     def circle_transition_out(self, player, display, offset=Vec(0, 0)):
         surf_overlay = pg.Surface(SCREEN_RES)
@@ -289,33 +365,32 @@ class Game:
             self.fade_state = None
 
     def run_interaction(self):
-        for chest in self.chests:
-            if pg.sprite.collide_mask(self.player, chest):
-                if not chest.interacted:
-                    self.sfx_manager.play('chest_open')
-                    item = chest.open_chest()
-                    self.loot.add(Loot(self, chest.rect.topleft, item, (16, 16)))
-                    self.looted_chests['total'] += 1
-                    if chest.variant == 2:
-                        self.looted_chests['normal'] += 1
-                    else:
-                        self.looted_chests['rare'] += 1
-        for item in self.loot:
-            if pg.sprite.collide_mask(self.player, item) and item.lootable:
+        for chest in self.chests.collide(self.player):
+            if not chest.interacted:
+                self.sfx_manager.play('chest_open')
+                item = chest.open_chest()
+                self.loot.spawn(Loot, self, chest.rect.topleft, item, (16, 16))
+                self.looted_chests['total'] += 1
+                if chest.variant == 2:
+                    self.looted_chests['normal'] += 1
+                else:
+                    self.looted_chests['rare'] += 1
+        for item in self.loot.collide(self.player):
+            if item.lootable:
                 self.player.take_loot(item)
                 if item.type in 'gold_goo':
                     for i in range(8):
-                        self.sparks.add(Spark(item.rect.center, random.random() * math.pi * 2, 1.5, (70, 115, 50)))
+                        self.sparks.add(item.rect.center, self.rng.random() * math.pi * 2, 1.5, (70, 115, 50))
                 elif item.rarity == 'normal':
                     self.sfx_manager.play('loot')
                     for i in range(11):
-                        self.sparks.add(Spark(item.rect.center, random.random() * math.pi * 2, 1.5, (255, 240, 255)))
+                        self.sparks.add(item.rect.center, self.rng.random() * math.pi * 2, 1.5, (255, 240, 255))
                 else:
                     self.sfx_manager.play('loot')
                     for i in range(11):
-                        self.sparks.add(Spark(item.rect.center, random.random() * math.pi * 2, 1.5, (230, 240, 70)))
+                        self.sparks.add(item.rect.center, self.rng.random() * math.pi * 2, 1.5, (230, 240, 70))
                 item.destroy = True
-        if pg.sprite.collide_mask(self.player, self.portals.sprites()[0]):
+        if self.portals.collide(self.player):
             self.into_portal = True
                 
     def update_camera(self, modifier=20):
@@ -328,43 +403,47 @@ class Game:
             scroll_offset = Vec(int(self.camera.x), int(self.camera.y))
             return scroll_offset
 
-    def run_game(self):
-        
-        while True:
-            self.music_manager.music_loop()
-            self.display.blit(self.background, (0, 0))
-            self.screen_overlay.fill((0, 0, 0, 0))
+    def update_frame(self):
+        # one simulation step, menus and transition overlays included. returns the camera offset.
+        profiler = self.profiler
+        self.music_manager.music_loop()
+        self.screen_overlay.fill((0, 0, 0, 0))
 
+        with profiler.scope('update.events'):
             self.events = pg.event.get()
 
+        with profiler.scope('update.camera'):
             scroll_offset = self.update_camera()
 
+        with profiler.scope('update.stars'):
             self.stars.update()
-            self.stars.render(self.display, scroll_offset)
 
-            if self.lang_changed:
-                if self.language == 'eng':
-                    self.language = 'kor'
-                else:
-                    self.language = 'eng'
-                self.lang_strings = get_lang_strings(LOCALIZATION, self.language)
-                self.lang_changed = False
+        if self.lang_changed:
+            if self.language == 'eng':
+                self.language = 'kor'
+            else:
+                self.language = 'eng'
+            self.lang_strings = get_lang_strings(LOCALIZATION, self.language)
+            self.lang_changed = False
 
-            if self.main_screen:
-                if not self.start_game:
-                    if self.fade_midpoint:
-                        self.initialize_menus()
-                
-                pg.mouse.set_visible(True)
+        if self.main_screen:
+            if not self.start_game:
+                if self.fade_midpoint:
+                    self.initialize_menus()
+            
+            pg.mouse.set_visible(True)
+            with profiler.scope('update.menus'):
                 self.load_main_menu()
 
-            if self.start_game:
-                self.fade_state = 'fade_out'
-                self.music_manager.prepare_next_music('Pixel_11.wav', 60)
-                if self.fade_midpoint:
-                    self.main_screen = False
-                    self.initialize_player()
-                    self.main_menu = False
+        if self.start_game:
+            self.fade_state = 'fade_out'
+            self.music_manager.prepare_next_music('Pixel_11.wav', 60)
+            if self.fade_midpoint:
+                self.main_screen = False
+                self.initialize_player()
+                self.main_menu = False
+                with profiler.scope('update.map_load'):
+                    self.save_writer.flush()
                     check_files = check_existing_save(SAVES_DIR, SAVE_MAP_NAME, SAVE_DATA_NAME)
                     if not check_files[0][1] and check_files[1][1]:
                         self.load_new_map()
@@ -377,152 +456,188 @@ class Game:
                         self.load_new_map()
                         self.stage_no = 1
                     self.set_map_data()
-                    self.playing = True
-                    self.start_game = False
-                    self.hud = Hud(self)
-                    
-            
-            if self.into_portal:
-                self.circle_transition_out(self.player, self.screen_overlay, scroll_offset)
-                if self.fade_midpoint:
-                    self.cleared_maps += 1
+                self.playing = True
+                self.start_game = False
+                self.hud = Hud(self)
+                
+        
+        if self.into_portal:
+            self.circle_transition_out(self.player, self.screen_overlay, scroll_offset)
+            if self.fade_midpoint:
+                self.cleared_maps += 1
+                with profiler.scope('update.map_load'):
                     self.load_new_map()
                     self.set_map_data()
-                    self.stage_no += 1
-                    if self.stage_no > self.clear_streak:
-                        self.clear_streak = self.stage_no
-                        self.new_record = True
+                self.stage_no += 1
+                if self.stage_no > self.clear_streak:
+                    self.clear_streak = self.stage_no
+                    self.new_record = True
+                with profiler.scope('update.save'):
                     self.save_game_data()
-                    self.into_portal = False
-                    
+                self.into_portal = False
+                
 
-            if self.playing:
-                self.fade_transition(self.screen_transition_overlay, 5)
-                if not self.game_paused:
-                    pg.mouse.set_visible(False)
-
-                    if self.game_over:
-                        pg.mouse.set_visible(True)
-                        self.g_o.update(self)
-                        self.g_o.render(self.screen_overlay)
-                        if self.fade_midpoint:
-                            self.stage_no = 1
-                            self.initialize_menus()
-                            self.new_record = False
-                            self.playing = False
-                    
-                    else:
-                        if not self.player.dead:
-                            self.movement = Vec(self.x_movement[1] - self.x_movement[0], 0) * 1.1
+        if self.playing:
+            self.fade_transition(self.screen_transition_overlay, 5)
+            if not self.game_paused:
+                pg.mouse.set_visible(False)
+
+                if self.game_over:
+                    pg.mouse.set_visible(True)
+                    self.g_o.update(self)
+                    self.g_o.render(self.screen_overlay)
+                    if self.fade_midpoint:
+                        self.stage_no = 1
+                        self.initialize_menus()
+                        self.new_record = False
+                        self.playing = False
+                
+                else:
+                    if not self.player.dead:
+                        self.movement = Vec(self.x_movement[1] - self.x_movement[0], 0) * 1.1
+                        with profiler.scope('update.player_hits'):
                             coll_list = get_collision_sprites(self.player, self.enemies, self.projectiles)
-                            if coll_list:
-                                self.player.get_hit(coll_list)
+                        if coll_list:
+                            self.player.get_hit(coll_list)
+                        with profiler.scope('update.enemies'):
+                            self.enemies.set_active_area(pg.Rect(scroll_offset, DISPLAY_RES))
+                            update_enemy_sight(self.enemies, self.tilemap, self.player.rect)
                             self.enemies.update(self.tilemap)
-                            for enemy in self.enemies: 
-                                if enemy.destroy:
-                                    self.enemies.remove(enemy)
+                        for enemy in self.enemies: 
+                            if enemy.destroy:
+                                self.enemies.remove(enemy)
+                    else:
+                        self.movement *= 0
+                        self.music_manager.stop_playing()
+                        if self.game_over_delay:
+                            if self.player.animation.done:
+                                self.game_over_delay -= 1
+                            if self.game_over_delay == 0:
+                                self.fade_state = 'fade_out'
                         else:
-                            self.movement *= 0
-                            self.music_manager.stop_playing()
-                            if self.game_over_delay:
-                                if self.player.animation.done:
-                                    self.game_over_delay -= 1
-                                if self.game_over_delay == 0:
-                                    self.fade_state = 'fade_out'
-                            else:
-                                if self.fade_midpoint:
-                                    self.music_manager.prepare_next_music('Pixel_12.wav', 40)
-                                    self.deaths += 1
-                                    self.save_game_data(False)
-                                    self.g_o = GameOver(self)
-                                    self.game_over = True
-
+                            if self.fade_midpoint:
+                                self.music_manager.prepare_next_music('Pixel_12.wav', 40)
+                                self.deaths += 1
+                                self.save_game_data(False)
+                                self.g_o = GameOver(self)
+                                self.game_over = True
+
+                    with profiler.scope('update.player'):
                         self.player.update(self.tilemap, self.movement)
+                    with profiler.scope('update.portals'):
                         self.portals.update(self.tilemap)
+                    with profiler.scope('update.chests'):
                         self.chests.update()
+                    with profiler.scope('update.loot'):
                         self.loot.update(self.tilemap)
-                        self.particles.update()         
+                    with profiler.scope('update.particles'):
+                        self.particles.update()
+                    with profiler.scope('update.projectiles'):
                         self.projectiles.update(self.tilemap)
-                        self.sparks.update()
-                        self.ap_sparks.update(self)
-                        self.hp_sparks.update(self)
+                    with profiler.scope('update.sparks'):
+                        self.sparks.update(self)
+                    with profiler.scope('update.hud'):
                         self.hud.update(self)
-                        
-                else:
-                    pg.mouse.set_visible(True)
-                    self.p_m.update(self)
-                    self.p_m.render(self.screen_overlay)
-                    if self.p_m.display_help:
-                        self.display_help_menu()
-                    if self.p_m.display_stats:
-                        self.display_stats_menu()
                     
-
+            else:
+                pg.mouse.set_visible(True)
+                self.p_m.update(self)
+                self.p_m.render(self.screen_overlay)
+                if self.p_m.display_help:
+                    self.display_help_menu()
+                if self.p_m.display_stats:
+                    self.display_stats_menu()
+
+        return scroll_offset
+
+    def render_frame(self, scroll_offset, alpha=None):
+        # alpha: how far the frame is between the last tick and the next one, None to draw the last tick as it is.
+        if alpha is not None:
+            scroll_offset = self.prev_scroll_offset + (scroll_offset - self.prev_scroll_offset) * alpha
+            scroll_offset = Vec(int(scroll_offset.x), int(scroll_offset.y))
+        profiler = self.profiler
+        with profiler.scope('render.background'):
+            self.display.blit(self.background, (0, 0))
+            self.stars.render(self.display, scroll_offset)
+        if self.playing:
+            with profiler.scope('render.tilemap'):
                 self.tilemap.render(self.display, scroll_offset)
-                self.chests.draw(self.display, scroll_offset)
-                self.portals.draw(self.display, scroll_offset)
-                self.enemies.render(self.display, scroll_offset)
-                self.player.render(self.display, scroll_offset)
-                self.loot.draw(self.display, scroll_offset)
-                self.projectiles.draw(self.display, scroll_offset)
-                self.particles.draw(self.display, scroll_offset)
+            with profiler.scope('render.chests'):
+                self.chests.draw(self.display, scroll_offset, alpha)
+            with profiler.scope('render.portals'):
+                self.portals.draw(self.display, scroll_offset, alpha)
+            with profiler.scope('render.enemies'):
+                self.enemies.render(self.display, scroll_offset, alpha)
+            with profiler.scope('render.player'):
+                self.players.render(self.display, scroll_offset, alpha)
+            with profiler.scope('render.loot'):
+                self.loot.draw(self.display, scroll_offset, alpha)
+            with profiler.scope('render.projectiles'):
+                self.projectiles.draw(self.display, scroll_offset, alpha)
+            with profiler.scope('render.particles'):
+                self.particles.draw(self.display, scroll_offset, alpha)
+            with profiler.scope('render.sparks'):
                 self.sparks.render(self.display, scroll_offset)
-                self.ap_sparks.render(self.display, scroll_offset)
-                self.hp_sparks.render(self.display, scroll_offset)
-            
+
+            with profiler.scope('render.hud'):
                 self.hud.render(self.display)
-            
-            for event in self.events:
-                if event.type == pg.QUIT:
-                    pg.quit()
-                    sys.exit()
-                if event.type == pg.KEYDOWN:
-                    if event.key == pg.K_q:
-                        pg.quit()
-                        sys.exit()
-                    if self.playing and not self.player.dead:
-                        if event.key == pg.K_RIGHT:
-                            self.x_movement[1] = True
-                        if event.key == pg.K_LEFT:
-                            self.x_movement[0] = True
-                        if event.key == pg.K_z:
-                            self.player.jump()
-                        if event.key == pg.K_c:
-                            self.player.dash()
-                        if event.key == pg.K_x:
-                            self.player.attack()
-                        if event.key == pg.K_SPACE:
+
+    def handle_events(self):
+        for event in self.events:
+            if event.type == pg.QUIT:
+                self.quit()
+            if event.type == pg.KEYDOWN:
+                if event.key == pg.K_q:
+                    self.quit()
+                if event.key == pg.K_F3:
+                    self.profiler.toggle_overlay()
+                if self.playing and not self.player.dead:
+                    if event.key == pg.K_RIGHT:
+                        self.x_movement[1] = True
+                    if event.key == pg.K_LEFT:
+                        self.x_movement[0] = True
+                    if event.key == pg.K_z:
+                        self.player.jump()
+                    if event.key == pg.K_c:
+                        self.player.dash()
+                    if event.key == pg.K_x:
+                        self.player.attack()
+                    if event.key == pg.K_SPACE:
+                        if not self.game_paused:
+                            self.run_interaction()
+                    if event.key == pg.K_DOWN:
+                        self.y_direction[0] = True
+                    if event.key == pg.K_UP:
+                        self.y_direction[1] = True
+                    if event.key == pg.K_p or event.key == pg.K_BACKSPACE or event.key == pg.K_ESCAPE:
+                        if not self.p_m.display_help and not self.p_m.display_stats:
                             if not self.game_paused:
-                                self.run_interaction()
-                        if event.key == pg.K_DOWN:
-                            self.y_direction[0] = True
-                        if event.key == pg.K_UP:
-                            self.y_direction[1] = True
-                        if event.key == pg.K_p or event.key == pg.K_BACKSPACE or event.key == pg.K_ESCAPE:
-                            if not self.p_m.display_help and not self.p_m.display_stats:
-                                if not self.game_paused:
-                                    self.p_m.update_stats(self)
-                                self.game_paused = not self.game_paused
-                if event.type == pg.KEYUP:
-                    if self.playing and not self.player.dead:
-                        if event.key == pg.K_RIGHT:
-                            self.x_movement[1] = False
-                        if event.key == pg.K_LEFT:
-                            self.x_movement[0] = False
-                        if event.key == pg.K_DOWN:
-                            self.y_direction[0] = False
-                        if event.key == pg.K_UP:
-                            self.y_direction[1] = False
-            
-            
-            scaled_display = pg.transform.scale(self.display, self.screen.get_size())
+                                self.p_m.update_stats(self)
+                            self.game_paused = not self.game_paused
+            if event.type == pg.KEYUP:
+                if self.playing and not self.player.dead:
+                    if event.key == pg.K_RIGHT:
+                        self.x_movement[1] = False
+                    if event.key == pg.K_LEFT:
+                        self.x_movement[0] = False
+                    if event.key == pg.K_DOWN:
+                        self.y_direction[0] = False
+                    if event.key == pg.K_UP:
+                        self.y_direction[1] = False
+
+    def update_screenshake(self):
+        if self.screenshake:
+            self.shake_offset = (self.rng.random() * self.screenshake - self.screenshake / 3)
+            self.screenshake = max(self.screenshake - 1, 0)
+        else:
+            self.shake_offset = 0
 
-            if self.screenshake:
-                shake_offset = (random.random() * self.screenshake - self.screenshake / 3)
-                self.screen.blit(scaled_display, (shake_offset, shake_offset))
-                self.screenshake = max(self.screenshake - 1, 0)
-            else:
-                self.screen.blit(scaled_display, (0, 0))
+    def present_frame(self):
+        profiler = self.profiler
+        with profiler.scope('present.scale'):
+            scaled_display = pg.transform.scale(self.display, self.screen.get_size())
+        with profiler.scope('present.overlays'):
+            self.screen.blit(scaled_display, (self.shake_offset, self.shake_offset))
 
             if self.main_screen:
                 self.screen.blit(self.main_screen_overlay, (0, 0))
@@ -532,9 +647,117 @@ class Game:
             if self.transition_alpha != 0:
                 self.screen.blit(self.screen_transition_overlay, (0, 0))
 
+        profiler.render(self.screen)
+        with profiler.scope('present.flip'):
             pg.display.flip()
-            self.clock.tick(60)
+
+    def store_render_positions(self):
+        self.prev_scroll_offset = Vec(self.scroll_offset)
+        for group in (self.players, self.enemies, self.chests, self.portals, self.loot, self.projectiles, self.particles):
+            group.store_positions()
+
+    def start_recording(self, path):
+        self.recorder = InputRecorder(self.seed, path)
+
+    def stop_recording(self):
+        if self.recorder:
+            self.recorder.save()
+            self.recorder = None
+
+    def snapshot_state(self):
+        # the whole live state as bytes, for quicksaves, rewinding or starting benchmarks and tests from the same point.
+        return snapshot_game(self)
+
+    def restore_state(self, data):
+        restore_game(self, data)
+
+    def export_profile(self):
+        if self.profile_path:
+            self.profiler.export(self.profile_path)
+
+    def quit(self):
+        self.save_writer.flush()
+        self.stop_recording()
+        self.export_profile()
+        pg.quit()
+        sys.exit()
+
+    def tick(self):
+        # one fixed simulation step.
+        if self.tick_count == self.start_game_tick:
+            self.start_game = True
+        if self.input_script and self.tick_count in self.input_script:
+            for event in self.input_script[self.tick_count]:
+                pg.event.post(event)
+        if self.interpolate:
+            self.store_render_positions()
+        with self.profiler.scope('update'):
+            self.scroll_offset = self.update_frame()
+        if self.recorder:
+            self.recorder.record(self.tick_count, self.events, self.start_game)
+        self.handle_events()
+        self.update_screenshake()
+        self.tick_count += 1
+
+    def run_game(self, max_ticks=None, render=True, uncapped=False, input_script=None, fps=60):
+        # input_script: {tick: [event, ...]}, posted before that tick's events are read.
+        # uncapped runs one tick per loop as fast as possible instead of following the clock.
+        self.input_script = input_script
+        accumulator = 0
+        while max_ticks is None or self.tick_count < max_ticks:
+            if uncapped:
+                self.clock.tick()
+                self.tick()
+            else:
+                accumulator += self.clock.tick(fps) / 1000
+                ticks = 0
+                while accumulator >= TICK_TIME and ticks < MAX_TICKS_PER_FRAME:
+                    self.tick()
+                    accumulator -= TICK_TIME
+                    ticks += 1
+                if ticks == MAX_TICKS_PER_FRAME:
+                    accumulator = min(accumulator, TICK_TIME)
+            if render:
+                alpha = None
+                if self.interpolate and not uncapped:
+                    alpha = accumulator / TICK_TIME
+                with self.profiler.scope('render'):
+                    self.render_frame(self.scroll_offset, alpha)
+                self.present_frame()
+            self.profiler.end_frame()
+        self.save_writer.flush()
+        self.stop_recording()
+        self.export_profile()
 
 
 if __name__ == '__main__':
-    Game().run_game()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Purplish')
+    parser.add_argument('--headless', action='store_true', help='no window or sound (dummy SDL drivers), runs uncapped')
+    parser.add_argument('--no-render', action='store_true', help='only run the update step')
+    parser.add_argument('--uncapped', action='store_true', help='run simulation ticks back to back as fast as possible')
+    parser.add_argument('--ticks', type=int, default=None, help='quit after this many simulation ticks')
+    parser.add_argument('--fps', type=int, default=60, help='render frame rate cap, the simulation always runs at %d ticks per second' % TICK_RATE)
+    parser.add_argument('--interpolate', action='store_true', help='draw sprites between simulation ticks')
+    parser.add_argument('--seed', type=int, default=None, help='seed for the run')
+    parser.add_argument('--script', default=None, help='json input script, [[tick, "down" / "up", key name], ...]')
+    parser.add_argument('--autostart', action='store_true', help='skip the main menu')
+    parser.add_argument('--record', default=None, help='record the seed and key input of the session to this file')
+    parser.add_argument('--replay', default=None, help='play back a recorded session, use with --headless to run it faster than real time')
+    parser.add_argument('--profile', default=None, help='write the per-phase frame timings to this file on exit, .csv for every frame, .json for percentiles')
+    args = parser.parse_args()
+    if args.replay:
+        replay = Replay(args.replay)
+        game = Game(headless=args.headless, seed=replay.seed, interpolate=args.interpolate)
+        game.start_game_tick = replay.start_tick
+        input_script = replay.input_script
+        max_ticks = args.ticks if args.ticks is not None else replay.ticks
+    else:
+        game = Game(headless=args.headless, seed=args.seed, interpolate=args.interpolate)
+        if args.autostart:
+            game.start_game_tick = 0
+        input_script = load_input_script(args.script) if args.script else None
+        max_ticks = args.ticks
+    if args.record:
+        game.start_recording(args.record)
+    game.profile_path = args.profile
+    game.run_game(max_ticks, not args.no_render, args.uncapped or args.headless, input_script, args.fps)
@@ -0,0 +1,118 @@
+import numpy as np
+
+AUTOTILE_NEIGHBORS = [(-1, 0), (0, -1), (0, 1), (1, 0)]
+AUTOTILE_DIAGONALS = [(-1, -1), (1, -1), (-1, 1), (1, 1)]
+AUTOTILE_TYPES = {'grass', 'stone', 'grassystone', 'bg_grass'}
+AUTOTILE_MAP_BASE = {
+    tuple(sorted([(1, 0), (0, 1)])): 0,
+    tuple(sorted([(1, 0), (0, 1), (-1, 0)])): 1,
+    tuple(sorted([(-1, 0), (0, 1)])): 2,
+    tuple(sorted([(-1, 0), (0, -1), (0, 1)])): 3,
+    tuple(sorted([(-1, 0), (0, -1)])): 4,
+    tuple(sorted([(-1, 0), (0, -1), (1, 0)])): 5,
+    tuple(sorted([(1, 0), (0, -1)])): 6,
+    tuple(sorted([(1, 0), (0, -1), (0, 1)])): 7,
+    tuple(sorted([(1, 0), (-1, 0), (0, 1), (0, -1)])): 8,
+    tuple(sorted([(1, 0), (-1, 0)])): 1,
+    tuple(sorted([(-1, 0)])): 2,
+    tuple(sorted([(0, -1), (0, 1)])): 3,
+    tuple(sorted([(0, -1)])): 5
+}
+# inner corners: every neighbour but one diagonal is the same type, that diagonal has to be empty (not another type).
+AUTOTILE_MAP_CORNERS = {
+    9: {'exists': tuple(sorted([(-1, 1), (-1, 0), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)])), 'empty': tuple(sorted([(-1, -1)]))},
+    10: {'exists': tuple(sorted([(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, 1), (1, 0)])), 'empty': tuple(sorted([(1, -1)]))}
+}
+# any tile with water right above it.
+UNDER_WATER_VARIANT = 3
+
+# bit i of a neighbour mask is NEIGHBOR_BITS[i]
+NEIGHBOR_BITS = AUTOTILE_NEIGHBORS + AUTOTILE_DIAGONALS
+STRAIGHT_MASK = 0b1111
+
+
+def mask_offsets(mask):
+    return tuple(sorted(offset for bit, offset in enumerate(NEIGHBOR_BITS) if mask & (1 << bit)))
+
+def offsets_mask(offsets):
+    return sum(1 << NEIGHBOR_BITS.index(offset) for offset in offsets)
+
+def build_tables():
+    # {same type mask: variant}, -1 where the tile keeps its variant.
+    base = np.full(256, -1, np.int16)
+    corner = np.full(256, -1, np.int16)
+    corner_empty = np.zeros(256, np.uint8)
+    for mask in range(256):
+        base[mask] = AUTOTILE_MAP_BASE.get(mask_offsets(mask & STRAIGHT_MASK), -1)
+    for variant, condition in AUTOTILE_MAP_CORNERS.items():
+        mask = offsets_mask(condition['exists'])
+        corner[mask] = variant
+        corner_empty[mask] = offsets_mask(condition['empty'])
+    return base, corner, corner_empty
+
+BASE_TABLE, CORNER_TABLE, CORNER_EMPTY_TABLE = build_tables()
+
+
+def autotile(grid, region=None):
+    """Picks the variant of every tile in region (x, y, w, h in tiles, the whole grid if None). Returns the changed cells."""
+    if region is None:
+        if not len(grid):
+            return []
+        min_x, min_y, max_x, max_y = grid.bounds()
+        region = (min_x, min_y, max_x - min_x + 1, max_y - min_y + 1)
+    x, y, w, h = region
+    # palette id -> type code (0 empty) / variant / autotiled
+    types = {}
+    type_codes = np.zeros(len(grid.palette), np.int32)
+    variants = np.zeros(len(grid.palette), np.int32)
+    autotiled = np.zeros(len(grid.palette), bool)
+    for tile_id, (t_type, variant) in enumerate(grid.palette[1:], 1):
+        type_codes[tile_id] = types.setdefault(t_type, len(types) + 1)
+        variants[tile_id] = variant
+        autotiled[tile_id] = t_type in AUTOTILE_TYPES
+
+    # one tile of border around the region for the neighbours.
+    ids = grid.get_ids(x - 1, y - 1, w + 2, h + 2)
+    codes = type_codes[ids]
+    center_ids = ids[1:-1, 1:-1]
+    center = codes[1:-1, 1:-1]
+    same = np.zeros((h, w), np.uint8)
+    empty = np.zeros((h, w), np.uint8)
+    for bit, (dx, dy) in enumerate(NEIGHBOR_BITS):
+        neighbor = codes[1 + dy:1 + dy + h, 1 + dx:1 + dx + w]
+        same |= (neighbor == center).astype(np.uint8) << bit
+        empty |= (neighbor == 0).astype(np.uint8) << bit
+
+    old_variants = variants[center_ids]
+    new_variants = old_variants.copy()
+    auto = autotiled[center_ids]
+    base = BASE_TABLE[same]
+    new_variants[auto & (base >= 0)] = base[auto & (base >= 0)]
+    corner = CORNER_TABLE[same]
+    is_corner = auto & (corner >= 0) & (empty == CORNER_EMPTY_TABLE[same])
+    new_variants[is_corner] = corner[is_corner]
+    if 'water' in types:
+        new_variants[codes[:-2, 1:-1] == types['water']] = UNDER_WATER_VARIANT
+
+    rows, cols = np.nonzero((center_ids != 0) & (new_variants != old_variants))
+    if not len(rows):
+        return []
+    # one palette lookup per distinct (tile, new variant), then the ids are written back in one go.
+    new_ids = center_ids.copy()
+    pairs = center_ids[rows, cols].astype(np.int64) << 16 | new_variants[rows, cols]
+    unique_pairs, inverse = np.unique(pairs, return_inverse=True)
+    pair_ids = np.array([grid.get_palette_id(grid.palette[pair >> 16][0], pair & 0xFFFF) for pair in unique_pairs.tolist()], np.uint16)
+    new_ids[rows, cols] = pair_ids[inverse]
+    grid.put_ids(x, y, new_ids)
+    return list(zip((cols + x).tolist(), (rows + y).tolist()))
+
+def autotile_offgrid(tiles, tile_size=16):
+    # offgrid tiles only look at the four straight neighbours, any autotiled type counts.
+    locs = {(tile['pos'][0], tile['pos'][1]) for tile in tiles}
+    for tile in tiles:
+        mask = 0
+        for bit, (dx, dy) in enumerate(AUTOTILE_NEIGHBORS):
+            if (tile['pos'][0] + dx * tile_size, tile['pos'][1] + dy * tile_size) in locs:
+                mask |= 1 << bit
+        if BASE_TABLE[mask] >= 0:
+            tile['variant'] = int(BASE_TABLE[mask])
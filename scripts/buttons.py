@@ -18,6 +18,7 @@ class StaticButton(Sprite):
     def set_image_rect(self):
         self.og_image = pg.font.Font(self.font_path, self.size).render(self.text, True, self.color)
         self.image = self.og_image
+        self.mask_image = None
         self.rect = self.image.get_rect(**self.pos)
 
     def check_mouseover(self, offset_x=0, offset_y=0):
@@ -41,13 +42,17 @@ class Button(StaticButton):
             self.image = self.og_image
 
     def get_button_mask(self):
-        return pg.mask.from_surface(self.image).to_surface(unsetcolor=None)
+        # the highlight only depends on og_image, so it is made once.
+        if self.mask_image is None:
+            self.mask_image = pg.mask.from_surface(self.og_image).to_surface(unsetcolor=None)
+        return self.mask_image
 
 
 class ImgButton(Button):
     def __init__(self, img, **kwargs):
         self.og_image = img
         self.image = self.og_image
+        self.mask_image = None
         self.pos = kwargs
         self.rect = self.image.get_rect(**self.pos)
 
@@ -0,0 +1,172 @@
+CONTACT_NONE = 0
+CONTACT_POS = 1  # hit while moving right / down
+CONTACT_NEG = 2  # hit while moving left / up
+CONTACT_STATIC = 3  # overlapping a solid tile without moving on that axis
+
+NEIGHBOR_OFFSETS = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 0), (0, 1), (1, -1), (1, 0), (1, 1)]
+
+
+class CollisionGrid:
+    """One byte per tile over the map bounds, 1 for solid tiles. Built once per map."""
+    def __init__(self, min_x, min_y, width, height, tile_size=16):
+        self.min_x = min_x
+        self.min_y = min_y
+        self.width = width
+        self.height = height
+        self.tile_size = tile_size
+        self.cells = bytearray(width * height)
+
+    @classmethod
+    def from_tilegrid(cls, grid, solid_types, tile_size=16):
+        if not len(grid):
+            return cls(0, 0, 0, 0, tile_size)
+        min_x, min_y, max_x, max_y = grid.bounds()
+        collision_grid = cls(min_x, min_y, max_x - min_x + 1, max_y - min_y + 1, tile_size)
+        for (x, y), (t_type, variant) in grid.items():
+            if t_type in solid_types:
+                collision_grid.set_solid(x, y, True)
+        return collision_grid
+
+    def set_solid(self, x, y, solid):
+        # tiles outside the bounds the grid was built with are ignored.
+        x -= self.min_x
+        y -= self.min_y
+        if 0 <= x < self.width and 0 <= y < self.height:
+            self.cells[y * self.width + x] = 1 if solid else 0
+
+    def solid(self, x, y):
+        x -= self.min_x
+        y -= self.min_y
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return self.cells[y * self.width + x]
+        return 0
+
+    def first_solid_col(self, col_start, col_end, row_start, row_end):
+        # walks the columns from col_start to col_end (inclusive, either direction), returns the first one with a solid tile in the rows.
+        row_start = max(row_start - self.min_y, 0)
+        row_end = min(row_end - self.min_y, self.height - 1)
+        if row_start > row_end:
+            return None
+        cells = self.cells
+        width = self.width
+        step = 1 if col_end >= col_start else -1
+        for col in range(col_start, col_end + step, step):
+            x = col - self.min_x
+            if 0 <= x < width:
+                for index in range(row_start * width + x, row_end * width + x + 1, width):
+                    if cells[index]:
+                        return col
+        return None
+
+    def first_solid_row(self, row_start, row_end, col_start, col_end):
+        col_start = max(col_start - self.min_x, 0)
+        col_end = min(col_end - self.min_x, self.width - 1)
+        if col_start > col_end:
+            return None
+        cells = self.cells
+        width = self.width
+        step = 1 if row_end >= row_start else -1
+        for row in range(row_start, row_end + step, step):
+            y = row - self.min_y
+            if 0 <= y < self.height:
+                if cells.find(1, y * width + col_start, y * width + col_end + 1) != -1:
+                    return row
+        return None
+
+    def rect_overlaps(self, rect):
+        ts = self.tile_size
+        return self.first_solid_col(rect.left // ts, (rect.right - 1) // ts, rect.top // ts, (rect.bottom - 1) // ts) is not None
+
+    def neighbor_cells(self, pos, size):
+        # the cells the old per-entity neighbour lookup visited, in the same order.
+        ts = self.tile_size
+        grid_pos = (int(pos.x // ts), int(pos.y // ts))
+        check_positions = [grid_pos]
+        if size[0] > ts and size[1] > ts:
+            check_positions.append((grid_pos[0] + size[0] // ts, grid_pos[1] + size[1] // ts))
+        elif size[0] > ts:
+            for i in range(size[0] // ts):
+                check_positions.append((grid_pos[0] + i + 1, grid_pos[1]))
+        elif size[1] > ts:
+            for i in range(size[1] // ts):
+                check_positions.append((grid_pos[0], grid_pos[1] - i - 1))
+        cells = []
+        for x, y in check_positions:
+            for offset in NEIGHBOR_OFFSETS:
+                if self.solid(x + offset[0], y + offset[1]):
+                    cells.append((x + offset[0], y + offset[1]))
+        return cells
+
+    def push_out(self, pos, size, delta, axis):
+        # resolves a body that already started inside the terrain (spawned into the ground, pushed in by knockback).
+        # each overlapping neighbour pushes it in turn, so it can be moved out by more than one tile.
+        ts = self.tile_size
+        contact = CONTACT_NONE
+        for x, y in self.neighbor_cells(pos, size):
+            left = int(pos.x)
+            top = int(pos.y)
+            if left < (x + 1) * ts and x * ts < left + size[0] and top < (y + 1) * ts and y * ts < top + size[1]:
+                start = (left, top)[axis]
+                if delta > 0:
+                    start = (x, y)[axis] * ts - size[axis]
+                    contact = CONTACT_POS
+                elif delta < 0:
+                    start = ((x, y)[axis] + 1) * ts
+                    contact = CONTACT_NEG
+                elif not contact:
+                    contact = CONTACT_STATIC
+                pos[axis] = start
+        return contact
+
+    def move_x(self, pos, size, dx):
+        # moves pos (topleft, Vector2) by dx and pushes it out of the first solid column it sweeps into.
+        ts = self.tile_size
+        old_left = int(pos.x)
+        if self.first_solid_col(old_left // ts, (old_left + size[0] - 1) // ts, int(pos.y) // ts, (int(pos.y) + size[1] - 1) // ts) is not None:
+            pos.x += dx
+            return self.push_out(pos, size, dx, 0)
+        pos.x += dx
+        left = int(pos.x)
+        top = int(pos.y)
+        row_start = top // ts
+        row_end = (top + size[1] - 1) // ts
+        if dx > 0:
+            col = self.first_solid_col(min(left // ts, (old_left + size[0] - 1) // ts + 1), (left + size[0] - 1) // ts, row_start, row_end)
+            if col is not None:
+                pos.x = col * ts - size[0]
+                return CONTACT_POS
+        elif dx < 0:
+            col = self.first_solid_col(max((left + size[0] - 1) // ts, old_left // ts - 1), left // ts, row_start, row_end)
+            if col is not None:
+                pos.x = (col + 1) * ts
+                return CONTACT_NEG
+        elif self.first_solid_col(left // ts, (left + size[0] - 1) // ts, row_start, row_end) is not None:
+            pos.x = left
+            return CONTACT_STATIC
+        return CONTACT_NONE
+
+    def move_y(self, pos, size, dy):
+        ts = self.tile_size
+        old_top = int(pos.y)
+        if self.first_solid_row(old_top // ts, (old_top + size[1] - 1) // ts, int(pos.x) // ts, (int(pos.x) + size[0] - 1) // ts) is not None:
+            pos.y += dy
+            return self.push_out(pos, size, dy, 1)
+        pos.y += dy
+        top = int(pos.y)
+        left = int(pos.x)
+        col_start = left // ts
+        col_end = (left + size[0] - 1) // ts
+        if dy > 0:
+            row = self.first_solid_row(min(top // ts, (old_top + size[1] - 1) // ts + 1), (top + size[1] - 1) // ts, col_start, col_end)
+            if row is not None:
+                pos.y = row * ts - size[1]
+                return CONTACT_POS
+        elif dy < 0:
+            row = self.first_solid_row(max((top + size[1] - 1) // ts, old_top // ts - 1), top // ts, col_start, col_end)
+            if row is not None:
+                pos.y = (row + 1) * ts
+                return CONTACT_NEG
+        elif self.first_solid_row(top // ts, (top + size[1] - 1) // ts, col_start, col_end) is not None:
+            pos.y = top
+            return CONTACT_STATIC
+        return CONTACT_NONE
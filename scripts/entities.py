@@ -1,10 +1,11 @@
 import pygame as pg
 from pygame import Vector2 as Vec
 from pygame.sprite import Sprite
-from scripts.particle import Particle, Fireball, Spark, SlimeBlobYellow, SlimeBlobRed, AetherSpark, HealthSpark
+from scripts.particle import Particle, Fireball, SlimeBlobYellow, SlimeBlobRed
 from scripts.utils import *
 from scripts.gameutils import *
-import math, random
+from scripts.collision import CONTACT_POS, CONTACT_NEG
+import math
 
 
 
@@ -26,7 +27,8 @@ class PhysicsEntity(Sprite):
         self.water_tiles = []
 
         # for compulsory sprite attributes
-        self.image = pg.transform.flip(self.animation.cur_img(), self.flip, False)
+        self.image = self.animation.cur_img(self.flip)
+        self.mask = self.animation.cur_mask(self.flip)
         self.rect = self.current_rect()
 
         self.destroy = False
@@ -45,21 +47,17 @@ class PhysicsEntity(Sprite):
         return (int((self.pos.x + self.size[0] / 2) // tilemap.tile_size), int((self.pos.y + self.size[1] / 2) // tilemap.tile_size + 1))
         
     def update(self, tilemap, movement=Vec(0, 0)):
-        self.collisions = {'up': False, 'down': False, 'right': False, 'left': False}
+        collisions = self.collisions
+        collisions['up'] = collisions['down'] = collisions['right'] = collisions['left'] = False
         frame_movement = movement + self.vel
+        collision_grid = tilemap.get_collision_grid()
 
         # updating x position
-        self.pos.x += frame_movement.x
-        self.rect = self.current_rect()
-        for rect in tilemap.neighbor_physics_rects(self.pos, self.size):
-            if self.rect.colliderect(rect):
-                if frame_movement.x < 0:
-                    self.rect.left = rect.right
-                    self.collisions['left'] = True
-                if frame_movement.x > 0:
-                    self.rect.right = rect.left
-                    self.collisions['right'] = True
-                self.pos.x = self.rect.x
+        contact = collision_grid.move_x(self.pos, self.size, frame_movement.x)
+        if contact == CONTACT_NEG:
+            collisions['left'] = True
+        elif contact == CONTACT_POS:
+            collisions['right'] = True
         min_x_pos = self.game.map_left_boundary
         max_x_pos = self.game.map_right_boundary
         if self.pos.x <= min_x_pos:
@@ -68,17 +66,11 @@ class PhysicsEntity(Sprite):
             self.pos.x = max_x_pos
 
         # updating y position
-        self.pos.y += frame_movement.y
-        self.rect = self.current_rect()
-        for rect in tilemap.neighbor_physics_rects(self.pos, self.size):
-            if self.rect.colliderect(rect):
-                if frame_movement.y > 0:
-                    self.rect.bottom = rect.top
-                    self.collisions['down'] = True
-                if frame_movement.y < 0:
-                    self.rect.top = rect.bottom
-                    self.collisions['up'] = True
-                self.pos.y = self.rect.y
+        contact = collision_grid.move_y(self.pos, self.size, frame_movement.y)
+        if contact == CONTACT_POS:
+            collisions['down'] = True
+        elif contact == CONTACT_NEG:
+            collisions['up'] = True
 
         if movement.x > 0:
             self.flip = True
@@ -103,7 +95,7 @@ class PhysicsEntity(Sprite):
         if self.collisions['down'] and tilemap.water_check(feet_loc):
             if feet_loc not in self.water_tiles:
                 self.water_tiles.append(feet_loc)
-                self.game.particles.add(Particle(self.game, 'splash', (self.rect.centerx - 8, self.rect.bottom - 16), ((self.last_movement.x / 2, 0))))
+                self.game.particles.spawn(Particle, self.game, 'splash', (self.rect.centerx - 8, self.rect.bottom - 16), ((self.last_movement.x / 2, 0)))
                 if self.type == 'player':
                     self.game.sfx_manager.play('splash')
         if self.water_tiles:
@@ -113,7 +105,8 @@ class PhysicsEntity(Sprite):
                 self.water_tiles.pop(0)
 
         self.animation.update()
-        self.image = pg.transform.flip(self.animation.cur_img(), self.flip, False)
+        self.image = self.animation.cur_img(self.flip)
+        self.mask = self.animation.cur_mask(self.flip)
 
         if self.image.get_width() != self.size[0]:
             temp_pos_x = self.get_adjusted_x_pos()
@@ -122,7 +115,7 @@ class PhysicsEntity(Sprite):
             self.rect = self.current_rect()
     
     def get_mask_rect(self):
-        mask_rect = pg.mask.from_surface(self.image).get_rect(centerx=self.rect.centerx, bottom=self.rect.bottom)
+        mask_rect = self.mask.get_rect(centerx=self.rect.centerx, bottom=self.rect.bottom)
         return mask_rect
     
     def get_adjusted_x_pos(self):
@@ -254,15 +247,15 @@ class Player(PhysicsEntity):
             self.visible = False
             if abs(self.dash_time) == 2:
                 self.vel.x *= 0.1
-            p_vel = Vec(abs(self.dash_time) / self.dash_time * random.random() * 2, 0)
-            self.game.particles.add(Particle(self.game, 'dash', self.pos, velocity=p_vel, frame=random.randint(0, 5)))
+            p_vel = Vec(abs(self.dash_time) / self.dash_time * self.game.rng.random() * 2, 0)
+            self.game.particles.spawn(Particle, self.game, 'dash', self.pos, velocity=p_vel, frame=self.game.rng.randint(0, 5))
         
         if abs(self.dash_time) in {12, 1}:
             for i in range(15):
-                angle = random.random() * math.pi * 2
-                speed = random.random() * 0.5 + 0.5
+                angle = self.game.rng.random() * math.pi * 2
+                speed = self.game.rng.random() * 0.5 + 0.5
                 p_vel = Vec(math.cos(angle) * speed, math.sin(angle) * speed)
-                self.game.particles.add(Particle(self.game, 'dash', self.pos, velocity=p_vel, frame=random.randint(0, 5)))
+                self.game.particles.spawn(Particle, self.game, 'dash', self.pos, velocity=p_vel, frame=self.game.rng.randint(0, 5))
         
     def jump(self):
         if self.wallslide:
@@ -296,13 +289,13 @@ class Player(PhysicsEntity):
             if self.mana >= 2:
                 self.game.sfx_manager.play('attack_player')
                 if self.aim_vertical == 1:
-                    self.game.projectiles.add(Fireball(self.game, (self.rect.x, self.rect.centery), False, Vec(0, 0.4)))
+                    self.game.projectiles.spawn(Fireball, self.game, (self.rect.x, self.rect.centery), False, Vec(0, 0.4))
                 elif self.aim_vertical == -1:
-                    self.game.projectiles.add(Fireball(self.game, (self.rect.x, self.rect.top), False, Vec(0, -0.4)))
+                    self.game.projectiles.spawn(Fireball, self.game, (self.rect.x, self.rect.top), False, Vec(0, -0.4))
                 elif self.flip:
-                    self.game.projectiles.add(Fireball(self.game, (self.rect.x + 2, self.rect.centery - 2), True, Vec(1, 0)))
+                    self.game.projectiles.spawn(Fireball, self.game, (self.rect.x + 2, self.rect.centery - 2), True, Vec(1, 0))
                 else:
-                    self.game.projectiles.add(Fireball(self.game, (self.rect.x - 2, self.rect.centery - 2), False, Vec(-1, 0)))
+                    self.game.projectiles.spawn(Fireball, self.game, (self.rect.x - 2, self.rect.centery - 2), False, Vec(-1, 0))
                 self.attacking = True
                 self.mana -= 2
     
@@ -341,10 +334,10 @@ class Player(PhysicsEntity):
                     entity.destroy = True
                     if entity.type == 'blob_sy':
                         for i in range(6):
-                            self.game.sparks.add(Spark(self.pos, random.random() * math.pi * 2, random.random() + 0.5, entity.spark_clr))
+                            self.game.sparks.add(self.pos, self.game.rng.random() * math.pi * 2, self.game.rng.random() + 0.5, entity.spark_clr)
                     else:
                         for i in range(8):
-                            self.game.sparks.add(Spark(self.pos, random.random() * math.pi * 2, random.random() + 0.5, entity.spark_clr))
+                            self.game.sparks.add(self.pos, self.game.rng.random() * math.pi * 2, self.game.rng.random() + 0.5, entity.spark_clr)
                     if self.health > 0:
                         self.game.sfx_manager.play('hurt_player')
                         self.flicker_countdown = 120
@@ -427,6 +420,10 @@ class Enemy(PhysicsEntity):
         self.attack_cooldown = 120
         self.hurt = False
         self.die = False
+        # set by the enemies group when it is far from the camera, see OffsetSpriteGroup.update_zones.
+        self.dormant = False
+        # ((from tile, to tile), visible) of this tick's batched line of sight query, see update_enemy_sight.
+        self.sight = None
 
         self.show_hp = False
         self.hp_og = game.hud_dict['enemy_hp_base'].copy()
@@ -458,9 +455,9 @@ class Enemy(PhysicsEntity):
             ap_num = 30
             hp_num = 20
         for i in range(ap_num):
-            self.game.ap_sparks.add(AetherSpark((self.rect.centerx, self.rect.bottom), random.random() * math.pi * 2, random.random() + 1))
+            self.game.sparks.add_aether((self.rect.centerx, self.rect.bottom), self.game.rng.random() * math.pi * 2, self.game.rng.random() + 1)
         for i in range(hp_num):
-            self.game.hp_sparks.add(HealthSpark((self.rect.centerx, self.rect.bottom), random.random() * math.pi * 2, random.random() + 1))
+            self.game.sparks.add_health((self.rect.centerx, self.rect.bottom), self.game.rng.random() * math.pi * 2, self.game.rng.random() + 1)
     
     def reset_detect_cd(self, amount=80):
         self.detect_cooldown = amount
@@ -471,37 +468,27 @@ class Enemy(PhysicsEntity):
     def reset_jmp_cd(self, amount):
         self.jump_cooldown = amount
 
+    def can_sleep(self):
+        # enemies that are chasing, fighting or dying finish that first.
+        return not (self.detected_player or self.hurt or self.die or self.jumping or self.attacking)
+
+    def sleep_update(self, tilemap, movement=Vec(0, 0)):
+        # no ai or animation while dormant, only the physics until it has landed.
+        self.moving = 0
+        if not self.collisions['down'] or self.vel.x:
+            PhysicsEntity.update(self, tilemap, Vec(0, 0))
+
     def check_visibility(self, tilemap, entity_rect):
-        x1 = self.rect.centerx // 16
-        x2 = entity_rect.centerx // 16
-        y1 = self.rect.centery // 16
-        y2 = entity_rect.top // 16
-        points = []
-        dx = abs(x2 - x1)
-        dy = abs(y2 - y1)
-        sx = 1 if x1 < x2 else -1
-        sy = 1 if y1 < y2 else -1
-        
-        error = dx - dy
-        
-        while x1 != x2 or y1 != y2:
-            double_error = error * 2
-            if double_error > -dy:
-                error -= dy
-                x1 += sx
-            if double_error < dx:
-                error += dx
-                y1 += sy
-            points.append((int(x1), int(y1)))
-        
-        for point in points:
-            loc = str(point)
-            if tilemap.tilemap.get(loc):
-                if tilemap.tilemap[loc]['type'] in {'stone', 'grass', 'grassystone', 'water'}:
-                    return False
-                
-        self.detected_player = True
-        return True
+        # the batched result when it is for the same tiles, otherwise the map's LineOfSight (cached per tile pair).
+        tiles = ((self.rect.centerx // 16, self.rect.centery // 16), (entity_rect.centerx // 16, entity_rect.top // 16))
+        if self.sight is not None and self.sight[0] == tiles:
+            visible = self.sight[1]
+        else:
+            visible = tilemap.get_line_of_sight().visible(*tiles[0], *tiles[1])
+        if visible:
+            self.detected_player = True
+            return True
+        return False
 
     def get_hit(self, entity):
         self.game.sfx_manager.play('hurt_enemy')
@@ -519,6 +506,15 @@ class Enemy(PhysicsEntity):
             surf.blit(self.hp_base, hp_pos)
 
 
+def update_enemy_sight(enemies, tilemap, entity_rect):
+    # one line of sight query per tick, every awake enemy against the entity's (the player's) tile. check_visibility() reads the results.
+    awake = [enemy for enemy in enemies if not enemy.dormant]
+    end = (entity_rect.centerx // 16, entity_rect.top // 16)
+    starts = [(enemy.rect.centerx // 16, enemy.rect.centery // 16) for enemy in awake]
+    for enemy, start, visible in zip(awake, starts, tilemap.get_line_of_sight().visible_many(starts, end)):
+        enemy.sight = ((start, end), visible)
+
+
 class SlimeGreen(Enemy):
     def __init__(self, game, variant, pos, size, anims):
         super().__init__(game, 'enemy_sl_g', variant, pos, size, 2, anims)
@@ -546,7 +542,7 @@ class SlimeGreen(Enemy):
                         self.attack(xy_distance)
             
                 elif self.detected_player:
-                    self.moving = random.randint(10, 30)
+                    self.moving = self.game.rng.randint(10, 30)
                     if self.detect_cooldown:
                         movement.x = -0.5 if not self.flip else 0.5
                         self.detect_cooldown = max(self.detect_cooldown - 1, 0)
@@ -564,8 +560,8 @@ class SlimeGreen(Enemy):
                     self.flip = True
                 movement.x = -0.5 if not self.flip else 0.5
                 
-            elif random.random() < 0.01:
-                self.moving = random.randint(30, 120)
+            elif self.game.rng.random() < 0.01:
+                self.moving = self.game.rng.randint(30, 120)
             else:
                 movement = Vec(0, 0)
 
@@ -655,8 +651,8 @@ class SlimeYellow(Enemy):
                 elif self.collisions['left'] or tilemap.edge_check(self.get_mask_rect())[0]:
                     self.flip = True
                 movement.x = -0.4 if not self.flip else 0.4
-            elif random.random() < 0.005:
-                self.moving = random.randint(30, 90)
+            elif self.game.rng.random() < 0.005:
+                self.moving = self.game.rng.randint(30, 90)
             else:
                 movement = Vec(0, 0)
 
@@ -699,7 +695,7 @@ class SlimeYellow(Enemy):
         self.game.sfx_manager.play('attack_blob')
         start_x = self.rect.centerx
         start_y = self.rect.centery + 4
-        self.game.projectiles.add(SlimeBlobYellow(self.game, (start_x, start_y), player_pos))
+        self.game.projectiles.spawn(SlimeBlobYellow, self.game, (start_x, start_y), player_pos)
 
     def attack(self, xy_dis):
         if not self.jumping and not self.attack_cooldown and xy_dis <= 80:
@@ -746,8 +742,8 @@ class SlimeRed(Enemy):
                 elif self.collisions['left'] or tilemap.edge_check(self.get_mask_rect())[0]:
                     self.flip = True
                 movement.x = -0.5 if not self.flip else 0.5
-            elif random.random() < 0.02:
-                self.moving = random.randint(30, 90)
+            elif self.game.rng.random() < 0.02:
+                self.moving = self.game.rng.randint(30, 90)
             else:
                 movement = Vec(0, 0)
 
@@ -831,7 +827,7 @@ class SlimeRed(Enemy):
         self.game.sfx_manager.play('attack_blob')
         start_x = self.rect.centerx
         start_y = self.rect.centery + 4
-        self.game.projectiles.add(SlimeBlobRed(self.game, 'blob_sr', (start_x, start_y), player_pos))
+        self.game.projectiles.spawn(SlimeBlobRed, self.game, 'blob_sr', (start_x, start_y), player_pos)
 
 
 
@@ -843,14 +839,14 @@ class NormalChest(Sprite):
         self.pos = pos
         self.size = size
         self.type = c_type
-        self.images = game.tile_dict.copy()
-        self.anims = Animation(self.images[self.type], 4, False)
-        self.static_closed = self.images[self.type][0]
-        self.static_open = self.images[self.type][-1]
+        self.anims = game.chest_anims[self.type].copy()
+        self.static_closed = self.anims.images[0]
+        self.static_open = self.anims.images[-1]
         self.interacted = False
         self.destroy = False
 
         self.image = self.static_closed
+        self.mask = self.anims.masks[False][0]
         self.rect = self.get_current_rect()
         
     def get_current_rect(self):
@@ -858,15 +854,25 @@ class NormalChest(Sprite):
     
     def open_chest(self):
         self.interacted = True
-        item = random.choices(N_CHEST_ITEMS, N_CHEST_WEIGHTS, k=1)
+        item = self.game.rng.choices(N_CHEST_ITEMS, N_CHEST_WEIGHTS, k=1)
         return item[0]
 
+    def set_opened(self):
+        # opened before the run was saved, shown open without playing the animation.
+        self.interacted = True
+        self.anims.reset(self.anims.dur * len(self.anims.images) - 1)
+        self.anims.done = True
+        self.image = self.static_open
+        self.mask = self.anims.masks[False][-1]
+
     def update(self):
         if self.interacted:
             self.anims.update()
             self.image = self.anims.cur_img()
+            self.mask = self.anims.cur_mask()
         if self.anims.done:
             self.image = self.static_open
+            self.mask = self.anims.masks[False][-1]
         self.rect = self.get_current_rect()
 
 
@@ -877,7 +883,7 @@ class RareChest(NormalChest):
 
     def open_chest(self):
         self.interacted = True
-        item = random.choices(R_CHEST_ITEMS, R_CHEST_WEIGHTS, k=1)
+        item = self.game.rng.choices(R_CHEST_ITEMS, R_CHEST_WEIGHTS, k=1)
         return item[0]
 
 
@@ -890,14 +896,19 @@ R_CHEST_WEIGHTS = [1, 1, 2, 3, 3, 4]
 class Loot(Sprite):
     def __init__(self, game, pos, lt_type, size):
         super().__init__()
+        self.pos = Vec()
+        self.vel = Vec()
+        self.reset(game, pos, lt_type, size)
+
+    def reset(self, game, pos, lt_type, size):
+        # also used to reuse a pooled item.
         self.game = game
         self.size = size
-        self.pos = Vec(pos)
-        self.vel = Vec(1, -1.5)
+        self.pos.update(pos)
+        self.vel.update(1, -1.5)
         self.type = lt_type
         self.set_rarity()
-        image = self.game.loot_dict[lt_type].copy()
-        self.image = pg.transform.scale_by(image, 0.8)
+        self.image, self.mask = self.game.loot_images[lt_type]
         self.size = (self.image.get_width(), self.image.get_height())
         self.rect = self.current_rect()
         self.lootable = False
@@ -915,14 +926,16 @@ class Loot(Sprite):
     def update(self, tilemap):
         self.vel.x = max(self.vel.x - 0.1, 0)
         self.vel.y = min(self.vel.y + 0.1, 5)
-        self.pos += self.vel
-        self.rect = self.current_rect()
-        for rect in tilemap.neighbor_physics_rects(self.pos, self.size):
-            if self.rect.colliderect(rect):
-                if self.vel.y > 0:
-                    self.rect.bottom = rect.top
-                    self.vel.y = 0
-                self.pos.y = self.rect.y
+        self.pos.x += self.vel.x
+        collision_grid = tilemap.get_collision_grid()
+        if self.vel.y > 0:
+            if collision_grid.move_y(self.pos, self.size, self.vel.y):
+                self.vel.y = 0
+                self.lootable = True
+        else:
+            # rising loot is not pushed out of tiles.
+            self.pos.y += self.vel.y
+            if collision_grid.move_y(self.pos, self.size, 0):
                 self.lootable = True
 
         self.rect = self.current_rect()
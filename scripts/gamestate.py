@@ -0,0 +1,269 @@
+import marshal, struct
+import pygame as pg
+from pygame import Vector2 as Vec
+from scripts.utils import Animation
+from scripts.entities import PhysicsEntity, Player, Enemy, SlimeGreen, SlimeYellow, SlimeRed, NormalChest, RareChest, Portal, Loot
+from scripts.particle import Particle, Projectile, Fireball, SlimeBlobYellow, SlimeBlobRed
+from scripts.menus import Hud
+
+
+STATE_MAGIC = b'PSNP'
+STATE_VERSION = 1
+# magic, version. the rest is marshal data, so a snapshot is only meant for the build (and python) that made it.
+STATE_HEADER = struct.Struct('<4sB')
+
+# the Game attributes that are simulation state, the rest are assets, settings and menus.
+GAME_ATTRIBUTES = ('tick_count', 'stage_no', 'cleared_maps', 'clear_streak', 'killed_enemies', 'looted_chests', 'looted_items', 'deaths', 'saved_map',
+                   'camera', 'scroll_offset', 'prev_scroll_offset', 'x_movement', 'y_direction', 'movement', 'into_portal', 'new_record',
+                   'map_left_boundary', 'map_right_boundary', 'map_bottom_boundary', 'map_spawnpoints', 'screenshake', 'shake_offset',
+                   'transition_alpha', 'fade_state', 'fade_midpoint', 'fade_delay', 'circle_transition_radius',
+                   'playing', 'main_screen', 'main_menu', 'start_game', 'game_over', 'game_over_delay', 'game_paused', 'stats_menu', 'options_menu', 'help_menu')
+# (group, entity classes), saved and restored in this order.
+GROUPS = (('enemies', (SlimeGreen, SlimeYellow, SlimeRed)), ('chests', (NormalChest, RareChest)), ('portals', (Portal,)),
+          ('loot', (Loot,)), ('projectiles', (Fireball, SlimeBlobYellow, SlimeBlobRed)), ('particles', (Particle,)))
+ENTITY_CLASSES = {cls.__name__: cls for group, classes in GROUPS for cls in classes}
+ANIMS = {SlimeGreen: 'enemy_slg_anims', SlimeYellow: 'enemy_sly_anims', SlimeRed: 'enemy_slr_anims', Portal: 'portal_anims'}
+
+
+def get_default_vectors(classes):
+    # Vec(0, 0) default arguments of the entity methods. some are changed in place (the enemy ai's movement, the blobs' velocity) and carry over between calls, so they are state too.
+    vectors = {}
+    for cls in classes:
+        for function in vars(cls).values():
+            for value in getattr(function, '__defaults__', None) or ():
+                if type(value) is Vec:
+                    vectors[id(value)] = value
+    return list(vectors.values())
+
+DEFAULT_VECTORS = get_default_vectors((PhysicsEntity, Player, Enemy, Particle, Projectile) + tuple(ENTITY_CLASSES.values()))
+DEFAULT_VECTOR_INDEX = {id(vector): index for index, vector in enumerate(DEFAULT_VECTORS)}
+
+PLAIN_TYPES = {int, float, bool, str, type(None)}
+NOT_PLAIN = object()
+# {class: attribute names that hold surfaces, assets or other objects}, learned as entities are captured.
+skipped_attributes = {}
+
+
+def is_plain(value):
+    value_type = type(value)
+    if value_type in PLAIN_TYPES:
+        return True
+    if value_type is list or value_type is tuple:
+        for item in value:
+            if type(item) not in PLAIN_TYPES and not is_plain(item):
+                return False
+        return True
+    if value_type is dict:
+        for key, item in value.items():
+            if type(key) not in PLAIN_TYPES or type(item) not in PLAIN_TYPES and not is_plain(item):
+                return False
+        return True
+    return False
+
+
+def pack_value(value):
+    # vectors are stored as complex numbers (nothing else in the game is one), rects as tuples and animations as (frame, done).
+    value_type = type(value)
+    if value_type in PLAIN_TYPES:
+        return value
+    if value_type is Vec:
+        return complex(value.x, value.y)
+    if value_type is pg.Rect:
+        return tuple(value)
+    if value_type is Animation:
+        return (value.frame, value.done)
+    if is_plain(value):
+        return value
+    return NOT_PLAIN
+
+
+def apply_state(obj, state, shared=()):
+    # rects, lists and animations are restored into the ones obj already has, so whatever else holds them sees the change.
+    attributes = obj.__dict__
+    for name, value in state.items():
+        value_type = type(value)
+        if value_type is complex:
+            attributes[name] = Vec(value.real, value.imag)
+        elif value_type is tuple or value_type is list:
+            current = attributes.get(name)
+            current_type = type(current)
+            if current_type is pg.Rect:
+                current.update(value)
+            elif current_type is Animation:
+                current.frame, current.done = value
+            elif current_type is list and value_type is list:
+                current[:] = value
+            else:
+                attributes[name] = value
+        else:
+            attributes[name] = value
+    for name, index in shared:
+        attributes[name] = DEFAULT_VECTORS[index]
+
+
+def capture_entity(entity):
+    # (state, [(name, default vector index) ...] for the attributes that are one of DEFAULT_VECTORS)
+    skipped = skipped_attributes.setdefault(type(entity), {'game', '_Sprite__g'})
+    state = {}
+    shared = []
+    for name, value in entity.__dict__.items():
+        if name in skipped:
+            continue
+        value_type = type(value)
+        if value_type in PLAIN_TYPES:
+            state[name] = value
+            continue
+        if value_type is Vec and id(value) in DEFAULT_VECTOR_INDEX:
+            shared.append((name, DEFAULT_VECTOR_INDEX[id(value)]))
+        value = pack_value(value)
+        if value is NOT_PLAIN:
+            skipped.add(name)
+        else:
+            state[name] = value
+    return state, shared
+
+
+def new_entity(game, group, cls, state):
+    # a fresh entity of the right kind, its state is applied over it.
+    if issubclass(cls, Enemy):
+        return cls(game, state['variant'], (0, 0), state['size'], getattr(game, ANIMS[cls]))
+    if cls is Portal:
+        return cls(game, (0, 0), state['size'], game.portal_anims)
+    if cls is NormalChest:
+        return cls(game, state['type'], state['variant'], Vec(0, 0), state['size'])
+    if cls is RareChest:
+        return cls(game, state['variant'], Vec(0, 0), state['size'])
+    # pooled ones
+    if cls is Loot:
+        return group.spawn(cls, game, (0, 0), state['type'], state['size'])
+    if cls is Particle:
+        return group.spawn(cls, game, state['type'], (0, 0))
+    if cls is Fireball:
+        return group.spawn(cls, game, (0, 0), state['flip'], Vec(state['vel'].real, state['vel'].imag))
+    if cls is SlimeBlobRed:
+        return group.spawn(cls, game, state['type'], (0, 0), (0, 0))
+    return group.spawn(cls, game, (0, 0), (0, 0))
+
+
+def restore_entity(entity, state, shared):
+    # the animation of the saved action / particle type, its frame is restored with the rest.
+    if isinstance(entity, PhysicsEntity):
+        entity.animation = entity.anims[state['action']].copy()
+    elif isinstance(entity, Particle) and entity.type != state['type']:
+        entity.animation = entity.game.particle_anims[state['type']].copy()
+    apply_state(entity, state, shared)
+    refresh_images(entity)
+
+
+def refresh_images(entity):
+    # surfaces are not saved, they are picked again from the restored state.
+    if isinstance(entity, PhysicsEntity):
+        entity.image = entity.animation.cur_img(entity.flip)
+        entity.mask = entity.animation.cur_mask(entity.flip)
+        if isinstance(entity, Enemy) and entity.show_hp:
+            entity.update_hp_bar()
+    elif isinstance(entity, NormalChest):
+        if entity.anims.done:
+            entity.image = entity.static_open
+            entity.mask = entity.anims.masks[False][-1]
+        elif entity.interacted:
+            entity.image = entity.anims.cur_img()
+            entity.mask = entity.anims.cur_mask()
+        else:
+            entity.image = entity.static_closed
+            entity.mask = entity.anims.masks[False][0]
+    elif isinstance(entity, Particle):
+        entity.set_current_img()
+    elif isinstance(entity, Projectile):
+        entity.set_image()
+    elif isinstance(entity, Loot):
+        entity.image, entity.mask = entity.game.loot_images[entity.type]
+
+
+def snapshot_game(game):
+    """The live game state as bytes: Game counters, player, every entity, sparks, camera and rng state. The map is kept as its seed."""
+    spawn_indices = {id(entity): index for index, entity in game.spawned.items()}
+    groups = []
+    for name, classes in GROUPS:
+        groups.append([(type(entity).__name__, spawn_indices.get(id(entity), -1)) + capture_entity(entity) for entity in getattr(game, name)])
+    game_state = {}
+    for name in GAME_ATTRIBUTES:
+        if name in game.__dict__:
+            game_state[name] = pack_value(game.__dict__[name])
+    state = {
+        'game': game_state,
+        'map': (game.tilemap.seed, game.tilemap.length),
+        'next_map': game.map_preloader.seed,
+        'rng': game.rng.getstate(),
+        'player': capture_entity(game.player),
+        'groups': groups,
+        'sparks': game.sparks.get_state(),
+        'stars': [star.pos.x for star in game.stars.stars],
+        'default_vectors': [complex(vector.x, vector.y) for vector in DEFAULT_VECTORS],
+    }
+    return STATE_HEADER.pack(STATE_MAGIC, STATE_VERSION) + marshal.dumps(state)
+
+
+def restore_game(game, data):
+    """Puts game back to the state snapshot_game() returned data for."""
+    magic, version = STATE_HEADER.unpack_from(data)
+    if magic != STATE_MAGIC or version != STATE_VERSION:
+        raise ValueError('not a version %d game state' % STATE_VERSION)
+    state = marshal.loads(memoryview(data)[STATE_HEADER.size:])
+
+    seed, length = state['map']
+    if (game.tilemap.seed, game.tilemap.length) != (seed, length):
+        if seed is None:
+            raise ValueError('the game state is for a map loaded from a file, it has to be the current map to be restored')
+        game.tilemap = game.map_preloader.generate(seed, length)
+        game.tilemap.take_spawnpoints()
+    game.map_preloader.reset(state['next_map'])
+
+    apply_state(game, state['game'])
+    game.rng.setstate(state['rng'])
+    for star, x in zip(game.stars.stars, state['stars']):
+        star.pos.x = x
+    game.sparks.set_state(state['sparks'])
+
+    restore_entity(game.player, *state['player'])
+    game.players.prev_positions = {}
+
+    # the entity made from the same spawnpoint, or else any live one of the same class, is reused. building them is most of the cost of a restore.
+    spawned = game.spawned
+    game.spawned = {}
+    for (name, classes), entities in zip(GROUPS, state['groups']):
+        group = getattr(game, name)
+        live = {}
+        for sprite in group.sprites()[::-1]:
+            live.setdefault(type(sprite), []).append(sprite)
+        used = set()
+        group.empty()
+        group.prev_positions = {}
+        for class_name, spawn_index, entity_state, shared in entities:
+            cls = ENTITY_CLASSES[class_name]
+            entity = spawned.get(spawn_index)
+            if type(entity) is not cls or entity in used:
+                entity = None
+                candidates = live.get(cls, [])
+                while candidates and entity is None:
+                    candidate = candidates.pop()
+                    if candidate not in used:
+                        entity = candidate
+                if entity is None:
+                    entity = new_entity(game, group, cls, entity_state)
+            used.add(entity)
+            restore_entity(entity, entity_state, shared)
+            group.add(entity)
+            if spawn_index >= 0:
+                game.spawned[spawn_index] = entity
+        if group.pool is not None:
+            for sprites in live.values():
+                for sprite in sprites:
+                    if sprite not in used:
+                        group.pool.release(sprite)
+
+    # last, new pooled projectiles reset some of them.
+    for vector, value in zip(DEFAULT_VECTORS, state['default_vectors']):
+        vector.update(value.real, value.imag)
+    if game.playing and getattr(game, 'hud', None) is None:
+        game.hud = Hud(game)
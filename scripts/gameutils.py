@@ -1,32 +1,179 @@
 from pygame.sprite import Group
-import math
+import math, json
 import pygame as pg
 
-class OffsetSpriteGroup(Group):
+class SpritePool:
+    """Killed sprites waiting to be reused, by class."""
     def __init__(self):
+        self.free = {}
+
+    def acquire(self, sprite_cls, *args, **kwargs):
+        free = self.free.get(sprite_cls)
+        if free:
+            sprite = free.pop()
+            sprite.reset(*args, **kwargs)
+            return sprite
+        return sprite_cls(*args, **kwargs)
+
+    def release(self, sprite):
+        # only for sprites that can be set up again with reset().
+        if type(sprite) in self.free:
+            self.free[type(sprite)].append(sprite)
+        else:
+            self.free[type(sprite)] = [sprite]
+
+
+# {mask: (left, top, right, bottom) of its set pixels}, filled when the frame atlases and image variants are built.
+MASK_BOUNDS = {}
+
+def get_mask_bounds(mask) -> pg.Rect:
+    rects = mask.get_bounding_rects()
+    return rects[0].unionall(rects[1:]) if rects else pg.Rect(0, 0, 0, 0)
+
+def add_mask_bounds(mask, rect):
+    MASK_BOUNDS[mask] = (rect.left, rect.top, rect.right, rect.bottom)
+
+def collide_mask_bounds(left, right):
+    # same as pg.sprite.collide_mask, the masks' bounding rects are tested before their pixels. about half the pairs whose images overlap stop there.
+    left_mask = left.mask
+    right_mask = right.mask
+    left_x, left_y = left.rect.topleft
+    right_x, right_y = right.rect.topleft
+    lb = MASK_BOUNDS.get(left_mask)
+    rb = MASK_BOUNDS.get(right_mask)
+    if lb is not None and rb is not None and (left_x + lb[2] <= right_x + rb[0] or right_x + rb[2] <= left_x + lb[0] or left_y + lb[3] <= right_y + rb[1] or right_y + rb[3] <= left_y + lb[1]):
+        return None
+    return left_mask.overlap(right_mask, (right_x - left_x, right_y - left_y))
+
+
+class OffsetSpriteGroup(Group):
+    def __init__(self, cell_size=64, pool=None, wake_margin=None, sleep_margin=None):
         super().__init__()
+        # destroyed sprites are handed back to the pool, if there is one.
+        self.pool = pool
+        # broadphase, sprites are bucketed by the cells their image covers. rebuilt on the first query after anything moved.
+        self.cell_size = cell_size
+        self.cells = {}
+        self.index_stale = True
+        # {sprite: (x, y)} at the start of the last tick, for interpolated rendering.
+        self.prev_positions = {}
+        # activation zones, off when wake_margin is None. sprites away from the active area (the camera) only get sleep_update().
+        self.wake_margin = wake_margin
+        self.sleep_margin = sleep_margin if sleep_margin is not None else wake_margin
+        self.active_area = None
+
+    def add_internal(self, sprite, layer=None):
+        super().add_internal(sprite, layer)
+        self.index_stale = True
+
+    def remove_internal(self, sprite):
+        super().remove_internal(sprite)
+        self.index_stale = True
+
+    def set_active_area(self, rect):
+        self.active_area = rect
 
     def update(self, *args, **kwargs):
-        for sprite in self.sprites():
-            sprite.update(*args, **kwargs)
+        if self.wake_margin is not None and self.active_area is not None:
+            self.update_zones(*args, **kwargs)
+        else:
+            for sprite in self.sprites():
+                sprite.update(*args, **kwargs)
         for sprite in self.sprites():
             if sprite.destroy:
                 sprite.kill()
+                if self.pool is not None:
+                    self.pool.release(sprite)
+        self.index_stale = True
+
+    def update_zones(self, *args, **kwargs):
+        # a dormant sprite wakes inside the wake rect (or when something, e.g. a stray fireball, made it unable to sleep), an awake one only goes dormant outside the bigger sleep rect and when can_sleep().
+        area = self.active_area
+        wake_rect = area.inflate(self.wake_margin * 2, self.wake_margin * 2)
+        sleep_rect = area.inflate(self.sleep_margin * 2, self.sleep_margin * 2)
+        for sprite in self.sprites():
+            if sprite.dormant:
+                if wake_rect.colliderect(sprite.rect) or not sprite.can_sleep():
+                    sprite.dormant = False
+            elif not sleep_rect.colliderect(sprite.rect) and sprite.can_sleep():
+                sprite.dormant = True
+            if sprite.dormant:
+                sprite.sleep_update(*args, **kwargs)
+            else:
+                sprite.update(*args, **kwargs)
+
+    def spawn(self, sprite_cls, *args, **kwargs):
+        # adds a new sprite, reusing a pooled one when possible.
+        if self.pool is not None:
+            sprite = self.pool.acquire(sprite_cls, *args, **kwargs)
+        else:
+            sprite = sprite_cls(*args, **kwargs)
+        self.add(sprite)
+        return sprite
+
+    def build_index(self):
+        cells = {}
+        cell_size = self.cell_size
+        for order, sprite in enumerate(self.sprites()):
+            rect = get_sprite_bounds(sprite)
+            for cy in range(rect.top // cell_size, (rect.bottom - 1) // cell_size + 1):
+                for cx in range(rect.left // cell_size, (rect.right - 1) // cell_size + 1):
+                    if (cx, cy) in cells:
+                        cells[(cx, cy)].append((order, sprite))
+                    else:
+                        cells[(cx, cy)] = [(order, sprite)]
+        self.cells = cells
+        self.index_stale = False
+
+    def query_rect(self, rect):
+        # sprites whose image overlaps rect, in group order.
+        if self.index_stale:
+            self.build_index()
+        cell_size = self.cell_size
+        found = {}
+        cells = self.cells
+        for cy in range(rect.top // cell_size, (rect.bottom - 1) // cell_size + 1):
+            for cx in range(rect.left // cell_size, (rect.right - 1) // cell_size + 1):
+                if (cx, cy) in cells:
+                    for order, sprite in cells[(cx, cy)]:
+                        if order not in found and rect.colliderect(get_sprite_bounds(sprite)):
+                            found[order] = sprite
+        return [found[order] for order in sorted(found)]
+
+    def collide(self, sprite, collided=collide_mask_bounds):
+        # same result as pg.sprite.spritecollide(sprite, self, False, collided), only tests sprites near it.
+        return [other for other in self.query_rect(get_sprite_bounds(sprite)) if collided(sprite, other)]
 
-    def draw(self, surf, offset=(0, 0)):
+    def store_positions(self):
+        self.prev_positions = {sprite: (sprite.pos.x, sprite.pos.y) for sprite in self.sprites()}
+
+    def get_render_offset(self, sprite, offset, alpha):
+        # moves the sprite back towards where it was at the start of the tick, alpha 1 draws it where it is now.
+        if alpha is None or sprite not in self.prev_positions:
+            return offset
+        prev_x, prev_y = self.prev_positions[sprite]
+        dx = sprite.pos.x - prev_x
+        dy = sprite.pos.y - prev_y
+        # teleported (new map, respawn), not moved.
+        if abs(dx) > 32 or abs(dy) > 32:
+            return offset
+        return (offset[0] + dx * (1 - alpha), offset[1] + dy * (1 - alpha))
+
+    def draw(self, surf, offset=(0, 0), alpha=None):
         sprites = self.sprites()
+        offsets = [self.get_render_offset(spr, offset, alpha) for spr in sprites] if alpha is not None else [offset] * len(sprites)
         if hasattr(surf, "blits"):
             self.spritedict.update(
-                zip(sprites, surf.blits((spr.image, (spr.rect.x - offset[0], spr.rect.y - offset[1])) for spr in sprites))
+                zip(sprites, surf.blits((spr.image, (spr.rect.x - spr_offset[0], spr.rect.y - spr_offset[1])) for spr, spr_offset in zip(sprites, offsets)))
             )
         else:
-            for spr in sprites:
-                self.spritedict[spr] = surf.blit(spr.image, (spr.rect.x - offset[0], spr.rect.y - offset[1]))
+            for spr, spr_offset in zip(sprites, offsets):
+                self.spritedict[spr] = surf.blit(spr.image, (spr.rect.x - spr_offset[0], spr.rect.y - spr_offset[1]))
             
-    def render(self, surf, offset=(0, 0)):
+    def render(self, surf, offset=(0, 0), alpha=None):
         sprites = self.sprites()
         for sprite in sprites:
-            sprite.render(surf, offset)
+            sprite.render(surf, self.get_render_offset(sprite, offset, alpha))
 
 
 def get_reflect_vec(pos1, pos2, forcex, forcey):
@@ -36,8 +183,27 @@ def get_reflect_vec(pos1, pos2, forcex, forcey):
     return math.cos(angle) * forcex, math.sin(angle) * forcey
 
 
+def get_sprite_bounds(sprite):
+    # the area collide_mask can hit, masks are made from the image and placed at rect.topleft.
+    return pg.Rect(sprite.rect.topleft, sprite.image.get_size())
+
+
 def get_collision_sprites(player, *args):
     coll_list = []
     for group in args:
-        coll_list.extend(pg.sprite.spritecollide(player, group, False, pg.sprite.collide_mask))
+        coll_list.extend(group.collide(player))
     return coll_list
+
+
+def load_input_script(path) -> dict:
+    # [[frame, "down" / "up", key name], ...] -> {frame: [event, ...]}
+    with open(path, 'r') as f:
+        script = json.load(f)
+    events = {}
+    for frame, action, key in script:
+        event = pg.event.Event(pg.KEYDOWN if action == 'down' else pg.KEYUP, key=pg.key.key_code(key))
+        if frame in events:
+            events[frame].append(event)
+        else:
+            events[frame] = [event]
+    return events
@@ -1,39 +1,88 @@
 import pygame as pg
 from perlin_noise import PerlinNoise
-import random, json
+import numpy as np
+import math, random, threading
+from scripts.tilemap import Tilemap
+from scripts.autotile import AUTOTILE_TYPES, autotile, autotile_offgrid
 
 SURFACE_TILES = ['grass', 'stone', 'grassystone']
 MAX_Y = 6
+# noise samples the surface is made from, the map ends up about this many tiles wide.
+MAP_LENGTH = 100
 ENEMY_VARIANTS = [4, 5, 6]
 ENEMY_WEIGHTS = [5, 2, 1]
-AUTOTILE_NEIGHBORS = [(-1, 0), (0, -1), (0, 1), (1, 0)]
-AUTOTILE_DIAGONALS = [(-1, -1), (1, -1), (-1, 1), (1, 1)]
-AUTOTILE_TYPES = {'grass', 'stone', 'grassystone', 'bg_grass'}
-AUTOTILE_MAP_BASE = {
-    tuple(sorted([(1, 0), (0, 1)])): 0,
-    tuple(sorted([(1, 0), (0, 1), (-1, 0)])): 1,
-    tuple(sorted([(-1, 0), (0, 1)])): 2,
-    tuple(sorted([(-1, 0), (0, -1), (0, 1)])): 3,
-    tuple(sorted([(-1, 0), (0, -1)])): 4,
-    tuple(sorted([(-1, 0), (0, -1), (1, 0)])): 5,
-    tuple(sorted([(1, 0), (0, -1)])): 6,
-    tuple(sorted([(1, 0), (0, -1), (0, 1)])): 7,
-    tuple(sorted([(1, 0), (-1, 0), (0, 1), (0, -1)])): 8,
-    tuple(sorted([(1, 0), (-1, 0)])): 1,
-    tuple(sorted([(-1, 0)])): 2,
-    tuple(sorted([(0, -1), (0, 1)])): 3,
-    tuple(sorted([(0, -1)])): 5
-}
-AUTOTILE_MAP_CORNERS = {
-    9: {'exists': tuple(sorted([(-1, 1), (-1, 0), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)])), 'empty': tuple(sorted([(-1, -1)]))},
-    10: {'exists': tuple(sorted([(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, 1), (1, 0)])), 'empty': tuple(sorted([(1, -1)]))}
-}
-
-
-def tile_types_gen():
+# saved maps are rebuilt from their seed, bump this when a change makes a seed generate a different map.
+GENERATOR_VERSION = 1
+
+
+NOISE_OCTAVES = 80
+NOISE_SEED = 10
+NOISE_YPIX = 100
+noise = None
+# {(y_line, length): [height, ...]}, the noise is fixed, so a row only ever needs sampling once.
+noise_rows = {}
+# the preloader's worker and the main thread both generate maps. perlin_noise reseeds the global random module while it samples, so one at a time.
+noise_lock = threading.Lock()
+
+
+def get_noise():
+    global noise
+    if noise is None:
+        noise = PerlinNoise(octaves=NOISE_OCTAVES, seed=NOISE_SEED)
+    return noise
+
+def fade(values):
+    # same arithmetic as perlin_noise (math.pow), so the heights match it exactly.
+    return np.array([6 * math.pow(t, 5) - 15 * math.pow(t, 4) + 10 * math.pow(t, 3) for t in values])
+
+def corner_vector(noise, corner):
+    # the library's gradient vector at an integer corner. not public api, check_noise_rows() tells if it still works the same.
+    return noise.get_from_cache_of_create_new(corner).vec
+
+def sample_noise_row(y_line, length):
+    # PerlinNoise([y_line, j / NOISE_YPIX]) for every j in range(length) at once, using the library's own corner vectors.
+    noise = get_noise()
+    cy = y_line * noise.octaves
+    cx = np.arange(length) / NOISE_YPIX * noise.octaves
+    x0 = np.floor(cx).astype(np.int64)
+    first = int(x0[0])
+    values = np.zeros(length)
+    for corner_y in (math.floor(cy), math.floor(cy) + 1):
+        dy = cy - corner_y
+        weight_y = fade([1 - abs(dy)])[0]
+        for shift in (0, 1):
+            corner_x = x0 + shift
+            vecs = np.array([corner_vector(noise, (corner_y, x)) for x in range(first + shift, int(corner_x[-1]) + 1)])
+            vecs = vecs[corner_x - first - shift]
+            dx = cx - corner_x
+            values = values + weight_y * fade(1 - np.abs(dx)) * (vecs[:, 0] * dy + vecs[:, 1] * dx)
+    return values
+
+def sample_noise_row_scalar(y_line, length):
+    noise = get_noise()
+    return np.array([noise([y_line, j / NOISE_YPIX]) for j in range(length)])
+
+def check_noise_rows():
+    # a perlin_noise version whose internals sample differently would silently change every map, it gets called point by point instead.
+    try:
+        return np.array_equal(sample_noise_row(37, 64), sample_noise_row_scalar(37, 64))
+    except (AttributeError, TypeError):
+        return False
+
+VECTORIZED_NOISE = check_noise_rows()
+
+def get_noise_row(y_line, length):
+    key = (y_line, length)
+    with noise_lock:
+        if key not in noise_rows:
+            sample = sample_noise_row if VECTORIZED_NOISE else sample_noise_row_scalar
+            noise_rows[key] = np.round(sample(y_line, length) * 10).astype(np.int64).tolist()
+        return noise_rows[key]
+
+def tile_types_gen(rng):
     current_type = None
     while True:
-        tile_type = random.choice(SURFACE_TILES)
+        tile_type = rng.choice(SURFACE_TILES)
         if tile_type != current_type:
             yield tile_type
             current_type = tile_type
@@ -50,95 +99,92 @@ def check_water_boundaries(loc_list, index):
         elif _ == len(upcoming_ys) - 2:
             return False
 
-def check_platform_space(loc_list, index, plat_length):
-    surface_heights = set()
-    for n in range(-3, plat_length + 1):
-        ground_height = loc_list[index + n][1]
-        surface_heights.add(ground_height)
-    fin_sorted = sorted(surface_heights)
+def check_platform_space(heights, index, plat_length):
     # smallest y is highest
-    return fin_sorted[0]
-
-def convert_strtup_to_list(string) -> list:
-    tuple_string = string.strip('()').split(', ')
-    return [int(tuple_string[0]), int(tuple_string[1])]
+    return int(heights[index - 3:index + plat_length + 1].min())
 
+class MapGenerationError(Exception):
+    pass
 
 class RandomMapGenerator:
-    def __init__(self, game):
+    def __init__(self, game, length=MAP_LENGTH, tilemap=None, rng=None):
+        # tilemap / rng default to the game's, MapPreloader passes its own.
+        self.length = length
         self.tiles_dict = game.tile_dict.copy()
-        self.tilemap = game.tilemap  # tilemap: dict {"(0, 1)"": {'type': ...} ... }
-        # offgrid: list [{'type: ...} ... ]
+        self.rng = rng if rng is not None else game.rng
+        self.tilemap = tilemap if tilemap is not None else game.tilemap  # grid: TileGrid, offgrid: list [{'type: ...} ... ]
+        # grid locations in the order they were first placed, the placement passes walk the map in this order.
+        self.placed = {}
+        self.spawnpoint_locs = []
     
+    def set_tile(self, loc, t_type, variant):
+        self.tilemap.grid.set(loc[0], loc[1], t_type, variant)
+        self.placed[(loc[0], loc[1])] = None
+
+    def set_spawnpoint(self, loc, variant):
+        # a tile until the map is done, then moved to the tilemap's spawnpoint index.
+        self.set_tile(loc, 'spawnpoint', variant)
+        self.spawnpoint_locs.append((loc[0], loc[1]))
+
     def make_noise(self):
-        y_values = []
-        noise = PerlinNoise(octaves=80, seed=10)
-        xpix, ypix = 100, 100
-        y_line = random.randint(1, xpix)
-        height_values = [noise([y_line, j/ypix]) for j in range(xpix)]
-        for i in height_values:
-            y_values.append(round(i * 10))
-        return y_values
+        y_line = self.rng.randint(1, NOISE_YPIX)
+        return get_noise_row(y_line, self.length)
     
     def adjust_singles(self, y_list):
-        mod = 0
+        # builds a new list instead of inserting into y_list. the neighbour before y_list[i] and the copied tile
+        # (index i of the list so far) are read from the new list, which is what the in-place version saw.
+        if len(y_list) < 3:
+            return list(y_list)
+        adjusted = [y_list[0]]
         for i in range(1, len(y_list) - 1):
-            if y_list[i+mod] != (y_list[i+mod-1] and y_list[i+mod+1]):
-                y_list.insert(i+1+mod, y_list[i])
-                mod += 1
+            adjusted.append(y_list[i])
+            if y_list[i] != (adjusted[-2] and y_list[i+1]):
+                adjusted.append(adjusted[i])
                 for _ in range(5):
-                    if random.randint(1, 4) == 1:
-                        y_list.insert(i+1+mod, y_list[i+mod+1])
-                        mod += 1
+                    if self.rng.randint(1, 4) == 1:
+                        adjusted.append(y_list[i+1])
+        adjusted.append(y_list[-1])
+        return adjusted
     
     def adjust_heights(self, y_list):
-        mod = 0
-        for i in range(len(y_list) - 1):
-            diff = y_list[i+mod] - y_list[i+mod+1]
-            if abs(diff) >= 4:
-                y_list.insert(i+1+mod, y_list[i+mod] - int(abs(diff) / diff / 2))
-                y_list.insert(i+2+mod, y_list[i+mod] - int(abs(diff) / diff / 2))
-                mod += 2
-        for item in y_list:
-            if item > MAX_Y:
-                y_list.remove(item)
+        # the tile before a step of 4 or more is repeated twice more.
+        y_array = np.array(y_list)
+        counts = np.ones(len(y_array), np.int64)
+        counts[:-1][np.abs(np.diff(y_array)) >= 4] = 3
+        y_list = np.repeat(y_array, counts).tolist()
+        if max(y_list, default=0) > MAX_Y:
+            # rare, kept as the original in-place removal since it skips the item after each removed one.
+            for item in y_list:
+                if item > MAX_Y:
+                    y_list.remove(item)
+        return y_list
     
     def remove_singles(self, y_list):
-        copied_list = []
-        for i in range(1, len(y_list) - 1):
-            if y_list[i] != y_list[i+1]:
-                if y_list[i] == y_list[i-1]:
-                    copied_list.append(y_list[i])
-            else:
-                copied_list.append(y_list[i])
-        return copied_list
+        y_array = np.array(y_list)
+        middle = y_array[1:-1]
+        return middle[(middle == y_array[2:]) | (middle == y_array[:-2])]
     
-    def adjust_first_last(self, y_list):
-        while y_list[0] != y_list[1]:
-            y_list.pop(0)
-        while y_list[-1] != y_list[-2]:
-            y_list.pop()
-
-    def add_x_locs(self, y_list):
-        loc_list = []
-        for x in range(len(y_list)):
-            loc_tup = x, y_list[x]
-            loc_list.append(loc_tup)
-        return loc_list
+    def adjust_first_last(self, y_array):
+        # trims the ends back to the first and last pair of equal heights.
+        pairs = np.flatnonzero(y_array[:-1] == y_array[1:])
+        return y_array[pairs[0]:pairs[-1] + 2]
+
+    def add_x_locs(self, y_array):
+        return list(enumerate(y_array.tolist()))
     
     def make_noise_surface(self):
         ys_list = self.make_noise()
-        self.adjust_singles(ys_list)
-        self.adjust_heights(ys_list)
-        final_ys_list = self.remove_singles(ys_list)
-        self.adjust_first_last(final_ys_list)
-        locations_list = self.add_x_locs(final_ys_list)
+        ys_list = self.adjust_singles(ys_list)
+        ys_list = self.adjust_heights(ys_list)
+        final_ys = self.remove_singles(ys_list)
+        final_ys = self.adjust_first_last(final_ys)
+        locations_list = self.add_x_locs(final_ys)
         # [(0, 1), (1, 1) ... ]
         return locations_list
 
 
     def set_surface_tile_types(self, loc_list):
-        tile_picker = tile_types_gen()
+        tile_picker = tile_types_gen(self.rng)
         can_change_type = False
         t_type = next(tile_picker)
         tile_before_water = 0
@@ -152,70 +198,70 @@ class RandomMapGenerator:
                     can_change_type = False
             if 10 < index < len(loc_list) - 10:
                 if loc_list[index][1] == loc_list[index + 1][1] and loc_list[index][1] > 0 and loc_list[index][1] > loc_list[index - 1][1]:
-                    if t_type != 'water' and random.randint(1, 2) == 1:
+                    if t_type != 'water' and self.rng.randint(1, 2) == 1:
                         if check_water_boundaries(loc_list, index):
                             t_type = 'water'
             if t_type == 'water':
                 tile_before_water += 1
                 if loc_list[index][1] < loc_list[index - 1][1]:
-                    t_type = self.tilemap.tilemap[str(loc_list[index - tile_before_water])]['type']
+                    t_type = self.tilemap.grid.get_type(*loc_list[index - tile_before_water])
                     tile_before_water = 0
                 elif index < len(loc_list) - 1 and loc_list[index][1] != loc_list[index + 1][1]:
                     water_variant = 2
             loc = loc_list[index]
             if t_type == 'water':
                 if tile_before_water == 1:
-                    self.tilemap.tilemap[str(loc)] = {'type': t_type, 'variant': 0, 'pos': [loc[0], loc[1]]}
+                    self.set_tile(loc, t_type, 0)
                 else:
-                    self.tilemap.tilemap[str(loc)] = {'type': t_type, 'variant': water_variant, 'pos': [loc[0], loc[1]]}
+                    self.set_tile(loc, t_type, water_variant)
             else:
-                self.tilemap.tilemap[str(loc)] = {'type': t_type, 'variant': 1, 'pos': [loc[0], loc[1]]}
+                self.set_tile(loc, t_type, 1)
 
     def create_floating_platforms(self, loc_list):
-        tile_picker = tile_types_gen()
+        tile_picker = tile_types_gen(self.rng)
         tile_type = next(tile_picker)
-        platform_length = random.randint(2, 8)
-        platform_height = random.randint(2, 5)
+        platform_length = self.rng.randint(2, 8)
+        platform_height = self.rng.randint(2, 5)
         placing = False
+        heights = np.array([loc[1] for loc in loc_list])
         for index in range(6, len(loc_list) - 10):
             if (index + 1) % 20 == 0:
                 tile_type = next(tile_picker)
             loc = loc_list[index]  # (x, y)
-            if random.randint(1, 4) == 1 and not placing:
-                plat_bottom = loc[1] - random.randint(3, 8)
+            if self.rng.randint(1, 4) == 1 and not placing:
+                plat_bottom = loc[1] - self.rng.randint(3, 8)
                 plat_loc = loc[0], plat_bottom
-                lowest_y = check_platform_space(loc_list, index, platform_length)
+                lowest_y = check_platform_space(heights, index, platform_length)
                 if lowest_y > plat_bottom + 2:
                     placing = True
             if placing:
                 for x in range(platform_length):
                     for y in range(platform_height):
-                        self.tilemap.tilemap[str((plat_loc[0] + x, plat_loc[1] - y))] = {'type': tile_type, 'variant': 1, 'pos': [plat_loc[0] + x, plat_loc[1] - y]}
+                        self.set_tile((plat_loc[0] + x, plat_loc[1] - y), tile_type, 1)
                 placing = False
-                platform_length = random.randint(2, 8)
-                platform_height = random.randint(2, 5)
+                platform_length = self.rng.randint(2, 8)
+                platform_height = self.rng.randint(2, 5)
     
     def fill_ground(self, loc_list):
         for loc in loc_list:
-            t_type = self.tilemap.tilemap[str(loc)]['type']
+            t_type = self.tilemap.grid.get_type(loc[0], loc[1])
             for y in range(loc[1] + 1, MAX_Y + 1):
-                self.tilemap.tilemap[str((loc[0], y))] = {'type': t_type, 'variant': 1, 'pos': [loc[0], y]}
+                self.set_tile((loc[0], y), t_type, 1)
     
     def check_flat_surface(self, tile_loc, length: int):
-        t_loc = convert_strtup_to_list(tile_loc)
-        cur_x = t_loc[0]
-        cur_y = t_loc[1]
+        cur_x = tile_loc[0]
+        cur_y = tile_loc[1]
         if length == 2:
-            locs_to_check = [str((cur_x + 1, cur_y))]
-            locs_to_exclude = [str((cur_x + 1, cur_y - 1))]
+            locs_to_check = [(cur_x + 1, cur_y)]
+            locs_to_exclude = [(cur_x + 1, cur_y - 1)]
         elif length == 3:
-            locs_to_check = [str((cur_x - 1, cur_y)), str((cur_x + 1, cur_y))]
-            locs_to_exclude = [str((cur_x - 1, cur_y - 1)), str((cur_x + 1, cur_y - 1))]
+            locs_to_check = [(cur_x - 1, cur_y), (cur_x + 1, cur_y)]
+            locs_to_exclude = [(cur_x - 1, cur_y - 1), (cur_x + 1, cur_y - 1)]
         elif length == 4:
-            locs_to_check = [str((cur_x + 1, cur_y)), str((cur_x + 2, cur_y)), str((cur_x + 3, cur_y)), str((cur_x + 4, cur_y))]
-            locs_to_exclude = [str((cur_x + 1, cur_y - 1)), str((cur_x + 2, cur_y - 1)), str((cur_x + 3, cur_y - 1)), str((cur_x + 4, cur_y - 1))]
-        if all(loc in self.tilemap.tilemap for loc in locs_to_check):
-            if not any(exloc in self.tilemap.tilemap for exloc in locs_to_exclude):
+            locs_to_check = [(cur_x + 1, cur_y), (cur_x + 2, cur_y), (cur_x + 3, cur_y), (cur_x + 4, cur_y)]
+            locs_to_exclude = [(cur_x + 1, cur_y - 1), (cur_x + 2, cur_y - 1), (cur_x + 3, cur_y - 1), (cur_x + 4, cur_y - 1)]
+        if all(loc in self.tilemap.grid for loc in locs_to_check):
+            if not any(exloc in self.tilemap.grid for exloc in locs_to_exclude):
                 return True
         else:
             return False
@@ -226,75 +272,64 @@ class RandomMapGenerator:
         r_chest_placed = False
         enemy_cooldown = 30
         n_chest_cooldown = 50
-        t_x = set()
-        t_y = set()
-        for location in self.tilemap.tilemap.copy():
-            t_x.add(convert_strtup_to_list(location)[0])
-            t_y.add(convert_strtup_to_list(location)[1])
-        tilemap_length = sorted(t_x, reverse=True)[0]
-        tilemap_height = sorted(t_y)[0]
+        min_x, min_y, max_x, max_y = self.tilemap.grid.bounds()
+        tilemap_length = max_x
+        tilemap_height = min_y
         for index in range(len(loc_list)):
             loc = loc_list[index]
-            if 4 < index < 12 and self.check_flat_surface(str(loc_list[index]), 2) and not player_placed:
-                self.tilemap.tilemap[str((loc[0], loc[1] - 1))] = {'type': 'spawnpoint', 'variant': 0, 'pos': [loc[0], loc[1] - 1]}
+            if 4 < index < 12 and self.check_flat_surface(loc_list[index], 2) and not player_placed:
+                self.set_spawnpoint((loc[0], loc[1] - 1), 0)
                 player_placed = True
         for b_index in range(len(loc_list) - 4, len(loc_list) - 16, -1):
             b_loc = loc_list[b_index]
-            if self.check_flat_surface(str(loc_list[b_index]), 3) and not portal_placed:
-                self.tilemap.tilemap[str((b_loc[0], b_loc[1] - 2))] = {'type': 'spawnpoint', 'variant': 1, 'pos': [b_loc[0], b_loc[1] - 2]}
+            if self.check_flat_surface(loc_list[b_index], 3) and not portal_placed:
+                self.set_spawnpoint((b_loc[0], b_loc[1] - 2), 1)
                 portal_placed = True
-        for location in self.tilemap.tilemap.copy():
-            t_loc = convert_strtup_to_list(location)
-            check_ys = [str((t_loc[0], t_loc[1] - 1)), str((t_loc[0], t_loc[1] - 2))]
-            if not any(check in self.tilemap.tilemap for check in check_ys):
+        for t_loc in list(self.placed):
+            check_ys = [(t_loc[0], t_loc[1] - 1), (t_loc[0], t_loc[1] - 2)]
+            if not any(check in self.tilemap.grid for check in check_ys):
                 if not r_chest_placed and t_loc[1] == tilemap_height:
-                    self.tilemap.tilemap[str((t_loc[0] + 1, t_loc[1] - 1))] = {'type': 'spawnpoint', 'variant': 3, 'pos': [t_loc[0] + 1, t_loc[1] - 1]}
+                    self.set_spawnpoint((t_loc[0] + 1, t_loc[1] - 1), 3)
                     r_chest_placed = True
                 if 15 < t_loc[0] < tilemap_length - 16:
-                    if self.tilemap.tilemap[str((t_loc[0], t_loc[1]))]['type'] != 'water':
-                        if self.check_flat_surface(location, 2):
-                            if random.randint(1, 4) == 1 and not enemy_cooldown:
-                                self.tilemap.tilemap[str((t_loc[0], t_loc[1] - 1))] = {'type': 'spawnpoint', 'variant': random.choices(ENEMY_VARIANTS, ENEMY_WEIGHTS)[0], 'pos': [t_loc[0], t_loc[1] - 1]}
+                    if self.tilemap.grid.get_type(t_loc[0], t_loc[1]) != 'water':
+                        if self.check_flat_surface(t_loc, 2):
+                            if self.rng.randint(1, 4) == 1 and not enemy_cooldown:
+                                self.set_spawnpoint((t_loc[0], t_loc[1] - 1), self.rng.choices(ENEMY_VARIANTS, ENEMY_WEIGHTS)[0])
                                 enemy_cooldown = 30
-                        if self.check_flat_surface(location, 3):
-                            if random.randint(1, 8) == 1 and not n_chest_cooldown:
-                                self.tilemap.tilemap[str((t_loc[0], t_loc[1] - 1))] = {'type': 'spawnpoint', 'variant': 2, 'pos': [t_loc[0], t_loc[1] - 1]}
+                        if self.check_flat_surface(t_loc, 3):
+                            if self.rng.randint(1, 8) == 1 and not n_chest_cooldown:
+                                self.set_spawnpoint((t_loc[0], t_loc[1] - 1), 2)
                                 n_chest_cooldown = 60
             enemy_cooldown = max(enemy_cooldown - 1, 0)
             n_chest_cooldown = max(n_chest_cooldown - 1, 0)
             if not player_placed:
-                raise Exception("Player spawnpoint not in map!")
+                raise MapGenerationError("Player spawnpoint not in map!")
             if not portal_placed:
-                raise Exception("No portal to exit the map!")
+                raise MapGenerationError("No portal to exit the map!")
     
     def place_decor(self):
-        for loc in self.tilemap.tilemap:
-            tile = self.tilemap.tilemap[loc]
-            list_loc = convert_strtup_to_list(loc)
-            check_y = list_loc[0], list_loc[1] - 1
-            if str(check_y) not in self.tilemap.tilemap:
-                offgrid_loc = tile['pos'][0] * 16 + random.randint(1, 3), (tile['pos'][1] - 1) * 16
-                if tile['type'] == 'grass':
-                    if random.randint(1, 3) == 1:
-                        self.tilemap.offgrid_tiles.append({"type": "decor", "variant": random.choice(range(0, 8)), "pos": [offgrid_loc[0], offgrid_loc[1]]})
-                if tile['type'] == 'stone':
-                    if random.randint(1, 4) == 1:
-                        self.tilemap.offgrid_tiles.append({"type": "decor", "variant": random.choice(range(8, 12)), "pos": [offgrid_loc[0], offgrid_loc[1]]})
-                if tile['type'] == 'grassystone':
-                    if random.randint(1, 5) == 1:
-                        self.tilemap.offgrid_tiles.append({"type": "decor", "variant": random.choice(list(range(11, 15)) + [6, 7]), "pos": [offgrid_loc[0], offgrid_loc[1]]})
-
-    def check_flat_bottom(self, cd_list, index, length):
+        for loc in self.placed:
+            t_type = self.tilemap.grid.get_type(loc[0], loc[1])
+            check_y = loc[0], loc[1] - 1
+            if check_y not in self.tilemap.grid:
+                offgrid_loc = loc[0] * 16 + self.rng.randint(1, 3), (loc[1] - 1) * 16
+                if t_type == 'grass':
+                    if self.rng.randint(1, 3) == 1:
+                        self.tilemap.add_offgrid({"type": "decor", "variant": self.rng.choice(range(0, 8)), "pos": [offgrid_loc[0], offgrid_loc[1]]})
+                if t_type == 'stone':
+                    if self.rng.randint(1, 4) == 1:
+                        self.tilemap.add_offgrid({"type": "decor", "variant": self.rng.choice(range(8, 12)), "pos": [offgrid_loc[0], offgrid_loc[1]]})
+                if t_type == 'grassystone':
+                    if self.rng.randint(1, 5) == 1:
+                        self.tilemap.add_offgrid({"type": "decor", "variant": self.rng.choice(list(range(11, 15)) + [6, 7]), "pos": [offgrid_loc[0], offgrid_loc[1]]})
+
+    def check_flat_bottom(self, cd_list, cd_set, index, length):
+        # cd_set: the coordinates of cd_list as tuples, for the lookups.
         cur_x = cd_list[index][0]
         cur_y = cd_list[index][1]
-        if cur_y != MAX_Y and [cur_x, cur_y + 1] not in cd_list:
-            if length == 2:
-                locs_to_check = [[cur_x, cur_y], [cur_x + 1, cur_y]]
-            elif length == 3:
-                locs_to_check = [[cur_x, cur_y], [cur_x + 1, cur_y], [cur_x + 2, cur_y]]
-            elif length == 4:
-                locs_to_check = [[cur_x, cur_y], [cur_x + 1, cur_y], [cur_x + 2, cur_y], [cur_x + 3, cur_y]]
-            if all(loc in cd_list for loc in locs_to_check):
+        if cur_y != MAX_Y and (cur_x, cur_y + 1) not in cd_set:
+            if all((cur_x + i, cur_y) in cd_set for i in range(length)):
                 return True
         else:
             return False
@@ -302,97 +337,58 @@ class RandomMapGenerator:
     def place_bg_decor(self, loc_list):
         tree_cooldown = 0
         for ind in range(10, len(loc_list) - 15):
-            if self.check_flat_surface(str(loc_list[ind]), 4) and not tree_cooldown:
-                if random.randint(1, 2) == 1:
-                    offgrid_loc = loc_list[ind][0] * 16 + random.randint(1, 5), loc_list[ind][1] * 16 - 147
-                    self.tilemap.offgrid_tiles.append({"type": "bg_foliage", "variant": 0, "pos": [offgrid_loc[0], offgrid_loc[1]]})
+            if self.check_flat_surface(loc_list[ind], 4) and not tree_cooldown:
+                if self.rng.randint(1, 2) == 1:
+                    offgrid_loc = loc_list[ind][0] * 16 + self.rng.randint(1, 5), loc_list[ind][1] * 16 - 147
+                    self.tilemap.add_offgrid({"type": "bg_foliage", "variant": 0, "pos": [offgrid_loc[0], offgrid_loc[1]]})
                     tree_cooldown = 15
             tree_cooldown = max(tree_cooldown - 1, 0)
-        all_coords = [tile['pos'] for tile in self.tilemap.tilemap.values()]
+        all_coords = [[x, y] for x, y in self.tilemap.grid]
         # list containing lists
         all_coords.sort()
+        coords_set = {(x, y) for x, y in all_coords}
         for i in range(10, len(all_coords) - 15):
             offgrid_loc = all_coords[i][0] * 16, (all_coords[i][1] + 1) * 16
             if all_coords[i][1] < -2:
-                if self.check_flat_bottom(all_coords, i, 3) and random.randint(1, 5) == 1:
-                    self.tilemap.offgrid_tiles.append({"type": "bg_foliage", "variant": random.randint(1, 3), "pos": [offgrid_loc[0] + random.randint(-2, 2), offgrid_loc[1] - 5]})
-                elif self.check_flat_bottom(all_coords, i, 4) and random.randint(1, 8) == 1:
-                    self.tilemap.offgrid_tiles.append({"type": "bg_foliage", "variant": random.randint(4, 5), "pos": [offgrid_loc[0] + random.randint(-2, 2), offgrid_loc[1]]})
+                if self.check_flat_bottom(all_coords, coords_set, i, 3) and self.rng.randint(1, 5) == 1:
+                    self.tilemap.add_offgrid({"type": "bg_foliage", "variant": self.rng.randint(1, 3), "pos": [offgrid_loc[0] + self.rng.randint(-2, 2), offgrid_loc[1] - 5]})
+                elif self.check_flat_bottom(all_coords, coords_set, i, 4) and self.rng.randint(1, 8) == 1:
+                    self.tilemap.add_offgrid({"type": "bg_foliage", "variant": self.rng.randint(4, 5), "pos": [offgrid_loc[0] + self.rng.randint(-2, 2), offgrid_loc[1]]})
         t_x = set()
         t_y = set()
-        for location in self.tilemap.tilemap:
-            t_x.add(int(convert_strtup_to_list(location)[0]))
-            t_y.add(int(convert_strtup_to_list(location)[1]))
+        for x, y in self.tilemap.grid:
+            t_x.add(x)
+            t_y.add(y)
         tilemap_x_locs = sorted(t_x)
         tilemap_length = len(t_x)
         tilemap_height = sorted(t_y)[0]
-        bg_grass_length = random.randint(2, 6)
-        bg_grass_height = random.randint(2, 4)
+        bg_grass_length = self.rng.randint(2, 6)
+        bg_grass_height = self.rng.randint(2, 4)
         placing = False
         for index in range(20, tilemap_length - 10):
             g_loc_x = tilemap_x_locs[index]
-            g_loc_y = random.randint(tilemap_height - 1, tilemap_height + 15)
+            g_loc_y = self.rng.randint(tilemap_height - 1, tilemap_height + 15)
             offgrid_g_loc = g_loc_x * 16, g_loc_y * 16
-            if random.randint(1, 11) == 1 and not placing:
+            if self.rng.randint(1, 11) == 1 and not placing:
                     placing = True
             if placing:
                 for x in range(bg_grass_length):
                     for y in range(bg_grass_height):
-                        self.tilemap.offgrid_tiles.append({"type": "bg_grass", "variant": 1, "pos": [offgrid_g_loc[0] + x * 16, offgrid_g_loc[1] - y * 16]})
+                        self.tilemap.add_offgrid({"type": "bg_grass", "variant": 1, "pos": [offgrid_g_loc[0] + x * 16, offgrid_g_loc[1] - y * 16]})
                 placing = False
-                bg_grass_length = random.randint(2, 6)
-                bg_grass_height = random.randint(2, 4)
+                bg_grass_length = self.rng.randint(2, 6)
+                bg_grass_height = self.rng.randint(2, 4)
     
     def auto_tile(self):
-        for loc in self.tilemap.tilemap:
-            tile = self.tilemap.tilemap[loc]
-            existing_neighbors = set()
-            empty_neighbors = set()
-            if tile['type'] in AUTOTILE_TYPES:
-                for shift in AUTOTILE_NEIGHBORS:
-                    check_loc = str((tile['pos'][0] + shift[0], tile['pos'][1] + shift[1]))
-                    if check_loc in self.tilemap.tilemap:
-                        if self.tilemap.tilemap[check_loc]['type'] == tile['type']:
-                            existing_neighbors.add(shift)
-                    else:
-                        empty_neighbors.add(shift)
-                basic_neighbors = tuple(sorted(existing_neighbors))
-                if basic_neighbors in AUTOTILE_MAP_BASE:
-                    tile['variant'] = AUTOTILE_MAP_BASE[basic_neighbors]
-                for shift in AUTOTILE_DIAGONALS:
-                    check_loc = str((tile['pos'][0] + shift[0], tile['pos'][1] + shift[1]))
-                    if check_loc in self.tilemap.tilemap:
-                        if self.tilemap.tilemap[check_loc]['type'] == tile['type']:
-                            existing_neighbors.add(shift)
-                    else:
-                        empty_neighbors.add(shift)
-                all_neighbors = tuple(sorted(existing_neighbors))
-                empty_neighbors = tuple(sorted(empty_neighbors))
-                for variant, condition in AUTOTILE_MAP_CORNERS.items():
-                    if all_neighbors == condition['exists'] and empty_neighbors == condition['empty']:
-                        tile['variant'] = int(variant)
-            tile_above = str((tile['pos'][0], tile['pos'][1] - 1))
-            if self.tilemap.tilemap.get(tile_above) and self.tilemap.tilemap[tile_above]['type'] == 'water':
-                tile['variant'] = 3
+        autotile(self.tilemap.grid)
         og_grass_tiles = []
-        og_grass_locs = []
-        copied_og_tiles = self.tilemap.offgrid_tiles.copy()
-        for index in range(len(copied_og_tiles)):
-            og_tile = copied_og_tiles[index]
-            if og_tile['type'] in AUTOTILE_TYPES:
-                self.tilemap.offgrid_tiles.remove(og_tile)
-                og_grass_tiles.append(og_tile)
-                og_grass_locs.append(og_tile['pos'])
-        for grass_tile in og_grass_tiles:
-            og_neighbors = set()
-            for shift in AUTOTILE_NEIGHBORS:
-                check_og_loc = [grass_tile['pos'][0] + shift[0] * 16, grass_tile['pos'][1] + shift[1] * 16]
-                if check_og_loc in og_grass_locs:
-                    og_neighbors.add(shift)
-            og_neighbors = tuple(sorted(og_neighbors))
-            if og_neighbors in AUTOTILE_MAP_BASE:
-                    grass_tile['variant'] = AUTOTILE_MAP_BASE[og_neighbors]
-            self.tilemap.offgrid_tiles.insert(0, grass_tile)
+        for t_type in sorted(AUTOTILE_TYPES):
+            og_grass_tiles.extend(self.tilemap.offgrid_index.query_type(t_type))
+        autotile_offgrid(og_grass_tiles)
+        # autotiled offgrid tiles go to the front of the list (drawn first), the index is rebuilt for the new variants.
+        grass_ids = {id(og_tile) for og_tile in og_grass_tiles}
+        other_tiles = [og_tile for og_tile in self.tilemap.get_offgrid_tiles() if id(og_tile) not in grass_ids]
+        self.tilemap.set_offgrid(og_grass_tiles[::-1] + other_tiles)
 
 
 
@@ -401,20 +397,94 @@ class RandomMapGenerator:
         self.set_surface_tile_types(surf_list)
         self.fill_ground(surf_list)
         self.create_floating_platforms(surf_list)
-        while True:
-            try:
-                self.place_spawnpoints(surf_list)
-            except:
-                print("map_gen_error")
-            else:
-                break
+        # placement does not depend on the rng, retrying the same surface would fail forever.
+        self.place_spawnpoints(surf_list)
         self.place_bg_decor(surf_list)
         self.place_decor()
         self.auto_tile()
+        self.tilemap.index_spawnpoints(self.spawnpoint_locs)
 
 
+class MapPreloader:
+    """Generates and bakes the next map on a worker thread while the current one is played."""
+    def __init__(self, game, length=MAP_LENGTH, max_attempts=10):
+        self.game = game
+        self.length = length
+        self.max_attempts = max_attempts
+        self.thread = None
+        # what the map being prepared is generated from, None before the first start().
+        self.seed = None
+        self.tilemap = None
+        self.error = None
 
+    def generate(self, seed, length=None):
+        # a map that fails spawnpoint placement is thrown away, the next attempt's seed comes from the failed one's rng.
+        length = length if length is not None else self.length
+        attempt_seed = seed
+        for attempt in range(self.max_attempts):
+            rng = random.Random(attempt_seed)
+            tilemap = Tilemap(self.game)
+            try:
+                RandomMapGenerator(self.game, length, tilemap, rng).generate_random_map()
+            except MapGenerationError:
+                print("map_gen_error")
+                attempt_seed = rng.getrandbits(32)
+            else:
+                # the same seed and length always give this map back, saves store only those.
+                tilemap.seed = seed
+                tilemap.length = length
+                tilemap.bake()
+                return tilemap
+        raise MapGenerationError("no valid map in %d attempts" % self.max_attempts)
 
+    def run(self, seed):
+        try:
+            self.tilemap = self.generate(seed)
+        except Exception as error:
+            self.error = error
 
-    
-    
\ No newline at end of file
+    def start(self, seed=None):
+        # the seed is drawn here, on the main thread, so the maps of a run only depend on the game seed.
+        if seed is None:
+            seed = self.game.rng.getrandbits(32)
+        self.seed = seed
+        self.tilemap = None
+        self.error = None
+        self.thread = threading.Thread(target=self.run, args=(seed,), daemon=True)
+        self.thread.start()
+
+    def prepare(self):
+        # starts on the next map, unless one is already being prepared. called once a stage is set up.
+        if self.thread is None:
+            self.start()
+
+    def wait(self):
+        if self.thread is not None:
+            self.thread.join()
+
+    def take(self):
+        # the prepared map, waits for the worker if it is not done. the one after it is started by prepare().
+        if self.thread is None:
+            # nothing was prepared (a restored game state from before the first one)
+            self.start()
+        self.wait()
+        tilemap, error = self.tilemap, self.error
+        self.thread = None
+        self.seed = None
+        self.tilemap = None
+        self.error = None
+        if error:
+            raise error
+        return tilemap
+
+    def reset(self, seed):
+        # prepares the map of seed instead, or goes back to not started when it is None. used when a game state is restored.
+        if seed == self.seed:
+            return
+        self.wait()
+        self.thread = None
+        self.seed = None
+        self.tilemap = None
+        self.error = None
+        if seed is not None:
+            self.start(seed)
@@ -0,0 +1,128 @@
+import json, mmap, struct
+import numpy as np
+
+
+MAP_MAGIC = b'PMAP'
+MAP_VERSION = 2
+# magic, version, bytes per tile id, tiles per chunk, palette json size, chunk count, offgrid tile count, spawnpoint count
+MAP_HEADER = struct.Struct('<4sBBHIIII')
+# version 1 files, from before the spawnpoint table.
+MAP_HEADER_V1 = struct.Struct('<4sBBHIII')
+CHUNK_KEY = np.dtype([('cx', '<i4'), ('cy', '<i4')])
+# index into the offgrid palette, pos in px
+OFFGRID_TILE = np.dtype([('tile', '<u2'), ('x', '<i4'), ('y', '<i4')])
+# pos in px
+SPAWNPOINT = np.dtype([('variant', 'u1'), ('x', '<i4'), ('y', '<i4')])
+
+# a generated map saved as its seed plus what changed since it was generated.
+MAP_DELTA_MAGIC = b'PMDL'
+MAP_DELTA_VERSION = 1
+# magic, version, generator version, seed, map length, player x, player y (px), removed spawnpoint count, opened chest count
+MAP_DELTA_HEADER = struct.Struct('<4sBBIHiiHH')
+
+
+def read_magic(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MAP_MAGIC))
+
+def is_map_file(path):
+    # binary map, anything else is taken for a legacy json one.
+    return read_magic(path) == MAP_MAGIC
+
+def is_map_delta(path):
+    return read_magic(path) == MAP_DELTA_MAGIC
+
+
+def write_map(path, grid, offgrid_tiles, spawnpoints=()):
+    with open(path, 'wb') as f:
+        f.write(encode_map(grid, offgrid_tiles, spawnpoints))
+
+
+def encode_map(grid, offgrid_tiles, spawnpoints=()):
+    """A TileGrid, offgrid list and spawnpoint index as bytes: header, palette json, chunk keys, chunk tile ids, offgrid table, spawnpoint table."""
+    keys = list(grid.chunks)
+    chunk_area = len(grid.chunks[keys[0]]) if keys else 0
+    ids = np.array([np.frombuffer(grid.chunks[key], np.uint16) for key in keys], np.uint16).reshape(len(keys), chunk_area)
+    # only the palette entries still in use, renumbered in palette order. chunks left empty are dropped.
+    used = np.unique(ids)
+    used = used[used != 0]
+    remap = np.zeros(len(grid.palette), np.uint16)
+    remap[used] = np.arange(1, len(used) + 1)
+    ids = remap[ids]
+    kept = ids.any(axis=1)
+    ids = ids[kept]
+    chunk_keys = np.array([key for key, keep in zip(keys, kept.tolist()) if keep], CHUNK_KEY)
+    id_size = 1 if len(used) < 256 else 2
+    palette = [list(grid.palette[tile_id]) for tile_id in used.tolist()]
+
+    offgrid_palette = []
+    offgrid_ids = {}
+    offgrid = np.zeros(len(offgrid_tiles), OFFGRID_TILE)
+    for i, tile in enumerate(offgrid_tiles):
+        key = (tile['type'], tile['variant'])
+        if key not in offgrid_ids:
+            offgrid_ids[key] = len(offgrid_palette)
+            offgrid_palette.append(list(key))
+        offgrid[i] = (offgrid_ids[key], tile['pos'][0], tile['pos'][1])
+
+    spawnpoint_table = np.array([(spawnpoint['variant'], spawnpoint['pos'][0], spawnpoint['pos'][1]) for spawnpoint in spawnpoints], SPAWNPOINT)
+
+    palette_json = json.dumps({'tiles': palette, 'offgrid': offgrid_palette}).encode()
+    header = MAP_HEADER.pack(MAP_MAGIC, MAP_VERSION, id_size, chunk_area, len(palette_json), len(chunk_keys), len(offgrid), len(spawnpoint_table))
+    return b''.join([header, palette_json, chunk_keys.tobytes(), ids.astype('<u%d' % id_size).tobytes(), offgrid.tobytes(), spawnpoint_table.tobytes()])
+
+
+def read_map(path):
+    """(palette, chunks, chunk area, offgrid tiles, spawnpoints) from a binary map. chunks are views into one uint16 buffer holding every chunk.
+    spawnpoints is None for version 1 maps, those still have them in the grid."""
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        view = memoryview(data)
+        try:
+            magic, version = struct.unpack_from('<4sB', view)
+            if magic != MAP_MAGIC or version not in (1, MAP_VERSION):
+                raise ValueError('%s is not a version %d map' % (path, MAP_VERSION))
+            if version == 1:
+                magic, version, id_size, chunk_area, palette_size, chunk_count, offgrid_count = MAP_HEADER_V1.unpack_from(view)
+                offset = MAP_HEADER_V1.size
+            else:
+                magic, version, id_size, chunk_area, palette_size, chunk_count, offgrid_count, spawnpoint_count = MAP_HEADER.unpack_from(view)
+                offset = MAP_HEADER.size
+            palette_json = json.loads(bytes(view[offset:offset + palette_size]))
+            offset += palette_size
+            chunk_keys = np.frombuffer(view, CHUNK_KEY, chunk_count, offset).tolist()
+            offset += chunk_count * CHUNK_KEY.itemsize
+            # the one copy out of the file, widened to the uint16 cells the grid works with.
+            ids = np.frombuffer(view, '<u%d' % id_size, chunk_count * chunk_area, offset).astype(np.uint16)
+            offset += chunk_count * chunk_area * id_size
+            offgrid = np.frombuffer(view, OFFGRID_TILE, offgrid_count, offset).tolist()
+            offset += offgrid_count * OFFGRID_TILE.itemsize
+            spawnpoints = np.frombuffer(view, SPAWNPOINT, spawnpoint_count, offset).tolist() if version > 1 else None
+        finally:
+            view.release()
+
+    palette = [None] + [tuple(tile) for tile in palette_json['tiles']]
+    cells = memoryview(ids)
+    chunks = {tuple(key): cells[i * chunk_area:(i + 1) * chunk_area] for i, key in enumerate(chunk_keys)}
+    offgrid_palette = palette_json['offgrid']
+    offgrid_tiles = [{'type': offgrid_palette[tile][0], 'variant': offgrid_palette[tile][1], 'pos': [x, y]} for tile, x, y in offgrid]
+    if spawnpoints is not None:
+        spawnpoints = [{'variant': variant, 'pos': [x, y]} for variant, x, y in spawnpoints]
+    return palette, chunks, chunk_area, offgrid_tiles, spawnpoints
+
+
+
+def encode_map_delta(generator_version, seed, length, player_pos, removed, opened):
+    """removed / opened: indices into the spawnpoints the map is generated with."""
+    header = MAP_DELTA_HEADER.pack(MAP_DELTA_MAGIC, MAP_DELTA_VERSION, generator_version, seed, length, player_pos[0], player_pos[1], len(removed), len(opened))
+    return header + np.array(removed, '<u2').tobytes() + np.array(opened, '<u2').tobytes()
+
+
+def read_map_delta(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, version, generator_version, seed, length, player_x, player_y, removed_count, opened_count = MAP_DELTA_HEADER.unpack_from(data)
+    if magic != MAP_DELTA_MAGIC or version != MAP_DELTA_VERSION:
+        raise ValueError('%s is not a version %d map delta' % (path, MAP_DELTA_VERSION))
+    indices = np.frombuffer(data, '<u2', removed_count + opened_count, MAP_DELTA_HEADER.size).tolist()
+    return {'generator_version': generator_version, 'seed': seed, 'length': length, 'player_pos': [player_x, player_y],
+            'removed': indices[:removed_count], 'opened': indices[removed_count:]}
@@ -1,5 +1,6 @@
 import pygame as pg
-import random, math
+import numpy as np
+import math
 from pygame import Vector2 as Vec
 from pygame.sprite import Sprite
 
@@ -7,12 +8,20 @@ from pygame.sprite import Sprite
 class Particle(Sprite):
     def __init__(self, game, p_type, pos, velocity=Vec(0, 0), frame=0):
         super().__init__()
+        self.pos = Vec()
+        self.rect = pg.Rect(0, 0, 0, 0)
+        self.type = None
+        self.reset(game, p_type, pos, velocity, frame)
+
+    def reset(self, game, p_type, pos, velocity=Vec(0, 0), frame=0):
+        # also used to reuse a pooled particle.
         self.game = game
+        if p_type != self.type:
+            self.animation = self.game.particle_anims[p_type].copy()
         self.type = p_type
-        self.pos = Vec(pos)
+        self.pos.update(pos)
         self.vel = velocity
-        self.animation = self.game.particle_anims[p_type].copy()
-        self.animation.frame = frame
+        self.animation.reset(frame)
         self.set_current_img()
         self.set_rect()
         self.destroy = False
@@ -21,7 +30,7 @@ class Particle(Sprite):
         self.image = self.animation.cur_img()
     
     def set_rect(self):
-        self.rect = pg.Rect(self.pos.x, self.pos.y, self.image.get_width(), self.image.get_height())
+        self.rect.update(self.pos.x, self.pos.y, self.image.get_width(), self.image.get_height())
 
     def update(self):
         if self.animation.done:
@@ -32,7 +41,7 @@ class Particle(Sprite):
         self.set_current_img()
         self.set_rect()
         if self.type == 'dash':
-            self.image = pg.transform.rotate(self.image, random.random() * 360)
+            self.image = self.animation.cur_rotated(self.game.rng.random() * 360)
 
     def render(self, surf, offset=(0, 0)):  
         render_pos_x = self.rect.x - offset[0] - self.image.get_width() // 2
@@ -43,29 +52,35 @@ class Particle(Sprite):
 PROJECTILE_DAMAGE = {'fireball': 1, 'blob_sy': 2, 'blob_sr': 3}
 
 class Projectile(Sprite):
-    def __init__(self, game, pj_type, pos, velocity=Vec(0, 0)):
+    def __init__(self, *args):
         super().__init__()
+        self.pos = Vec()
+        self.rect = pg.Rect(0, 0, 0, 0)
+        self.reset(*args)
+
+    def reset(self, game, pj_type, pos, velocity=Vec(0, 0)):
+        # subclasses set themselves up in reset so pooled projectiles can be reused.
         self.game = game
         self.type = pj_type
         self.damage = PROJECTILE_DAMAGE[self.type]
-        self.pos = Vec(pos)
+        self.pos.update(pos)
         self.vel = velocity
-        self.image_surf = self.game.projectile_dict[pj_type].copy()
-        self.image = self.image_surf
+        self.image, self.mask = self.game.projectile_images[pj_type][(False, 0)]
         self.size = self.image.get_size()
         self.set_rect()
         
         self.destroy = False
 
+    def set_image(self):
+        self.image, self.mask = self.game.projectile_images[self.type][(False, 0)]
+
     def set_rect(self):
-        self.rect = pg.Rect(self.pos.x, self.pos.y, self.size[0], self.size[1])
+        self.rect.update(self.pos.x, self.pos.y, self.size[0], self.size[1])
 
 
     def check_collisions(self, tilemap):
-        self.rect = pg.Rect(self.pos.x + 1, self.pos.y + 1, self.size[0] - 2, self.size[1] - 2)
-        for rect in tilemap.neighbor_physics_rects(self.pos, self.size):
-            if self.rect.colliderect(rect):
-                return True
+        self.rect.update(self.pos.x + 1, self.pos.y + 1, self.size[0] - 2, self.size[1] - 2)
+        return tilemap.get_collision_grid().rect_overlaps(self.rect)
     
     def update(self):
         self.pos += self.vel
@@ -78,15 +93,18 @@ class Projectile(Sprite):
 
 
 class Fireball(Projectile):
-    def __init__(self, game, pos, flip, velocity=Vec(0, 0)):
-        super().__init__(game, 'fireball', pos, velocity)
+    def reset(self, game, pos, flip, velocity=Vec(0, 0)):
+        super().reset(game, 'fireball', pos, velocity)
         self.flip = flip
+        self.set_image()
+
+    def set_image(self):
         if self.vel.y > 0:
-            self.image = pg.transform.rotate(self.image_surf, 90)
+            self.image, self.mask = self.game.projectile_images['fireball'][(False, 90)]
         elif self.vel.y < 0:
-            self.image = pg.transform.rotate(self.image_surf, 270)
+            self.image, self.mask = self.game.projectile_images['fireball'][(False, 270)]
         else:
-            self.image = pg.transform.flip(self.image_surf, self.flip, False)
+            self.image, self.mask = self.game.projectile_images['fireball'][(self.flip, 0)]
     
     def update(self, tilemap):
         accel = 0.1
@@ -98,14 +116,14 @@ class Fireball(Projectile):
                 if self.vel.y != 0:
                     loc_y = self.rect.bottom if self.vel.y > 0 else self.rect.top
                     loc = Vec(self.rect.centerx, loc_y)
-                    angle = (random.uniform(-3, 0) if self.vel.y > 0 else random.uniform(0, 3))
-                    self.game.sparks.add(Spark(loc, angle, 1 + random.random(), sp_color))
+                    angle = (self.game.rng.uniform(-3, 0) if self.vel.y > 0 else self.game.rng.uniform(0, 3))
+                    self.game.sparks.add(loc, angle, 1 + self.game.rng.random(), sp_color)
                 else:
                     loc_x = self.rect.left if self.vel.x < 0 else self.rect.right
-                    self.game.sparks.add(Spark((loc_x, self.pos.y), random.uniform(-1.4, 1.4) + (math.pi if self.vel.x > 0 else 0), 1 + random.random(), sp_color))
+                    self.game.sparks.add((loc_x, self.pos.y), self.game.rng.uniform(-1.4, 1.4) + (math.pi if self.vel.x > 0 else 0), 1 + self.game.rng.random(), sp_color)
         if self.pos.x < self.game.map_left_boundary - 16 or self.pos.x > self.game.map_right_boundary or self.pos.y < -500:
             self.destroy = True
-        coll_enemies = pg.sprite.spritecollide(self, self.game.enemies, False, collided=pg.sprite.collide_mask)
+        coll_enemies = self.game.enemies.collide(self)
         if coll_enemies:
             for enemy in coll_enemies:
                 if not enemy.die:
@@ -113,7 +131,7 @@ class Fireball(Projectile):
                     enemy.get_hit(self)
             loc = (self.rect.left if self.flip else self.rect.right, self.rect.centery)
             for i in range(15):
-                self.game.sparks.add(Spark(loc, random.random() * math.pi * 2, random.random() + 1, (235, 88, 24)))
+                self.game.sparks.add(loc, self.game.rng.random() * math.pi * 2, self.game.rng.random() + 1, (235, 88, 24))
             
 
         if self.vel.x > 0:
@@ -132,8 +150,8 @@ class Fireball(Projectile):
 
 
 class SlimeBlobYellow(Projectile):
-    def __init__(self, game, pos, target_pos):
-        super().__init__(game, 'blob_sy', pos)
+    def reset(self, game, pos, target_pos):
+        super().reset(game, 'blob_sy', pos)
         self.start_pos = self.pos
         self.target_pos = Vec(target_pos)
         self.time = 0
@@ -168,17 +186,17 @@ class SlimeBlobYellow(Projectile):
             self.destroy = True
             for i in range(4):
                 if self.vel.x < 0:
-                    angle = random.uniform(-1.4, 1.4)
-                    self.game.sparks.add(Spark(self.pos, angle, 1 + random.random(), self.spark_clr))
+                    angle = self.game.rng.uniform(-1.4, 1.4)
+                    self.game.sparks.add(self.pos, angle, 1 + self.game.rng.random(), self.spark_clr)
                 elif self.vel.x > 0:
-                    angle = random.uniform(-1.4, 1.4) + math.pi
-                    self.game.sparks.add(Spark(self.pos, angle, 1 + random.random(), self.spark_clr))
+                    angle = self.game.rng.uniform(-1.4, 1.4) + math.pi
+                    self.game.sparks.add(self.pos, angle, 1 + self.game.rng.random(), self.spark_clr)
                 if self.vel.y < 0:
-                    angle = random.uniform(0, 3)
-                    self.game.sparks.add(Spark(self.pos, angle, 1 + random.random(), self.spark_clr))
+                    angle = self.game.rng.uniform(0, 3)
+                    self.game.sparks.add(self.pos, angle, 1 + self.game.rng.random(), self.spark_clr)
                 elif self.vel.y > 0:
-                    angle = random.uniform(-3, 0)
-                    self.game.sparks.add(Spark(self.pos, angle, 1 + random.random(), self.spark_clr))
+                    angle = self.game.rng.uniform(-3, 0)
+                    self.game.sparks.add(self.pos, angle, 1 + self.game.rng.random(), self.spark_clr)
 
 
         grav = 0.1
@@ -188,105 +206,174 @@ class SlimeBlobYellow(Projectile):
         self.set_rect()
 
 class SlimeBlobRed(SlimeBlobYellow):
-    def __init__(self, game, pj_type, pos, target_pos):
-        super().__init__(game, pos, target_pos)
+    def reset(self, game, pj_type, pos, target_pos):
+        super().reset(game, pos, target_pos)
         self.type = pj_type
         self.damage = PROJECTILE_DAMAGE[self.type]
-        self.image = self.game.projectile_dict[pj_type].copy()
+        self.set_image()
         self.spark_clr = (200, 65, 65)
 
 
-class Spark(Sprite):
-    def __init__(self, pos, angle, speed, color):
-        super().__init__()
-        self.pos = Vec(pos)
-        # angle in radians
-        self.angle = angle
-        self.speed = speed
-        self.destroy = False
-        self.color = color
+SPARK = 0
+AETHER_SPARK = 1  # absorbed by the player, restores mana
+HEALTH_SPARK = 2  # absorbed by the player, restores health
+SPARK_ROTATIONS = 8
+# the per spark arrays of SparkSystem.
+SPARK_COLUMNS = ('x', 'y', 'angle', 'speed', 'absorb_speed', 'kind', 'color')
 
-    def update(self):
-        self.pos.x += math.cos(self.angle) * self.speed
-        self.pos.y += math.sin(self.angle) * self.speed
-        self.speed = max(0, self.speed - 0.1)
-        if self.speed == 0:
-            self.destroy = True
-    
-    def render(self, surf, offset=Vec(0, 0)):
-        pg.draw.circle(surf, self.color, self.pos - offset, 1)
-
-
-class AetherSpark(Spark):
-    def __init__(self, pos, angle, speed):
-        super().__init__(pos, angle, speed, (50, 50, 240))
-        self.absorb_speed = 1
-        self.max_speed = 4
 
-    def update(self, game):
-        self.pos.x += math.cos(self.angle) * self.speed
-        self.pos.y += math.sin(self.angle) * self.speed
-        self.speed = max(0, self.speed - 0.1)
-        if self.speed == 0:
-            player_pos = Vec(game.player.pos.x + 4, game.player.pos.y + 8)
-            diff_vec = player_pos - self.pos
-            new_angle = math.atan2(diff_vec.y, diff_vec.x)
-            self.pos.x += math.cos(new_angle) * self.absorb_speed
-            self.pos.y += math.sin(new_angle) * self.absorb_speed
-            self.absorb_speed = min(self.absorb_speed + 0.2, self.max_speed)
-            if self.pos.distance_to(player_pos) < 8:
-                self.destroy = True
-        if self.destroy:
-            game.player.mana = min(game.player.mana + 0.1, game.player.max_mana)
-    
-    def render(self, surf, offset=Vec(0, 0)):
-        rot = random.random() * 360
-        p1_vec = Vec(0, 1.5)
-        p1_vec.rotate_ip(rot)
-        p2_vec = p1_vec.rotate(120)
-        p3_vec = p1_vec.rotate(-120)
-        points = [
-            p1_vec + self.pos,
-            p2_vec + self.pos,
-            p3_vec + self.pos
-        ]
-        pg.draw.polygon(surf, self.color, [i - offset for i in points])
-
-
-class HealthSpark(Spark):
-    def __init__(self, pos, angle, speed):
-        super().__init__(pos, angle, speed, (240, 50, 50))
-        self.absorb_speed = 1.5
-        self.max_speed = 4
+class SparkSystem:
+    """Every live spark, stored as parallel numpy arrays and updated / drawn in one pass."""
+    def __init__(self, capacity=256, seed=None):
+        self.count = 0
+        self.x = np.zeros(capacity)
+        self.y = np.zeros(capacity)
+        # angle in radians
+        self.angle = np.zeros(capacity)
+        self.speed = np.zeros(capacity)
+        self.absorb_speed = np.zeros(capacity)
+        self.kind = np.zeros(capacity, np.int8)
+        self.color = np.zeros(capacity, np.int16)
+        # sparks added since the last update / render, appended to the arrays in one go.
+        self.pending = []
+        self.colors = []
+        self.color_ids = {}
+        self.stamps = {}
+        self.render_rng = np.random.default_rng(seed)
+        self.max_absorb_speed = 4
+
+    def __len__(self):
+        return self.count + len(self.pending)
+
+    def add(self, pos, angle, speed, color, kind=SPARK):
+        if color not in self.color_ids:
+            self.color_ids[color] = len(self.colors)
+            self.colors.append(color)
+        absorb_speed = 1.5 if kind == HEALTH_SPARK else 1
+        self.pending.append((pos[0], pos[1], angle, speed, absorb_speed, kind, self.color_ids[color]))
+
+    def add_aether(self, pos, angle, speed):
+        self.add(pos, angle, speed, (50, 50, 240), AETHER_SPARK)
+
+    def add_health(self, pos, angle, speed):
+        self.add(pos, angle, speed, (240, 50, 50), HEALTH_SPARK)
+
+    def empty(self):
+        self.count = 0
+        self.pending = []
+
+    def get_state(self):
+        # (count, column bytes, colors, render rng state), see scripts/gamestate.py.
+        self.flush()
+        n = self.count
+        return n, [getattr(self, name)[:n].tobytes() for name in SPARK_COLUMNS], list(self.colors), self.render_rng.bit_generator.state
+
+    def set_state(self, state):
+        count, columns, colors, rng_state = state
+        capacity = max(len(self.x), count)
+        for name, data in zip(SPARK_COLUMNS, columns):
+            arr = getattr(self, name)
+            if len(arr) < capacity:
+                arr = np.zeros(capacity, arr.dtype)
+                setattr(self, name, arr)
+            arr[:count] = np.frombuffer(data, arr.dtype)
+        self.count = count
+        self.pending = []
+        # color ids only ever get appended, the stamps stay valid while the old colors come first.
+        if colors != self.colors[:len(colors)]:
+            self.colors = list(colors)
+            self.color_ids = {color: i for i, color in enumerate(self.colors)}
+            self.stamps = {}
+        self.render_rng.bit_generator.state = rng_state
+
+    def flush(self):
+        if not self.pending:
+            return
+        start = self.count
+        end = start + len(self.pending)
+        if end > len(self.x):
+            capacity = max(end, len(self.x) * 2)
+            for name in SPARK_COLUMNS:
+                arr = getattr(self, name)
+                grown = np.zeros(capacity, arr.dtype)
+                grown[:start] = arr[:start]
+                setattr(self, name, grown)
+        columns = list(zip(*self.pending))
+        self.x[start:end] = columns[0]
+        self.y[start:end] = columns[1]
+        self.angle[start:end] = columns[2]
+        self.speed[start:end] = columns[3]
+        self.absorb_speed[start:end] = columns[4]
+        self.kind[start:end] = columns[5]
+        self.color[start:end] = columns[6]
+        self.count = end
+        self.pending = []
 
     def update(self, game):
-        self.pos.x += math.cos(self.angle) * self.speed
-        self.pos.y += math.sin(self.angle) * self.speed
-        self.speed = max(0, self.speed - 0.1)
-        if self.speed == 0:
-            player_pos = Vec(game.player.pos.x + 4, game.player.pos.y + 8)
-            diff_vec = player_pos - self.pos
-            new_angle = math.atan2(diff_vec.y, diff_vec.x)
-            self.pos.x += math.cos(new_angle) * self.absorb_speed
-            self.pos.y += math.sin(new_angle) * self.absorb_speed
-            self.absorb_speed = min(self.absorb_speed + 0.2, self.max_speed)
-            if self.pos.distance_to(player_pos) < 8:
-                self.destroy = True
-        if self.destroy:
-            game.player.health = min(game.player.health + 0.1, game.player.max_health)
-
-
-    def render(self, surf, offset=Vec(0, 0)):
-        rot = random.random() * 360
-        p1_vec = Vec(0, 1.2)
-        p1_vec.rotate_ip(rot)
-        p2_vec = p1_vec.rotate(90)
-        p3_vec = p1_vec.rotate(180)
-        p4_vec = p1_vec.rotate(270)
-        points = [
-            p1_vec + self.pos,
-            p2_vec + self.pos,
-            p3_vec + self.pos,
-            p4_vec + self.pos
-        ]
-        pg.draw.polygon(surf, self.color, [i - offset for i in points])
\ No newline at end of file
+        self.flush()
+        n = self.count
+        if not n:
+            return
+        x, y, speed, kind = self.x[:n], self.y[:n], self.speed[:n], self.kind[:n]
+        x += np.cos(self.angle[:n]) * speed
+        y += np.sin(self.angle[:n]) * speed
+        np.maximum(speed - 0.1, 0, out=speed)
+        stopped = speed == 0
+        dead = stopped & (kind == SPARK)
+
+        # stopped aether / health sparks fly into the player.
+        homing = np.flatnonzero(stopped & (kind != SPARK))
+        if len(homing):
+            player_x = game.player.pos.x + 4
+            player_y = game.player.pos.y + 8
+            absorb_speed = self.absorb_speed[homing]
+            new_angle = np.arctan2(player_y - y[homing], player_x - x[homing])
+            x[homing] += np.cos(new_angle) * absorb_speed
+            y[homing] += np.sin(new_angle) * absorb_speed
+            self.absorb_speed[homing] = np.minimum(absorb_speed + 0.2, self.max_absorb_speed)
+            absorbed = homing[np.hypot(player_x - x[homing], player_y - y[homing]) < 8]
+            dead[absorbed] = True
+            for i in range(np.count_nonzero(kind[absorbed] == AETHER_SPARK)):
+                game.player.mana = min(game.player.mana + 0.1, game.player.max_mana)
+            for i in range(np.count_nonzero(kind[absorbed] == HEALTH_SPARK)):
+                game.player.health = min(game.player.health + 0.1, game.player.max_health)
+
+        if dead.any():
+            keep = np.flatnonzero(~dead)
+            for name in SPARK_COLUMNS:
+                arr = getattr(self, name)
+                arr[:len(keep)] = arr[keep]
+            self.count = len(keep)
+
+    def get_stamp(self, kind, color_id, rotation):
+        # small pre-drawn surfaces, the spark's position is at (3, 3).
+        key = (kind, color_id, rotation)
+        if key not in self.stamps:
+            stamp = pg.Surface((7, 7), pg.SRCALPHA)
+            color = self.colors[color_id]
+            if kind == SPARK:
+                pg.draw.circle(stamp, color, (3, 3), 1)
+            else:
+                # aether sparks are triangles, health sparks are squares.
+                corners, radius = (3, 1.5) if kind == AETHER_SPARK else (4, 1.2)
+                p1_vec = Vec(0, radius).rotate(rotation * 360 / SPARK_ROTATIONS)
+                pg.draw.polygon(stamp, color, [p1_vec.rotate(i * 360 / corners) + Vec(3, 3) for i in range(corners)])
+            self.stamps[key] = stamp
+        return self.stamps[key]
+
+    def render(self, surf, offset=(0, 0)):
+        self.flush()
+        n = self.count
+        if not n:
+            return
+        screen_x = (self.x[:n] - offset[0]).astype(int) - 3
+        screen_y = (self.y[:n] - offset[1]).astype(int) - 3
+        on_screen = np.flatnonzero((screen_x > -7) & (screen_x < surf.get_width()) & (screen_y > -7) & (screen_y < surf.get_height()))
+        if not len(on_screen):
+            return
+        # absorbable sparks spin randomly every frame.
+        rotation = self.render_rng.integers(0, SPARK_ROTATIONS, len(on_screen))
+        rotation[self.kind[on_screen] == SPARK] = 0
+        get_stamp = self.get_stamp
+        surf.fblits([(get_stamp(kind, color_id, rot), (sx, sy)) for kind, color_id, rot, sx, sy in zip(
+            self.kind[on_screen].tolist(), self.color[on_screen].tolist(), rotation.tolist(), screen_x[on_screen].tolist(), screen_y[on_screen].tolist())])
@@ -0,0 +1,135 @@
+import csv, json
+from collections import deque
+from time import perf_counter
+import numpy as np
+import pygame as pg
+
+
+PERCENTILES = (50, 95, 99)
+
+
+class Scope:
+    """Adds the time spent inside the with block to the current frame's total for name."""
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        totals = self.profiler.current
+        totals[self.name] = totals.get(self.name, 0) + perf_counter() - self.start
+
+
+class NullScope:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+NULL_SCOPE = NullScope()
+
+
+class FrameProfiler:
+    """Named timing scopes, summed per rendered frame, over a rolling window of frames."""
+    def __init__(self, window=600, enabled=True, font_path=None, refresh=30):
+        self.enabled = enabled
+        self.frames = deque(maxlen=window)
+        self.current = {}
+        self.names = []
+        self.scopes = {}
+        self.frame_count = 0
+        self.frame_start = perf_counter()
+        self.show_overlay = False
+        self.font = None
+        self.font_path = font_path
+        # the overlay text is only rebuilt every refresh frames.
+        self.refresh = refresh
+        self.overlay = None
+
+    def scope(self, name):
+        if not self.enabled:
+            return NULL_SCOPE
+        scope = self.scopes.get(name)
+        if scope is None:
+            scope = self.scopes[name] = Scope(self, name)
+            self.names.append(name)
+        return scope
+
+    def end_frame(self):
+        now = perf_counter()
+        if self.enabled:
+            self.current['frame'] = now - self.frame_start
+            self.frames.append(self.current)
+            self.current = {}
+            self.frame_count += 1
+            if self.show_overlay and (self.overlay is None or self.frame_count % self.refresh == 0):
+                self.build_overlay()
+        self.frame_start = now
+
+    def phase_names(self):
+        # sorted, so each phase is listed next to its sub scopes.
+        return ['frame'] + sorted(self.names)
+
+    def samples(self, name):
+        # ms per frame, frames where the scope did not run count as 0.
+        return np.array([frame.get(name, 0) for frame in self.frames]) * 1000
+
+    def stats(self):
+        stats = {}
+        if not self.frames:
+            return stats
+        for name in self.phase_names():
+            samples = self.samples(name)
+            p50, p95, p99 = np.percentile(samples, PERCENTILES)
+            stats[name] = {'mean': float(samples.mean()), 'p50': float(p50), 'p95': float(p95), 'p99': float(p99), 'max': float(samples.max())}
+        return stats
+
+    def toggle_overlay(self):
+        self.show_overlay = not self.show_overlay
+        self.overlay = None
+
+    def build_overlay(self):
+        if self.font is None:
+            self.font = pg.font.Font(self.font_path, 16)
+        lines = ['%-22s %7s %7s %7s' % ('ms (%d frames)' % len(self.frames), 'p50', 'p95', 'p99')]
+        for name, stat in self.stats().items():
+            lines.append('%-22s %7.2f %7.2f %7.2f' % (name, stat['p50'], stat['p95'], stat['p99']))
+        line_height = self.font.get_linesize()
+        self.overlay = pg.Surface((max(self.font.size(line)[0] for line in lines) + 8, line_height * len(lines) + 8), pg.SRCALPHA)
+        self.overlay.fill((0, 0, 0, 160))
+        for i, line in enumerate(lines):
+            self.overlay.blit(self.font.render(line, False, (255, 250, 255)), (4, 4 + i * line_height))
+
+    def render(self, surf):
+        if self.show_overlay and self.overlay:
+            surf.blit(self.overlay, (0, 0))
+
+    def export(self, path):
+        # .csv: one row per frame in the window, .json: the percentiles per phase.
+        if path.endswith('.csv'):
+            self.export_csv(path)
+        else:
+            self.export_json(path)
+
+    def export_csv(self, path):
+        names = self.phase_names()
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['frame_no'] + names)
+            first = self.frame_count - len(self.frames)
+            for i, frame in enumerate(self.frames):
+                writer.writerow([first + i] + ['%.4f' % (frame.get(name, 0) * 1000) for name in names])
+
+    def export_json(self, path):
+        with open(path, 'w') as f:
+            json.dump({'frames': len(self.frames), 'unit': 'ms', 'phases': self.stats()}, f, indent=2)
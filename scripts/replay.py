@@ -0,0 +1,67 @@
+import struct, zlib
+import pygame as pg
+
+
+REPLAY_MAGIC = b'PRPL'
+REPLAY_VERSION = 1
+# magic, version, seed, start tick, tick count
+REPLAY_HEADER = struct.Struct('<4sBQII')
+NO_START = 0xFFFFFFFF
+# every key handle_events reacts to, the index in this list is what gets written.
+RECORDED_KEYS = [pg.K_RIGHT, pg.K_LEFT, pg.K_z, pg.K_c, pg.K_x, pg.K_SPACE, pg.K_DOWN, pg.K_UP, pg.K_p, pg.K_BACKSPACE, pg.K_ESCAPE, pg.K_q]
+KEY_UP_BIT = 0x80
+
+
+class InputRecorder:
+    """Records the key events read on every tick. Per tick: one count byte, then one byte per event (key index | up bit)."""
+    def __init__(self, seed, path):
+        self.seed = seed
+        self.path = path
+        self.start_tick = None
+        self.ticks = 0
+        self.stream = bytearray()
+        self.key_index = {key: i for i, key in enumerate(RECORDED_KEYS)}
+
+    def record(self, tick, events, start_game=False):
+        # ticks are recorded back to back from 0, tick is only used to note when the game was started.
+        if start_game and self.start_tick is None:
+            self.start_tick = tick
+        codes = []
+        for event in events:
+            if event.type == pg.KEYDOWN or event.type == pg.KEYUP:
+                index = self.key_index.get(event.key)
+                if index is not None:
+                    codes.append(index | (KEY_UP_BIT if event.type == pg.KEYUP else 0))
+        codes = codes[:255]
+        self.stream.append(len(codes))
+        self.stream.extend(codes)
+        self.ticks += 1
+
+    def save(self):
+        start_tick = self.start_tick if self.start_tick is not None else NO_START
+        with open(self.path, 'wb') as f:
+            f.write(REPLAY_HEADER.pack(REPLAY_MAGIC, REPLAY_VERSION, self.seed, start_tick, self.ticks))
+            f.write(zlib.compress(bytes(self.stream), 9))
+
+
+class Replay:
+    """A recording loaded back, input_script is in the {tick: [event, ...]} form Game.run_game posts from."""
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        magic, version, self.seed, start_tick, self.ticks = REPLAY_HEADER.unpack_from(data)
+        if magic != REPLAY_MAGIC or version != REPLAY_VERSION:
+            raise ValueError('%s is not a version %d replay' % (path, REPLAY_VERSION))
+        self.start_tick = start_tick if start_tick != NO_START else None
+        self.input_script = self.decode(zlib.decompress(data[REPLAY_HEADER.size:]))
+
+    def decode(self, stream):
+        input_script = {}
+        i = 0
+        for tick in range(self.ticks):
+            count = stream[i]
+            i += 1
+            if count:
+                input_script[tick] = [pg.event.Event(pg.KEYUP if code & KEY_UP_BIT else pg.KEYDOWN, key=RECORDED_KEYS[code & ~KEY_UP_BIT]) for code in stream[i:i + count]]
+                i += count
+        return input_script
@@ -0,0 +1,62 @@
+import os, threading
+
+
+class SaveWriter:
+    """Writes save files on a worker thread. A request for a path that is still waiting replaces it, so back to back saves are written once."""
+    def __init__(self):
+        self.pending = {}  # {path: encode() -> bytes, or None to remove the file}, in request order
+        self.writing = None
+        self.condition = threading.Condition()
+        self.thread = None
+        self.error = None
+
+    def write(self, path, encode):
+        # encode runs on the worker, it must only use state the caller has already copied.
+        with self.condition:
+            self.pending[path] = encode
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+            self.condition.notify_all()
+
+    def remove(self, path):
+        self.write(path, None)
+
+    def flush(self):
+        # waits for every requested write, call it before reading save files.
+        with self.condition:
+            while self.pending or self.writing:
+                self.condition.wait()
+            error, self.error = self.error, None
+        if error:
+            raise error
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                path = next(iter(self.pending))
+                encode = self.pending.pop(path)
+                self.writing = path
+            try:
+                if encode is None:
+                    if os.path.exists(path):
+                        os.remove(path)
+                else:
+                    write_atomic(path, encode())
+            except Exception as error:
+                self.error = error
+            with self.condition:
+                self.writing = None
+                self.condition.notify_all()
+
+
+def write_atomic(path, data):
+    # a crash mid write leaves the old file, never a half written one.
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
@@ -22,11 +22,11 @@ class Star:
 
 class Stars:
     """Class to store all of the stars."""
-    def __init__(self, star_images, count=30):
+    def __init__(self, star_images, count=30, rng=random):
         self.stars = []
 
         for i in range(count):
-            self.stars.append(Star((random.random() * 99999, random.random() * 99999), random.choice(star_images), random.random() * 0.05 + 0.02, random.random() * 0.4  + 0.03))
+            self.stars.append(Star((rng.random() * 99999, rng.random() * 99999), rng.choice(star_images), rng.random() * 0.05 + 0.02, rng.random() * 0.4  + 0.03))
 
         self.stars.sort(key=lambda x: x.depth)
     
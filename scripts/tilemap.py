@@ -1,121 +1,478 @@
 import pygame as pg
 from pygame.sprite import Sprite
 from pygame import Vector2 as Vec
-import json, copy, os
+from array import array
+import numpy as np
+from scripts.collision import CollisionGrid
+from scripts.autotile import autotile
+from scripts.visibility import LineOfSight
+from scripts.mapfile import is_map_file, read_map, write_map
+import json, os
 
-NEIGHBOR_OFFSETS = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 0), (0, 1), (1, -1), (1, 0), (1, 1)]
 PHYSICS_TILES = {'grass', 'stone', 'grassystone', 'water'}
+# chunks are CHUNK_SIZE x CHUNK_SIZE tiles, CHUNK_SIZE must be a power of two.
+CHUNK_SHIFT = 4
+CHUNK_SIZE = 1 << CHUNK_SHIFT
+CHUNK_MASK = CHUNK_SIZE - 1
+CHUNK_AREA = CHUNK_SIZE * CHUNK_SIZE
+# 0 player, 1 portal, 2 normal chest, 3 rare chest, 4-6 slimes
+SPAWNPOINT_PAIRS = [('spawnpoint', variant) for variant in range(7)]
+
+
+class TileGrid:
+    """Chunked tile storage. Cells hold palette ids, 0 is an empty cell."""
+    def __init__(self):
+        self.chunks = {}  # {(cx, cy): array('H') ...}
+        # keys of the chunks only this grid uses, the others are shared with a snapshot and copied on their first write.
+        self.owned = set()
+        self.palette = [None]  # [None, ('grass', 1) ...]
+        self.palette_ids = {}
+        self.tile_count = 0
+
+    def snapshot(self):
+        # copy on write, no tile data is copied until one of the two grids changes a chunk.
+        grid = TileGrid()
+        grid.chunks = self.chunks.copy()
+        grid.palette = self.palette.copy()
+        grid.palette_ids = self.palette_ids.copy()
+        grid.tile_count = self.tile_count
+        self.owned = set()
+        return grid
+
+    def own_chunk(self, chunk_key):
+        chunk = self.chunks[chunk_key]
+        if chunk_key not in self.owned:
+            chunk = self.chunks[chunk_key] = array('H', chunk)
+            self.owned.add(chunk_key)
+        return chunk
+
+    def get_palette_id(self, t_type, variant):
+        key = (t_type, variant)
+        if key not in self.palette_ids:
+            self.palette_ids[key] = len(self.palette)
+            self.palette.append(key)
+        return self.palette_ids[key]
+
+    def get_id(self, x, y):
+        chunk = self.chunks.get((x >> CHUNK_SHIFT, y >> CHUNK_SHIFT))
+        if chunk is None:
+            return 0
+        return chunk[(y & CHUNK_MASK) << CHUNK_SHIFT | (x & CHUNK_MASK)]
+
+    def get(self, x, y):
+        # (type, variant) or None
+        return self.palette[self.get_id(x, y)]
+
+    def get_type(self, x, y):
+        tile = self.palette[self.get_id(x, y)]
+        if tile:
+            return tile[0]
+
+    def set(self, x, y, t_type, variant):
+        chunk_key = (x >> CHUNK_SHIFT, y >> CHUNK_SHIFT)
+        if chunk_key in self.chunks:
+            chunk = self.own_chunk(chunk_key)
+        else:
+            chunk = array('H', bytes(CHUNK_AREA * 2))
+            self.chunks[chunk_key] = chunk
+            self.owned.add(chunk_key)
+        index = (y & CHUNK_MASK) << CHUNK_SHIFT | (x & CHUNK_MASK)
+        if not chunk[index]:
+            self.tile_count += 1
+        chunk[index] = self.get_palette_id(t_type, variant)
+
+    def remove(self, x, y):
+        chunk_key = (x >> CHUNK_SHIFT, y >> CHUNK_SHIFT)
+        chunk = self.chunks.get(chunk_key)
+        if chunk is None:
+            return
+        index = (y & CHUNK_MASK) << CHUNK_SHIFT | (x & CHUNK_MASK)
+        if chunk[index]:
+            self.own_chunk(chunk_key)[index] = 0
+            self.tile_count -= 1
+
+    def __contains__(self, loc):
+        return self.get_id(loc[0], loc[1]) != 0
+
+    def chunk_slices(self, min_x, min_y, width, height, write=False):
+        # (chunk cells, rect slices) for every existing chunk overlapping the rect, both as [y, x] array views.
+        for cx in range(min_x >> CHUNK_SHIFT, ((min_x + width - 1) >> CHUNK_SHIFT) + 1):
+            for cy in range(min_y >> CHUNK_SHIFT, ((min_y + height - 1) >> CHUNK_SHIFT) + 1):
+                if (cx, cy) not in self.chunks:
+                    continue
+                chunk = self.own_chunk((cx, cy)) if write else self.chunks[(cx, cy)]
+                block = np.frombuffer(chunk, np.uint16).reshape(CHUNK_SIZE, CHUNK_SIZE)
+                base_x = cx << CHUNK_SHIFT
+                base_y = cy << CHUNK_SHIFT
+                x0, x1 = max(base_x, min_x), min(base_x + CHUNK_SIZE, min_x + width)
+                y0, y1 = max(base_y, min_y), min(base_y + CHUNK_SIZE, min_y + height)
+                yield block[y0 - base_y:y1 - base_y, x0 - base_x:x1 - base_x], (slice(y0 - min_y, y1 - min_y), slice(x0 - min_x, x1 - min_x))
+
+    def get_ids(self, min_x, min_y, width, height):
+        # palette ids of a rect of cells as a [y, x] array, 0 where empty.
+        ids = np.zeros((height, width), np.uint16)
+        for cells, rect_slices in self.chunk_slices(min_x, min_y, width, height):
+            ids[rect_slices] = cells
+        return ids
+
+    def put_ids(self, min_x, min_y, ids):
+        # writes back an array from get_ids. only for changing what is in a cell, not for adding or removing tiles.
+        for cells, rect_slices in self.chunk_slices(min_x, min_y, ids.shape[1], ids.shape[0], True):
+            cells[:] = ids[rect_slices]
+
+    def __len__(self):
+        return self.tile_count
+
+    def __iter__(self):
+        for loc, tile in self.items():
+            yield loc
+
+    def items(self):
+        for (cx, cy), chunk in self.chunks.items():
+            base_x = cx << CHUNK_SHIFT
+            base_y = cy << CHUNK_SHIFT
+            for index, tile_id in enumerate(chunk):
+                if tile_id:
+                    yield (base_x + (index & CHUNK_MASK), base_y + (index >> CHUNK_SHIFT)), self.palette[tile_id]
+
+    def bounds(self):
+        # min_x, min_y, max_x, max_y in tiles
+        xs = []
+        ys = []
+        for (cx, cy), chunk in self.chunks.items():
+            block = np.frombuffer(chunk, np.uint16).reshape(CHUNK_SIZE, CHUNK_SIZE)
+            cols = np.flatnonzero(block.any(axis=0))
+            if len(cols):
+                rows = np.flatnonzero(block.any(axis=1))
+                xs += [(cx << CHUNK_SHIFT) + int(cols[0]), (cx << CHUNK_SHIFT) + int(cols[-1])]
+                ys += [(cy << CHUNK_SHIFT) + int(rows[0]), (cy << CHUNK_SHIFT) + int(rows[-1])]
+        return min(xs), min(ys), max(xs), max(ys)
+
+    def to_legacy(self) -> dict:
+        # {"(0, 1)": {'type': ..., 'variant': ..., 'pos': [0, 1]} ...} used by the json map files
+        legacy = {}
+        for (x, y), (t_type, variant) in self.items():
+            legacy[str((x, y))] = {'type': t_type, 'variant': variant, 'pos': [x, y]}
+        return legacy
+
+    @classmethod
+    def from_legacy(cls, tile_dict):
+        grid = cls()
+        for tile in tile_dict.values():
+            grid.set(int(tile['pos'][0]), int(tile['pos'][1]), tile['type'], tile['variant'])
+        return grid
+
+    @classmethod
+    def from_chunks(cls, palette, chunks):
+        # palette: [None, (type, variant) ...], chunks: {(cx, cy): uint16 cells ...} as read_map returns them.
+        grid = cls()
+        grid.chunks = chunks
+        grid.owned = set(chunks)
+        grid.palette = palette
+        grid.palette_ids = {tile: tile_id for tile_id, tile in enumerate(palette) if tile_id}
+        grid.tile_count = sum(int(np.count_nonzero(np.frombuffer(chunk, np.uint16))) for chunk in chunks.values())
+        return grid
+
+
+class OffgridIndex:
+    """Uniform grid over offgrid tiles. Each tile is listed in every cell its image overlaps."""
+    def __init__(self, get_size, cell_size=256):
+        self.get_size = get_size
+        self.cell_size = cell_size
+        self.cells = {}  # {(cx, cy): [entry ...]}
+        self.types = {}  # {(type, variant): {id(tile): entry}}
+        self.entries = {}  # {id(tile): entry}, entry: (order, rect, tile, (type, variant)). in offgrid list order.
+        self.next_order = 0
+
+    def rect_cells(self, rect):
+        cells = []
+        for cx in range(rect.left // self.cell_size, (rect.right - 1) // self.cell_size + 1):
+            for cy in range(rect.top // self.cell_size, (rect.bottom - 1) // self.cell_size + 1):
+                cells.append((cx, cy))
+        return cells
+
+    def add(self, tile):
+        rect = pg.Rect(tile['pos'], self.get_size(tile))
+        entry = (self.next_order, rect, tile, (tile['type'], tile['variant']))
+        self.next_order += 1
+        self.entries[id(tile)] = entry
+        for cell in self.rect_cells(rect):
+            self.cells.setdefault(cell, []).append(entry)
+        self.types.setdefault(entry[3], {})[id(tile)] = entry
+        return rect
+
+    def remove(self, tile):
+        entry = self.entries.pop(id(tile))
+        for cell in self.rect_cells(entry[1]):
+            self.cells[cell].remove(entry)
+            if not self.cells[cell]:
+                del self.cells[cell]
+        del self.types[entry[3]][id(tile)]
+        return entry[1]
+
+    def tiles(self):
+        return [entry[2] for entry in self.entries.values()]
+
+    def query_rect(self, rect):
+        # tiles overlapping rect, in offgrid list order.
+        rect = pg.Rect(rect)
+        found = {}
+        for cell in self.rect_cells(rect):
+            for entry in self.cells.get(cell, ()):
+                if entry[0] not in found and entry[1].colliderect(rect):
+                    found[entry[0]] = entry[2]
+        return [found[order] for order in sorted(found)]
+
+    def query_type(self, t_type, variant=None):
+        # every variant of t_type when variant is None, in offgrid list order.
+        if variant is not None:
+            return [entry[2] for entry in self.types.get((t_type, variant), {}).values()]
+        entries = []
+        for (e_type, e_variant), type_entries in self.types.items():
+            if e_type == t_type:
+                entries.extend(type_entries.values())
+        entries.sort(key=lambda entry: entry[0])
+        return [entry[2] for entry in entries]
 
 
 class Tilemap:
     def __init__(self, game, tile_size=16):
         self.game = game
         self.tile_size = tile_size
-        self.tilemap = {}
-        self.offgrid_tiles = []
-    
-    def copy(self):
-        return copy.deepcopy(self.tilemap), copy.deepcopy(self.offgrid_tiles)
+        self.grid = TileGrid()
+        self.collision_grid = None
+        self.line_of_sight = None
+        # [{'variant': ..., 'pos': [x, y]} ...] in px, kept out of the grid.
+        self.spawnpoints = []
+        # what the map was generated from, None for maps loaded from a file.
+        self.seed = None
+        self.length = None
+
+        # pre-rendered chunk surfaces, offgrid tiles are baked into every chunk they overlap.
+        self.chunk_px = CHUNK_SIZE * tile_size
+        self.chunk_surfs = {}
+        self.dirty_chunks = set()
+        self.baked = False
+
+        self.set_offgrid([])
+
+    def snapshot(self):
+        # (grid, offgrid tiles, spawnpoints) as they are now, the grid is copy on write and offgrid tiles are never changed in place.
+        return self.grid.snapshot(), self.get_offgrid_tiles(), list(self.spawnpoints)
 
     def load(self, path):
-        with open(path, 'r') as f:
-            map_data = json.load(f)
-            self.tilemap = map_data['tilemap']
-            self.offgrid_tiles = map_data['offgrid']
+        # binary map files, or the json ones from before them.
+        spawnpoints = None
+        if is_map_file(path):
+            palette, chunks, chunk_area, offgrid_tiles, spawnpoints = read_map(path)
+            if chunks and chunk_area != CHUNK_AREA:
+                raise ValueError('%s has %d tiles per chunk, not %d' % (path, chunk_area, CHUNK_AREA))
+            self.grid = TileGrid.from_chunks(palette, chunks)
+            self.set_offgrid(offgrid_tiles)
+        else:
+            with open(path, 'r') as f:
+                map_data = json.load(f)
+                self.grid = TileGrid.from_legacy(map_data['tilemap'])
+                self.set_offgrid(map_data['offgrid'])
+        self.collision_grid = None
+        self.line_of_sight = None
+        self.seed = None
+        self.length = None
+        # older files keep the spawnpoints as tiles.
+        if spawnpoints is None:
+            self.index_spawnpoints()
+        else:
+            self.spawnpoints = spawnpoints
+        self.bake()
+
+    def get_offgrid_size(self, tile):
+        return self.game.tile_dict[tile['type']][tile['variant']].get_size()
+
+    def set_offgrid(self, tiles):
+        # the index is the only copy of the list, tiles are added and removed through it.
+        self.offgrid_index = OffgridIndex(self.get_offgrid_size, self.chunk_px)
+        for tile in tiles:
+            self.offgrid_index.add(tile)
+        self.baked = False
+
+    def get_offgrid_tiles(self):
+        # a new list, in draw / save order.
+        return self.offgrid_index.tiles()
+
+    def add_offgrid(self, tile):
+        self.invalidate_rect(self.offgrid_index.add(tile))
+
+    def remove_offgrid(self, tile):
+        self.invalidate_rect(self.offgrid_index.remove(tile))
 
     def get_map_edges(self):
-        x_coords = set()
-        y_coords = set()
-        for tile_info in self.tilemap.values():
-            pos = tile_info['pos']
-            x_coords.add(pos[0])
-            y_coords.add(pos[1])
-        max_right = max(x_coords) * 16
-        max_left = min(x_coords) * 16
-        max_down = max(y_coords) * 16
+        min_x, min_y, max_x, max_y = self.grid.bounds()
+        max_right = max_x * 16
+        max_left = min_x * 16
+        max_down = max_y * 16
         return max_right, max_left, max_down
 
-        
+    def to_legacy(self) -> dict:
+        return {'tilemap': self.grid.to_legacy(), 'offgrid': self.get_offgrid_tiles()}
+
     def save(self, filepath):
-        with open(filepath, 'w') as f:
-            json.dump({'tilemap': self.tilemap, 'offgrid': self.offgrid_tiles}, f)
+        write_map(filepath, self.grid, self.get_offgrid_tiles(), self.spawnpoints)
+
+    def index_spawnpoints(self, locs=None):
+        # moves the spawnpoint tiles at locs out of the map into self.spawnpoints, in grid order. None searches the whole map.
+        if locs is None:
+            self.spawnpoints = self.extract(SPAWNPOINT_PAIRS)
+            return
+        grid = self.grid
+        chunk_order = {chunk_key: i for i, chunk_key in enumerate(grid.chunks)}
+        locs = [loc for loc in set(locs) if grid.get_type(loc[0], loc[1]) == 'spawnpoint']
+        locs.sort(key=lambda loc: (chunk_order[(loc[0] >> CHUNK_SHIFT, loc[1] >> CHUNK_SHIFT)], loc[1] & CHUNK_MASK, loc[0] & CHUNK_MASK))
+        spawnpoints = []
+        for x, y in locs:
+            spawnpoints.append({'variant': grid.get(x, y)[1], 'pos': [x * self.tile_size, y * self.tile_size]})
+            grid.remove(x, y)
+            self.invalidate(x, y)
+        self.spawnpoints = spawnpoints
+
+    def apply_delta(self, player_pos, removed, opened):
+        # a saved run on a regenerated map: removed / opened are spawnpoint indices, see save_current_map.
+        for spawnpoint in self.spawnpoints:
+            if spawnpoint['variant'] == 0:
+                spawnpoint['pos'] = list(player_pos)
+        for index in removed:
+            self.spawnpoints[index]['removed'] = True
+        for index in opened:
+            self.spawnpoints[index]['opened'] = True
+
+    def take_spawnpoints(self):
+        # handed over once, the entities made from them are what gets saved after that.
+        spawnpoints, self.spawnpoints = self.spawnpoints, []
+        return spawnpoints
 
     def extract(self, tv_pairs: list, keep=False):
         matches = []
-        for tile in self.offgrid_tiles.copy():
-            if (tile['type'], tile['variant']) in tv_pairs:
+        for t_type, variant in tv_pairs:
+            for tile in self.offgrid_index.query_type(t_type, variant):
                 matches.append(tile.copy())
                 if not keep:
-                    self.offgrid_tiles.remove(tile)
-        for loc in copy.deepcopy(self.tilemap):
-            tile = self.tilemap[loc]
-            if (tile['type'], tile['variant']) in tv_pairs:
-                matches.append(tile)
-                matches[-1]['pos'][0] *= self.tile_size
-                matches[-1]['pos'][1] *= self.tile_size
+                    self.remove_offgrid(tile)
+        tile_ids = [self.grid.palette_ids[tile] for tile in map(tuple, tv_pairs) if tile in self.grid.palette_ids]
+        if not tile_ids:
+            return matches
+        # only the matching cells are visited, in the same chunk and cell order as grid.items().
+        for (cx, cy), chunk in list(self.grid.chunks.items()):
+            cells = np.frombuffer(chunk, np.uint16)
+            for index in np.flatnonzero(np.isin(cells, tile_ids)).tolist():
+                x = (cx << CHUNK_SHIFT) + (index & CHUNK_MASK)
+                y = (cy << CHUNK_SHIFT) + (index >> CHUNK_SHIFT)
+                t_type, variant = self.grid.palette[cells[index]]
+                matches.append({'type': t_type, 'variant': variant, 'pos': [x * self.tile_size, y * self.tile_size]})
                 if not keep:
-                    del self.tilemap[loc]
+                    self.grid.remove(x, y)
+                    self.invalidate(x, y)
         return matches
 
-    
+    def solid_at(self, x, y):
+        return self.grid.get_type(x, y) in PHYSICS_TILES
+
+    def get_collision_grid(self):
+        # built on first use after the map is generated or loaded.
+        if self.collision_grid is None:
+            self.collision_grid = CollisionGrid.from_tilegrid(self.grid, PHYSICS_TILES, self.tile_size)
+        return self.collision_grid
+
+    def get_line_of_sight(self):
+        collision_grid = self.get_collision_grid()
+        if self.line_of_sight is None or self.line_of_sight.grid is not collision_grid:
+            self.line_of_sight = LineOfSight(collision_grid)
+        return self.line_of_sight
+
     def edge_check(self, mask_rect):
         left_check = False
         right_check = False
         check_below_l = (mask_rect.x // self.tile_size, mask_rect.bottom // self.tile_size + 1)
         check_below_r = (mask_rect.x // self.tile_size + 1, mask_rect.bottom // self.tile_size + 1)
         # check_below = [check_below_l, check_below_r]
-        left_tile_loc = str((int(check_below_l[0]), int(check_below_l[1])))
-        right_tile_loc = str((int(check_below_r[0]), int(check_below_r[1])))
-        if left_tile_loc not in self.tilemap:
+        if not self.grid.get_id(int(check_below_l[0]), int(check_below_l[1])):
             left_check = True
-        if right_tile_loc not in self.tilemap:
+        if not self.grid.get_id(int(check_below_r[0]), int(check_below_r[1])):
             right_check = True
         return left_check, right_check
-    
-
-    def neighbor_tiles(self, pos, size):
-        grid_pos = (int(pos.x // self.tile_size), int(pos.y // self.tile_size))
-        check_positions = [grid_pos]
-        if size[0] > self.tile_size and size[1] > self.tile_size:
-            check_positions.append((int(grid_pos[0] + size[0] // self.tile_size), int(grid_pos[1] + size[1] // self.tile_size)))
-        elif size[0] > self.tile_size:
-            extra_size_x = int(size[0] // self.tile_size)
-            for i in range(extra_size_x):
-                check_positions.append((grid_pos[0] + i + 1, grid_pos[1]))
-        elif size[1] > self.tile_size:
-            extra_size_y = int(size[1] // self.tile_size)
-            for i in range(extra_size_y):
-                check_positions.append((grid_pos[0], grid_pos[1] - i - 1))
-        tiles = []
-        for position in check_positions:
-            tile_loc = (position[0], position[1])
-            for offset in NEIGHBOR_OFFSETS:
-                check_loc = str((tile_loc[0] + offset[0], tile_loc[1] + offset[1]))
-                if check_loc in self.tilemap:
-                    tiles.append(self.tilemap[check_loc])
-        return tiles
-    
-    def neighbor_physics_rects(self, pos, size=(16, 16)):
-        rects = []
-        for tile in self.neighbor_tiles(pos, size):
-            if tile['type'] in PHYSICS_TILES:
-                rects.append(pg.Rect(tile['pos'][0] * self.tile_size, tile['pos'][1] * self.tile_size, self.tile_size, self.tile_size))
-        return rects
+
 
     def water_check(self, pos):
-        feet_tile_loc = str((pos[0], pos[1]))
-        if feet_tile_loc in self.tilemap and self.tilemap[feet_tile_loc]['type'] == 'water':
+        if self.grid.get_type(pos[0], pos[1]) == 'water':
             return pos
-    
+
+    def invalidate(self, x, y):
+        # tile coords, the chunk is re-baked the next time it is on screen.
+        self.dirty_chunks.add((x >> CHUNK_SHIFT, y >> CHUNK_SHIFT))
+        if self.collision_grid is not None:
+            solid = self.solid_at(x, y)
+            if bool(self.collision_grid.solid(x, y)) != solid:
+                self.collision_grid.set_solid(x, y, solid)
+                if self.line_of_sight is not None:
+                    self.line_of_sight.clear()
+
+    def autotile(self, region=None):
+        # region: (x, y, w, h) in tiles, after editing tiles pass the edited area grown by one tile on each side.
+        changed = autotile(self.grid, region)
+        for x, y in changed:
+            self.invalidate(x, y)
+        return changed
+
+    def set_tile(self, x, y, t_type, variant=0):
+        self.grid.set(x, y, t_type, variant)
+        self.invalidate(x, y)
+        self.autotile((x - 1, y - 1, 3, 3))
+
+    def remove_tile(self, x, y):
+        self.grid.remove(x, y)
+        self.invalidate(x, y)
+        self.autotile((x - 1, y - 1, 3, 3))
+
+    def invalidate_rect(self, rect):
+        # offgrid index cells line up with the chunks.
+        self.dirty_chunks.update(self.offgrid_index.rect_cells(rect))
+
+    def bake(self):
+        self.chunk_surfs = {}
+        self.dirty_chunks = set()
+        for chunk_key in set(self.grid.chunks) | set(self.offgrid_index.cells):
+            self.bake_chunk(chunk_key)
+        self.baked = True
+
+    def bake_chunk(self, chunk_key):
+        self.dirty_chunks.discard(chunk_key)
+        origin_x = chunk_key[0] * self.chunk_px
+        origin_y = chunk_key[1] * self.chunk_px
+        offgrid_tiles = self.offgrid_index.query_rect((origin_x, origin_y, self.chunk_px, self.chunk_px))
+        chunk = self.grid.chunks.get(chunk_key)
+        if not offgrid_tiles and (chunk is None or not any(chunk)):
+            self.chunk_surfs.pop(chunk_key, None)
+            return
+        chunk_surf = pg.Surface((self.chunk_px, self.chunk_px), pg.SRCALPHA)
+        tile_dict = self.game.tile_dict
+        for tile in offgrid_tiles:
+            chunk_surf.blit(tile_dict[tile['type']][tile['variant']], (tile['pos'][0] - origin_x, tile['pos'][1] - origin_y))
+        if chunk is not None:
+            palette = self.grid.palette
+            for index, tile_id in enumerate(chunk):
+                if tile_id:
+                    t_type, variant = palette[tile_id]
+                    chunk_surf.blit(tile_dict[t_type][variant], ((index & CHUNK_MASK) * self.tile_size, (index >> CHUNK_SHIFT) * self.tile_size))
+        self.chunk_surfs[chunk_key] = chunk_surf
+
     def render(self, surf, offset=(0, 0)):
-        for tile in self.offgrid_tiles:
-            surf.blit(self.game.tile_dict[tile['type']][tile['variant']], (tile['pos'][0] - offset[0], tile['pos'][1] - offset[1]))
-
-        for x in range(int(offset[0] // self.tile_size), (int(offset[0] + surf.get_width()) // self.tile_size + 1)):
-            for y in range(int(offset[1] // self.tile_size), (int(offset[1] + surf.get_height()) // self.tile_size + 1)):
-                loc = str((x, y))
-                if loc in self.tilemap:
-                    tile = self.tilemap[loc]
-                    surf.blit(self.game.tile_dict[tile['type']][tile['variant']], (tile['pos'][0] * self.tile_size - offset[0], tile['pos'][1] * self.tile_size - offset[1]))
-    
+        if not self.baked:
+            self.bake()
+        chunk_px = self.chunk_px
+        for cx in range(int(offset[0] // chunk_px), int((offset[0] + surf.get_width()) // chunk_px) + 1):
+            for cy in range(int(offset[1] // chunk_px), int((offset[1] + surf.get_height()) // chunk_px) + 1):
+                chunk_key = (cx, cy)
+                if chunk_key in self.dirty_chunks:
+                    self.bake_chunk(chunk_key)
+                chunk_surf = self.chunk_surfs.get(chunk_key)
+                if chunk_surf:
+                    surf.blit(chunk_surf, (cx * chunk_px - offset[0], cy * chunk_px - offset[1]))
 
@@ -1,6 +1,9 @@
 import json, glob, os
 import pygame as pg
-from scripts.tilemap import Tilemap
+from scripts.tilemap import TileGrid
+from scripts.mapfile import write_map, encode_map, encode_map_delta
+from scripts.map_generator import GENERATOR_VERSION
+from scripts.gameutils import get_mask_bounds, add_mask_bounds
 
 def get_lang_strings(filepath, language) -> dict:
     with open(filepath, 'r', encoding='utf-8') as f:
@@ -49,10 +52,21 @@ def get_animations(path, img_type, *args) -> dict:
             surf_list.append(img_surf)
         images_dict[action] = surf_list
     animations_dict = {}
-    for (action, length, loop) in args:
-        animations_dict[action] = (Animation(images_dict[action], length, loop))
+    # (action, length, loop) or (action, length, loop, rotation steps)
+    for (action, length, loop, *rotations) in args:
+        animations_dict[action] = (Animation(images_dict[action], length, loop, rotations=rotations[0] if rotations else 0))
     return animations_dict
 
+def get_image_variants(image, *variants) -> dict:
+    # {(flip, angle): (surf, mask)} for the orientations a single image is drawn in.
+    variants_dict = {}
+    for flip, angle in variants:
+        surf = pg.transform.rotate(pg.transform.flip(image, flip, False), angle) if angle else pg.transform.flip(image, flip, False)
+        mask = pg.mask.from_surface(surf)
+        add_mask_bounds(mask, get_mask_bounds(mask))
+        variants_dict[(flip, angle)] = (surf, mask)
+    return variants_dict
+
 def load_tiles(path) -> dict:
     root_dir = os.path.join(path, 'tiles')
     image_list = glob.glob('*/*.png', root_dir=root_dir)
@@ -85,39 +99,77 @@ def check_existing_save(save_folder, map_fn, data_fn):
 
 def save_current_map(game, save_dir, fn):
     path = os.path.join(save_dir, fn)
-    tilemap = Tilemap(game)
-    tilemap.tilemap, tilemap.offgrid_tiles = game.tilemap.copy()
-    player_pos = int(game.player.pos.x // 16), int(game.player.pos.y // 16)
-    player_loc = str(tuple(player_pos))
-    tilemap.tilemap[player_loc] = {"type": "spawnpoint", "variant": 0, "pos": [player_pos[0], player_pos[1]]}
+    player_pos = [int(game.player.pos.x // 16) * 16, int(game.player.pos.y // 16) * 16]
+    tilemap = game.tilemap
+    if tilemap.seed is not None:
+        # a generated map is saved as its seed and the spawnpoints that are gone / chests that are open since then.
+        removed = []
+        opened = []
+        for index, spawnpoint in enumerate(game.map_spawnpoints):
+            entity = game.spawned.get(index)
+            if spawnpoint['variant'] > 1 and (entity is None or not entity.alive()):
+                removed.append(index)
+            elif entity is not None and getattr(entity, 'interacted', False):
+                opened.append(index)
+        game.save_writer.write(path, lambda: encode_map_delta(GENERATOR_VERSION, tilemap.seed, tilemap.length, player_pos, removed, opened))
+        return path
+    # snapshotted here, encoded and written by the save writer.
+    grid, offgrid_tiles = tilemap.snapshot()[:2]
+    # the entities as they are now, snapped to the tile they are in.
+    spawnpoints = [{'variant': 0, 'pos': player_pos}]
     for enemy in game.enemies:
-        enemy_pos = int(enemy.pos.x // 16), int(enemy.pos.y // 16)
-        enemy_loc = str(tuple(enemy_pos))
-        tilemap.tilemap[enemy_loc] = {"type": "spawnpoint", "variant": enemy.variant, "pos": [enemy_pos[0], enemy_pos[1]]}
+        spawnpoints.append({'variant': enemy.variant, 'pos': [int(enemy.pos.x // 16) * 16, int(enemy.pos.y // 16) * 16]})
     for chest in game.chests:
-        chest_pos = int(chest.pos.x // 16), int(chest.pos.y // 16)
-        chest_loc = str(tuple(chest_pos))
-        tilemap.tilemap[chest_loc] = {"type": "spawnpoint", "variant": chest.variant, "pos": [chest_pos[0], chest_pos[1]]}
+        spawnpoints.append({'variant': chest.variant, 'pos': [int(chest.pos.x // 16) * 16, int(chest.pos.y // 16) * 16]})
     for portal in game.portals:
-        portal_pos = int(portal.pos.x // 16 + 1), int(portal.pos.y // 16)
-        portal_loc = str(tuple(portal_pos))
-        tilemap.tilemap[portal_loc] = {"type": "spawnpoint", "variant": 1, "pos": [portal_pos[0], portal_pos[1]]}
-    with open(path, 'w') as f:
-        json.dump({'tilemap': tilemap.tilemap, 'offgrid': tilemap.offgrid_tiles}, f)
+        spawnpoints.append({'variant': 1, 'pos': [int(portal.pos.x // 16 + 1) * 16, int(portal.pos.y // 16) * 16]})
+    game.save_writer.write(path, lambda: encode_map(grid, offgrid_tiles, spawnpoints))
     return path
 
+def import_legacy_map(json_path, path):
+    # a json map file from before the binary format is converted once, then removed.
+    with open(json_path, 'r') as f:
+        map_data = json.load(f)
+    write_map(path, TileGrid.from_legacy(map_data['tilemap']), map_data['offgrid'])
+    os.remove(json_path)
+
         
       
+def get_frame_atlas(images, rotations=0) -> dict:
+    # every frame pre-flipped (and pre-rotated in rotation steps if asked), with a mask and mask bounding rect per flip.
+    atlas = {'frames': {False: images, True: []}, 'masks': {False: [], True: []}, 'mask_rects': {False: [], True: []}, 'rotated': []}
+    for image in images:
+        atlas['frames'][True].append(pg.transform.flip(image, True, False))
+        for flip in (False, True):
+            mask = pg.mask.from_surface(atlas['frames'][flip][-1])
+            atlas['masks'][flip].append(mask)
+            # relative to the frame's topleft. collide_mask_bounds() looks them up by mask.
+            atlas['mask_rects'][flip].append(get_mask_bounds(mask))
+            add_mask_bounds(mask, atlas['mask_rects'][flip][-1])
+        if rotations:
+            atlas['rotated'].append([pg.transform.rotate(image, step * 360 / rotations) for step in range(rotations)])
+    return atlas
+
+
 class Animation:
-    def __init__(self, images, img_dur=5, loop=True):
+    def __init__(self, images, img_dur=5, loop=True, atlas=None, rotations=0):
         self.images = images
         self.loop = loop
         self.dur = img_dur
         self.done = False
         self.frame = 0
+        # built once when the animation is loaded, shared by every copy.
+        self.atlas = atlas if atlas else get_frame_atlas(images, rotations)
+        self.frames = self.atlas['frames']
+        self.masks = self.atlas['masks']
+        self.rotated = self.atlas['rotated']
     
     def copy(self):
-        return Animation(self.images, self.dur, self.loop)
+        return Animation(self.images, self.dur, self.loop, self.atlas)
+
+    def reset(self, frame=0):
+        self.frame = frame
+        self.done = False
     
     def update(self):
         total_frames = self.dur * len(self.images)
@@ -128,10 +180,18 @@ class Animation:
             if self.frame >= total_frames - 1:
                 self.done = True
     
-    def cur_img(self) -> pg.Surface:
+    def cur_img(self, flip=False) -> pg.Surface:
         # gets current image surface for frame.
         image_index = int(self.frame / self.dur)
-        return self.images[image_index]
+        return self.frames[flip][image_index]
+
+    def cur_rotated(self, angle) -> pg.Surface:
+        # current frame rotated by angle (degrees), snapped to the nearest rotation step.
+        steps = self.rotated[int(self.frame / self.dur)]
+        return steps[round(angle * len(steps) / 360) % len(steps)]
+
+    def cur_mask(self, flip=False) -> pg.mask.Mask:
+        return self.masks[flip][int(self.frame / self.dur)]
 
 
 
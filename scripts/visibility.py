@@ -0,0 +1,51 @@
+class LineOfSight:
+    """Tile line of sight over a CollisionGrid, cached per (from tile, to tile). Cleared when a tile's solidity changes."""
+    def __init__(self, collision_grid, max_entries=16384):
+        self.grid = collision_grid
+        self.cache = {}
+        self.max_entries = max_entries
+
+    def clear(self):
+        self.cache = {}
+
+    def visible(self, x1, y1, x2, y2):
+        key = (x1, y1, x2, y2)
+        result = self.cache.get(key)
+        if result is None:
+            if len(self.cache) >= self.max_entries:
+                self.cache = {}
+            result = self.cache[key] = self.trace(x1, y1, x2, y2)
+        return result
+
+    def visible_many(self, starts, end):
+        # [(x, y) ...] -> [bool ...], every start against the same end tile.
+        x2, y2 = end
+        visible = self.visible
+        return [visible(x1, y1, x2, y2) for x1, y1 in starts]
+
+    def trace(self, x1, y1, x2, y2):
+        # bresenham walk, every tile after the start one (the end one included) has to be clear.
+        grid = self.grid
+        cells = grid.cells
+        width = grid.width
+        height = grid.height
+        min_x = grid.min_x
+        min_y = grid.min_y
+        dx = abs(x2 - x1)
+        dy = abs(y2 - y1)
+        sx = 1 if x1 < x2 else -1
+        sy = 1 if y1 < y2 else -1
+        error = dx - dy
+        while x1 != x2 or y1 != y2:
+            double_error = error * 2
+            if double_error > -dy:
+                error -= dy
+                x1 += sx
+            if double_error < dx:
+                error += dx
+                y1 += sy
+            x = x1 - min_x
+            y = y1 - min_y
+            if 0 <= x < width and 0 <= y < height and cells[y * width + x]:
+                return False
+        return True
@@ -0,0 +1,41 @@
+import os, sys, unittest
+from types import SimpleNamespace
+from pygame import Vector2 as Vec
+
+# mgame finds its assets and saves from the working directory.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+import mgame
+
+
+@unittest.skipUnless(os.path.exists(os.path.join(mgame.SOUNDS_DIR, 'Pixel_3.wav')), 'the music tracks are not in this checkout')
+class DormantEnemyTest(unittest.TestCase):
+    def start_game(self):
+        game = mgame.Game(headless=True, seed=1)
+        game.start_game = True
+        while not game.playing:
+            game.tick()
+        # a few ticks for the activation zones to put the far enemies to sleep.
+        for i in range(5):
+            game.tick()
+        return game
+
+    def test_killed_while_dormant(self):
+        # e.g. by a fireball that kept flying, the kill is counted without the camera coming close.
+        game = self.start_game()
+        dormant = [enemy for enemy in game.enemies if enemy.dormant]
+        self.assertTrue(dormant)
+        enemy = dormant[0]
+        kills = game.killed_enemies['total']
+        enemy.get_hit(SimpleNamespace(damage=enemy.health, pos=Vec(enemy.pos)))
+        for i in range(600):
+            game.tick()
+            if enemy not in game.enemies:
+                break
+        self.assertNotIn(enemy, game.enemies)
+        self.assertEqual(game.killed_enemies['total'], kills + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()